@@ -3,7 +3,6 @@ AI AGENT - Agent thông minh tổng hợp với khả năng học tập
 """
 import os
 import sys
-import json
 import yaml
 import logging
 import tempfile
@@ -16,14 +15,43 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from memory.memory_system import MemorySystem
 
+# Schema output của sub-agent lập kế hoạch / đánh giá (dispatch_structured)
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "goal": {"type": "string"},
+        "steps": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+        "estimated_time": {"type": "string"},
+        "resources_needed": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["steps"]
+}
+
+REVIEW_CRITERIA = ["completeness", "accuracy", "clarity", "usefulness", "innovation"]
+
+REVIEW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "review": {
+            "type": "object",
+            "properties": {name: {"type": "number"} for name in REVIEW_CRITERIA},
+            "required": REVIEW_CRITERIA
+        },
+        "suggestions": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["review", "suggestions"]
+}
+
 class AIAgent:
     """AI Agent với khả năng học tập và tự cải thiện"""
     
-    def __init__(self, config_path: str = "config/permissions.yaml"):
+    def __init__(self, config_path: str = "config/permissions.yaml", dispatcher=None):
         self.logger = logging.getLogger(__name__)
         self.memory = MemorySystem()
         self.config = self._load_config(config_path)
         self.learning_history = []
+        # Mặc định dùng dispatcher chung của process (cùng cache, hàng đợi, breaker với Brain)
+        self._dispatcher = dispatcher
         
         # Khởi tạo các module con
         self._init_sub_agents()
@@ -43,6 +71,24 @@ class AIAgent:
                 }
             }
     
+    def _structured_call(self, task: Dict[str, Any], llm_type: str, instruction: str,
+                         schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Gọi LLM lấy output JSON theo schema, None nếu không có model hoặc output không hợp lệ"""
+        try:
+            if self._dispatcher is None:
+                from core_ai.llm_dispatcher import get_llm_dispatcher
+                self._dispatcher = get_llm_dispatcher()
+            result = self._dispatcher.dispatch_structured({
+                "llm_type": llm_type,
+                "intent": llm_type,
+                "language": task.get('language', 'vi'),
+                "user_input": instruction
+            }, schema)
+            return result.get('data')
+        except Exception as e:
+            self.logger.warning(f"Không thể gọi LLM có cấu trúc: {e}")
+            return None
+    
     def _init_sub_agents(self):
         """Khởi tạo các sub-agent (virtual)"""
         self.sub_agents = {
@@ -143,7 +189,12 @@ class AIAgent:
         user_input = task.get('user_input', '')
         
         # Truy xuất memory liên quan
-        related_memories = self.memory.retrieve_long_term(keyword=user_input[:20])
+        related_memories = self.memory.retrieve_long_term(keyword=user_input, limit=10)
+        
+        generated = self._structured_call(
+            task, "reasoning",
+            f"Lập kế hoạch thực hiện từng bước cho mục tiêu sau: {user_input}", PLAN_SCHEMA
+        )
         
         plan = {
             "goal": user_input,
@@ -159,6 +210,9 @@ class AIAgent:
             "resources_needed": ["Thông tin đầu vào", "Công cụ hỗ trợ", "Nhân lực (nếu cần)"],
             "related_memories": len(related_memories)
         }
+        if generated:
+            plan.update({k: v for k, v in generated.items() if k in PLAN_SCHEMA['properties'] and v})
+            plan['source'] = "llm"
         
         # Lưu vào long-term memory
         self.memory.save_long_term(
@@ -180,12 +234,16 @@ class AIAgent:
         # Tìm trong documents
         documents = self.memory.search_documents(user_input, max_results=3)
         
+        # Tìm theo ngữ nghĩa trong vector store (rỗng nếu chưa có embedding)
+        passages = self.memory.similarity_search(user_input, k=5)
+        
         # Tìm trong memory
-        memories = self.memory.retrieve_long_term(keyword=user_input)
+        memories = self.memory.retrieve_long_term(keyword=user_input, limit=10)
         
         research_result = {
             "topic": user_input,
             "documents_found": len(documents),
+            "semantic_matches": len(passages),
             "memories_found": len(memories),
             "sources": [doc.get('metadata', {}).get('source', 'unknown') for doc in documents],
             "key_points": [
@@ -205,6 +263,8 @@ class AIAgent:
             "research": research_result,
             "documents_preview": [{"id": d["id"][:8], "source": d.get("metadata", {}).get("source", "unknown")} 
                                 for d in documents[:2]],
+            "passages_preview": [{"id": p["doc_id"][:8], "score": p["score"], "text": p["text"][:200]}
+                               for p in passages[:3]],
             "agent": "researcher"
         }
     
@@ -362,6 +422,17 @@ print(process_data([1, 2, 3, 4, 5]))'''
             "Cấu trúc lại cho logic hơn"
         ]
         
+        generated = self._structured_call(
+            task, "reasoning",
+            "Đánh giá nội dung sau, chấm mỗi tiêu chí "
+            f"({', '.join(REVIEW_CRITERIA)}) từ 0 đến 1 và đưa ra gợi ý cải thiện:\n{content}",
+            REVIEW_SCHEMA
+        )
+        if generated:
+            review_criteria = {name: min(max(float(generated['review'][name]), 0.0), 1.0)
+                               for name in REVIEW_CRITERIA}
+            suggestions = generated['suggestions'] or suggestions
+        
         return {
             "response": f"Đã đánh giá nội dung ({len(content)} ký tự)",
             "review": review_criteria,
@@ -512,7 +583,7 @@ print(process_data([1, 2, 3, 4, 5]))'''
         
         if action == 'query':
             results = self.memory.search_documents(query, max_results=5)
-            memories = self.memory.retrieve_long_term(keyword=query)
+            memories = self.memory.retrieve_long_term(keyword=query, limit=10)
             
             return {
                 "response": f"Tìm thấy {len(results)} tài liệu và {len(memories)} ký ức",
@@ -525,12 +596,7 @@ print(process_data([1, 2, 3, 4, 5]))'''
         elif action == 'stats':
             # Lấy thống kê
             try:
-                index_file = self.memory.base_path / "memory_index.json"
-                if index_file.exists():
-                    with open(index_file, 'r', encoding='utf-8') as f:
-                        stats = json.load(f)
-                else:
-                    stats = {"error": "Không tìm thấy index"}
+                stats = self.memory.get_stats()
                 
                 return {
                     "response": "Thống kê bộ nhớ hệ thống",
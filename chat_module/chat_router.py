@@ -2,7 +2,7 @@
 Định tuyến chat đến core_ai
 """
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Optional
 from core_ai.brain import Brain
 
 class ChatRouter:
@@ -10,12 +10,13 @@ class ChatRouter:
         self.brain = Brain()
         self.logger = logging.getLogger(__name__)
     
-    def route(self, user_input: str) -> Dict[str, Any]:
+    def route(self, user_input: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Định tuyến input người dùng qua toàn bộ pipeline
         
         Args:
             user_input: Input từ người dùng
+            session_id: ID hội thoại - các lượt cùng session dùng chung lịch sử với LLM
             
         Returns:
             Kết quả xử lý
@@ -24,33 +25,89 @@ class ChatRouter:
             self.logger.info(f"Routing input: {user_input[:50]}...")
             
             # 1. Chuẩn hóa task
-            task = self._normalize_task(user_input)
+            task = self._normalize_task(user_input, session_id)
             
             # 2. Gửi đến Brain xử lý
             result = self.brain.process(task)
             
             # 3. Thêm thông tin routing
-            result['routing_info'] = {
-                'input_length': len(user_input),
-                'task_type': task.get('intent', 'unknown')
-            }
+            return self._with_routing_info(result, user_input, task)
             
-            return result
+        except Exception as e:
+            self.logger.error(f"Lỗi routing: {e}")
+            return self._routing_error(e)
+    
+    async def aroute(self, user_input: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Bản async của route() - nhiều phiên có thể chờ LLM cùng lúc
+        
+        Args:
+            user_input: Input từ người dùng
+            session_id: ID hội thoại
+            
+        Returns:
+            Kết quả xử lý (cùng cấu trúc với route)
+        """
+        try:
+            self.logger.info(f"Routing input (async): {user_input[:50]}...")
+            
+            task = self._normalize_task(user_input, session_id)
+            result = await self.brain.aprocess(task)
+            return self._with_routing_info(result, user_input, task)
             
         except Exception as e:
             self.logger.error(f"Lỗi routing: {e}")
-            return {
-                "status": "error",
-                "error": f"Lỗi định tuyến: {str(e)}",
-                "fallback": "Xin lỗi, tôi không thể xử lý yêu cầu này ngay lúc này."
-            }
+            return self._routing_error(e)
+    
+    def route_stream(self, user_input: str, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Định tuyến input và trả kết quả dạng stream
+        
+        Args:
+            user_input: Input từ người dùng
+            session_id: ID hội thoại
+            
+        Yields:
+            Các chunk text ({"chunk", "model", "done": False}),
+            event cuối cùng ({"done": True, ...}) có cấu trúc giống route()
+        """
+        try:
+            self.logger.info(f"Routing input (stream): {user_input[:50]}...")
+            
+            task = self._normalize_task(user_input, session_id)
+            
+            for event in self.brain.process_stream(task):
+                if event.get('done'):
+                    event = self._with_routing_info(event, user_input, task)
+                yield event
+            
+        except Exception as e:
+            self.logger.error(f"Lỗi routing: {e}")
+            yield {"done": True, **self._routing_error(e)}
+    
+    def _with_routing_info(self, result: Dict[str, Any], user_input: str,
+                           task: Dict[str, Any]) -> Dict[str, Any]:
+        """Gắn thông tin routing vào kết quả"""
+        result['routing_info'] = {
+            'input_length': len(user_input),
+            'task_type': task.get('intent', 'unknown')
+        }
+        return result
+    
+    def _routing_error(self, error: Exception) -> Dict[str, Any]:
+        return {
+            "status": "error",
+            "error": f"Lỗi định tuyến: {str(error)}",
+            "fallback": "Xin lỗi, tôi không thể xử lý yêu cầu này ngay lúc này."
+        }
     
-    def _normalize_task(self, user_input: str) -> Dict[str, Any]:
+    def _normalize_task(self, user_input: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Chuẩn hóa input thành task cho core_ai
         
         Args:
             user_input: Input thô từ người dùng
+            session_id: ID hội thoại (nếu có)
             
         Returns:
             Task đã chuẩn hóa
@@ -71,7 +128,8 @@ class ChatRouter:
             "intent": intent_info["intent"],
             "confidence": intent_info["confidence"],
             "source": "chat_interface",
-            "requires_response": True
+            "requires_response": True,
+            "session_id": session_id
         }
         
         return task
\ No newline at end of file
@@ -4,6 +4,8 @@
 import logging
 from typing import Dict, Any
 
+from core_ai.stream_processor import split_sentences
+
 def format_response(result: Dict[str, Any]) -> str:
     """
     Định dạng kết quả từ Brain thành phản hồi tự nhiên
@@ -40,9 +42,9 @@ def format_response(result: Dict[str, Any]) -> str:
             formatted = response_text
         else:
             # Response dài - thêm định dạng
-            sentences = response_text.split('. ')
+            sentences = split_sentences(response_text)
             if len(sentences) > 1:
-                formatted = '.\n\n'.join(sentences[:3]) + '.'
+                formatted = '\n\n'.join(sentences[:3])
                 if len(sentences) > 3:
                     formatted += '...'
             else:
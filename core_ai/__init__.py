@@ -5,5 +5,6 @@ Tuyệt đối không sửa đổi nội dung trong thư mục này
 from .brain import Brain
 from .reasoning_engine import ReasoningEngine
 from .llm_dispatcher import LLMDispatcher
+from .async_dispatcher import AsyncLLMDispatcher
 
-__all__ = ['Brain', 'ReasoningEngine', 'LLMDispatcher']
\ No newline at end of file
+__all__ = ['Brain', 'ReasoningEngine', 'LLMDispatcher', 'AsyncLLMDispatcher']
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+ASYNC BRIDGE - Chạy pipeline async từ code đồng bộ
+Một event loop nền dùng chung cho cả process; API sync (dispatch, dispatch_stream...)
+chỉ gửi coroutine sang loop này rồi chờ kết quả
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+
+class LoopRunner:
+    """Event loop chạy trong daemon thread riêng"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="llm-event-loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, awaitable: Awaitable) -> Any:
+        """
+        Chạy coroutine trên loop nền và chờ kết quả
+
+        Task được tạo trong bản sao context của thread gọi nên contextvars
+        (vd. lane ưu tiên) đi theo request
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Không thể gọi API sync từ trong event loop nền, hãy dùng API async")
+
+        async def wrapper():
+            return await awaitable
+
+        future = asyncio.run_coroutine_threadsafe(wrapper(), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # Caller bị ngắt (Ctrl+C) -> hủy task để giải phóng slot và kết nối
+            future.cancel()
+            raise
+
+    def iterate(self, stream: AsyncIterator) -> Iterator:
+        """Bản sync của async generator: mỗi lần next() chạy một bước trên loop nền"""
+
+        async def step():
+            try:
+                return True, await stream.__anext__()
+            except StopAsyncIteration:
+                return False, None
+
+        try:
+            while True:
+                has_item, item = self.run(step())
+                if not has_item:
+                    return
+                yield item
+        finally:
+            # Người đọc dừng sớm (break / close) -> đóng generator, kết nối HTTP được trả lại
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                self.run(aclose())
+
+
+_runner: Optional[LoopRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_loop_runner() -> LoopRunner:
+    """Event loop nền dùng chung của process (khởi động ở lần gọi đầu)"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = LoopRunner()
+    return _runner
@@ -0,0 +1,9 @@
+"""
+ASYNC LLM DISPATCHER - Dispatcher không chặn cho nhiều phiên đồng thời
+Pipeline async (adispatch, adispatch_stream, adispatch_structured) nằm trong LLMDispatcher;
+API sync của LLMDispatcher chỉ chạy pipeline đó trên event loop nền (async_bridge)
+"""
+from .llm_dispatcher import LLMDispatcher
+
+# Giữ tên cũ cho code gọi API async
+AsyncLLMDispatcher = LLMDispatcher
@@ -2,17 +2,20 @@
 BRAIN - Bộ não điều phối trung tâm
 Chỉ nhận task đã chuẩn hóa, không biết UI/CLI/Web
 """
+import asyncio
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Iterator
 # THÊM IMPORT TẠI ĐÂY - TRƯỚC KHI SỬ DỤNG
 from .reasoning_engine import ReasoningEngine
-from .llm_dispatcher import LLMDispatcher
+from .llm_dispatcher import get_llm_dispatcher
 
 class Brain:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.reasoning_engine = ReasoningEngine()
-        self.llm_dispatcher = LLMDispatcher()
+        # Dispatcher dùng chung của process: process() là wrapper sync của pipeline async
+        self.llm_dispatcher = get_llm_dispatcher()
+        self._memory = None
         
     def process(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -30,20 +33,102 @@ class Brain:
             # 1. Reasoning - Phân tích và lập kế hoạch
             plan = self.reasoning_engine.analyze(task)
             
-            # 2. Dispatch - Phân phối cho LLM phù hợp
+            # 2. Retrieve - Kèm tài liệu liên quan từ memory
+            self._attach_documents(plan)
+            
+            # 3. Dispatch - Phân phối cho LLM phù hợp
             result = self.llm_dispatcher.dispatch(plan)
             
             self.logger.info(f"Brain hoàn thành task")
-            return {
-                "status": "success",
-                "result": result,
-                "plan": plan
-            }
+            return self._success(result, plan)
             
         except Exception as e:
             self.logger.error(f"Lỗi trong Brain.process: {str(e)}")
-            return {
-                "status": "error",
-                "error": str(e),
-                "fallback": "Hệ thống đang gặp sự cố. Vui lòng thử lại."
-            }
\ No newline at end of file
+            return self._error(e)
+    
+    async def aprocess(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Bản async của process() - không chặn event loop khi chờ LLM
+        
+        Args:
+            task: Task đã chuẩn hóa từ chat_module
+            
+        Returns:
+            Kết quả xử lý (cùng cấu trúc với process)
+        """
+        try:
+            self.logger.info(f"Brain nhận task (async): {task.get('intent', 'unknown')}")
+            
+            plan = self.reasoning_engine.analyze(task)
+            # Truy xuất memory (SQLite, embedding) là I/O đồng bộ nên chạy ngoài event loop
+            await asyncio.to_thread(self._attach_documents, plan)
+            result = await self.llm_dispatcher.adispatch(plan)
+            
+            self.logger.info(f"Brain hoàn thành task")
+            return self._success(result, plan)
+            
+        except Exception as e:
+            self.logger.error(f"Lỗi trong Brain.aprocess: {str(e)}")
+            return self._error(e)
+    
+    def _attach_documents(self, plan: Dict[str, Any]):
+        """Gắn tài liệu liên quan trong memory vào plan['documents'] (lỗi truy xuất không chặn task)"""
+        try:
+            documents = self._get_memory().retrieve_context(plan.get('user_input', ''),
+                                                            plan.get('intent', 'chat'))
+        except Exception as e:
+            self.logger.warning(f"Không thể truy xuất tài liệu: {e}")
+            return
+        if documents:
+            plan['documents'] = documents
+            self.logger.info(f"📚 Kèm {len(documents)} tài liệu vào prompt")
+    
+    def _get_memory(self):
+        """MemorySystem nạp khi cần để Brain khởi động không phụ thuộc storage"""
+        if self._memory is None:
+            from memory.memory_system import MemorySystem
+            self._memory = MemorySystem()
+        return self._memory
+    
+    def _success(self, result: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "status": "success",
+            "result": result,
+            "plan": plan
+        }
+    
+    def _error(self, error: Exception) -> Dict[str, Any]:
+        return {
+            "status": "error",
+            "error": str(error),
+            "fallback": "Hệ thống đang gặp sự cố. Vui lòng thử lại."
+        }
+    
+    def process_stream(self, task: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Xử lý task như process() nhưng trả token ngay khi LLM sinh ra
+        
+        Args:
+            task: Task đã chuẩn hóa từ chat_module
+            
+        Yields:
+            {"chunk": str, "model": str, "done": False} cho từng đoạn text,
+            cuối cùng {"done": True, ...kết quả giống process()}
+        """
+        try:
+            self.logger.info(f"Brain nhận task (stream): {task.get('intent', 'unknown')}")
+            
+            plan = self.reasoning_engine.analyze(task)
+            self._attach_documents(plan)
+            
+            for event in self.llm_dispatcher.dispatch_stream(plan):
+                if not event.get('done'):
+                    yield event
+                    continue
+                
+                self.logger.info(f"Brain hoàn thành task")
+                yield {"done": True, **self._success(event['result'], plan)}
+            
+        except Exception as e:
+            self.logger.error(f"Lỗi trong Brain.process_stream: {str(e)}")
+            yield {"done": True, **self._error(e)}
\ No newline at end of file
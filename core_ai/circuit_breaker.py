@@ -0,0 +1,158 @@
+"""
+CIRCUIT BREAKER - Theo dõi sức khỏe từng model Ollama
+Cửa sổ trượt tỉ lệ lỗi/độ trễ; mạch mở thì bỏ qua model ngay, half-open để thử lại
+"""
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_BREAKER_CONFIG = {
+    "enabled": True,
+    "window_size": 20,              # Số lời gọi gần nhất được xét
+    "min_requests": 4,              # Cần đủ số lời gọi này mới đánh giá tỉ lệ
+    "error_rate_threshold": 0.5,
+    "slow_call_seconds": 90,        # Lời gọi chậm hơn mức này tính là chậm
+    "slow_call_rate_threshold": 0.8,
+    "open_seconds": 30              # Thời gian mở mạch trước khi thử half-open
+}
+
+
+class CircuitOpenError(Exception):
+    """Model đang bị ngắt mạch"""
+
+
+class CircuitBreaker:
+    """Circuit breaker cho một model"""
+
+    def __init__(self, model: str, config: Dict[str, Any]):
+        self.logger = logging.getLogger(__name__)
+        self.model = model
+        self.config = config
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        # Mỗi phần tử: (thành công?, độ trễ giây)
+        self._window: deque = deque(maxlen=config['window_size'])
+        self._lock = threading.Lock()
+
+    def is_available(self) -> bool:
+        """Model có thể được chọn không (không chiếm lượt probe)"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.time() - self.opened_at >= self.config['open_seconds']
+            if self.state == HALF_OPEN:
+                return not self._probe_in_flight
+            return True
+
+    def allow_request(self) -> bool:
+        """Xin phép gửi request; ở half-open chỉ cho một probe tại một thời điểm"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.config['open_seconds']:
+                    return False
+                self.state = HALF_OPEN
+                self.logger.info(f"🔌 {self.model}: half-open, gửi probe")
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self, latency: float):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.logger.info(f"🔌 {self.model}: probe thành công, đóng mạch")
+                self.state = CLOSED
+                self._probe_in_flight = False
+                self._window.clear()
+            self._window.append((True, latency))
+            self._evaluate()
+
+    def record_failure(self, latency: float):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._open()
+                return
+            self._window.append((False, latency))
+            self._evaluate()
+
+    def release_probe(self):
+        """Probe bị hủy giữa chừng (vd. thua hedge) - không tính thành công hay lỗi"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _evaluate(self):
+        """Mở mạch nếu tỉ lệ lỗi hoặc tỉ lệ gọi chậm vượt ngưỡng (gọi khi giữ lock)"""
+        if self.state != CLOSED or len(self._window) < self.config['min_requests']:
+            return
+
+        total = len(self._window)
+        errors = sum(1 for ok, _ in self._window if not ok)
+        slow = sum(1 for _, latency in self._window if latency >= self.config['slow_call_seconds'])
+
+        if (errors / total >= self.config['error_rate_threshold']
+                or slow / total >= self.config['slow_call_rate_threshold']):
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.logger.warning(f"🔌 {self.model}: mở mạch trong {self.config['open_seconds']}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = len(self._window)
+            latencies = sorted(latency for _, latency in self._window)
+            return {
+                "state": self.state,
+                "calls": total,
+                "error_rate": round(sum(1 for ok, _ in self._window if not ok) / total, 3) if total else 0.0,
+                "p50_latency": round(latencies[total // 2], 2) if total else None
+            }
+
+
+class CircuitBreakerRegistry:
+    """Quản lý circuit breaker cho tất cả model"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(DEFAULT_BREAKER_CONFIG)
+        self.config.update(config or {})
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def get(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = CircuitBreaker(model, self.config)
+                self._breakers[model] = breaker
+            return breaker
+
+    def is_available(self, model: str) -> bool:
+        return not self.enabled or self.get(model).is_available()
+
+    def acquire(self, model: str) -> Optional[CircuitBreaker]:
+        """Lấy breaker để ghi nhận kết quả; ném CircuitOpenError nếu mạch đang mở"""
+        if not self.enabled:
+            return None
+        breaker = self.get(model)
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"Model {model} đang bị ngắt mạch")
+        return breaker
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.model: breaker.snapshot() for breaker in breakers}
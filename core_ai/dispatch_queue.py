@@ -0,0 +1,256 @@
+"""
+DISPATCH QUEUE - Hàng đợi request theo model trước Ollama
+Giới hạn số request đồng thời mỗi model (OLLAMA_NUM_PARALLEL trên mỗi host), ưu tiên theo lane,
+gộp các prompt giống nhau đang chạy thành một lần sinh
+"""
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Lane nhỏ hơn được phục vụ trước
+PRIORITY_LANES = {
+    "interactive": 0,   # Chat trực tiếp với user
+    "research": 1,      # Nghiên cứu / web search
+    "background": 2     # Học, tác vụ nền
+}
+
+DEFAULT_QUEUE_CONFIG = {
+    "enabled": True,
+    "num_parallel": 1,          # Bị ghi đè bởi biến môi trường OLLAMA_NUM_PARALLEL nếu có
+    "coalesce": True
+}
+
+# Lane của request hiện tại - đặt ở đầu dispatch, tự truyền sang task asyncio con
+current_lane: contextvars.ContextVar = contextvars.ContextVar('dispatch_lane', default='interactive')
+
+
+class _Waiter:
+    """Một coroutine đang chờ slot (có thể thuộc event loop khác với coroutine cấp slot)"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.granted = False
+        self.abandoned = False
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def grant(self):
+        """Cấp slot (gọi khi giữ lock của queue)"""
+        self.granted = True
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class ModelQueue:
+    """
+    Slot gọi đồng thời cho một model, cấp theo (lane, thứ tự đến)
+
+    Mỗi host có model được limit slot: nhiều host thì tổng số slot tăng theo
+    """
+
+    def __init__(self, model: str, limit: int, hosts: Optional[Callable[[str], int]] = None):
+        self.model = model
+        self.limit = max(1, limit)
+        self._hosts = hosts
+        self.active = 0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    async def aacquire(self, lane: str):
+        waiter = self._enqueue(lane, asyncio.get_running_loop())
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    # Đã được cấp slot nhưng bị hủy trước khi dùng - trả lại
+                    self.active -= 1
+                    self._grant_next()
+                else:
+                    waiter.abandoned = True
+            raise
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            self._grant_next()
+
+    def _enqueue(self, lane: str, loop: asyncio.AbstractEventLoop) -> _Waiter:
+        waiter = _Waiter(loop)
+        with self._lock:
+            priority = PRIORITY_LANES.get(lane, PRIORITY_LANES['interactive'])
+            heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+            self._grant_next()
+        return waiter
+
+    def capacity(self) -> int:
+        """Tổng số slot: limit x số host khỏe đang có model (ít nhất limit)"""
+        hosts = self._hosts(self.model) if self._hosts is not None else 1
+        return self.limit * max(1, hosts)
+
+    def _grant_next(self):
+        """Cấp slot cho các request đứng đầu hàng đợi (gọi khi giữ lock)"""
+        capacity = self.capacity()
+        while self._waiters and self.active < capacity:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if waiter.abandoned:
+                continue
+            self.active += 1
+            waiter.grant()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"active": self.active, "capacity": self.capacity(),
+                    "waiting": sum(1 for *_, w in self._waiters if not w.abandoned)}
+
+
+class _Flight:
+    """Một lần sinh đang chạy, các request trùng chờ chung kết quả"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def finish(self, result: Any, error: Optional[BaseException]):
+        with self._lock:
+            self.result, self.error = result, error
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    async def await_result(self) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        with self._lock:
+            if self.done.is_set():
+                future.set_result(True)
+            else:
+                self._callbacks.append(notify)
+        await future
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class DispatchQueue:
+    """Quản lý ModelQueue cho từng model và các lần sinh đang chạy"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 hosts: Optional[Callable[[str], int]] = None):
+        """
+        Args:
+            hosts: Số host đang phục vụ được model (HostPool.capacity); None = một host
+        """
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_QUEUE_CONFIG)
+        self.config.update(config or {})
+
+        env_parallel = os.environ.get('OLLAMA_NUM_PARALLEL')
+        self.num_parallel = int(env_parallel) if env_parallel and env_parallel.isdigit() \
+            else int(self.config['num_parallel'])
+
+        self._hosts = hosts
+        self._queues: Dict[str, ModelQueue] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def queue_for(self, model: str) -> ModelQueue:
+        with self._lock:
+            if model not in self._queues:
+                self._queues[model] = ModelQueue(model, self.num_parallel, self._hosts)
+            return self._queues[model]
+
+    @asynccontextmanager
+    async def aslot(self, model: str):
+        """Giữ một slot của model trong suốt khối lệnh (dùng cho stream)"""
+        if not self.enabled:
+            yield
+            return
+        queue = self.queue_for(model)
+        await queue.aacquire(current_lane.get())
+        try:
+            yield
+        finally:
+            queue.release()
+
+    async def arun(self, model: str, key: Optional[str], call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Chạy call() khi model có slot trống
+
+        Args:
+            key: Key của prompt để gộp request trùng (None = không gộp)
+        """
+        if not self.enabled:
+            return await call()
+
+        flight, leader = self._join_flight(key)
+        if not leader:
+            return await flight.await_result()
+
+        result, error = None, None
+        try:
+            async with self.aslot(model):
+                result = await call()
+            return result
+        except asyncio.CancelledError:
+            # Request gốc bị hủy - các request đang chờ nhận lỗi để tự fallback
+            error = Exception(f"Request tới {model} bị hủy")
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._land(key, flight, result, error)
+
+    def _join_flight(self, key: Optional[str]):
+        """Trả về (flight, True nếu là request dẫn đầu)"""
+        if key is None or not self.config['coalesce']:
+            return None, True
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                self.logger.info("🔗 Gộp với request giống hệt đang chạy")
+                return flight, False
+            flight = _Flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def _land(self, key: Optional[str], flight: Optional[_Flight], result: Any,
+              error: Optional[BaseException]):
+        if flight is None:
+            return
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.finish(result, error)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queues = dict(self._queues)
+        return {
+            "num_parallel": self.num_parallel,
+            "coalesced": self.coalesced,
+            "models": {model: queue.stats() for model, queue in queues.items()}
+        }
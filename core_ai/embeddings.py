@@ -0,0 +1,110 @@
+"""
+EMBEDDINGS - Tạo embedding qua server LLM (provider + host pool dùng chung)
+Model lấy từ llm.allowed_models.embedding trong permissions.yaml, phải có sẵn trên server
+"""
+import yaml
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+from .http_transport import get_transport
+from .llm_providers import get_provider
+from .host_pool import get_host_pool
+from .model_registry import get_model_registry
+
+DEFAULT_EMBEDDING_CONFIG = {
+    "model": "",        # Rỗng = chọn theo permissions.yaml
+    "timeout": 10
+}
+
+
+def allowed_embedding_models(path: str = 'config/permissions.yaml') -> List[str]:
+    """Embedding model được cấp quyền trong permissions.yaml"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            permissions = yaml.safe_load(f) or {}
+        return permissions.get('llm', {}).get('allowed_models', {}).get('embedding') or []
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Không thể đọc quyền embedding: {e}")
+        return []
+
+
+def resolve_embedding_model(available_models: List[str], allowed: Optional[List[str]] = None) -> Optional[str]:
+    """Embedding model đầu tiên vừa được cấp quyền vừa có trên server (khớp cả tag, vd. ':latest')"""
+    for model in allowed if allowed is not None else allowed_embedding_models():
+        for available in available_models:
+            if available == model or available.startswith(f"{model}:"):
+                return available
+    return None
+
+
+class Embedder:
+    """Gọi endpoint embedding của provider, từng đoạn một qua host pool"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_EMBEDDING_CONFIG)
+        self.config.update(config or {})
+        self.http = get_transport()
+        self.provider = get_provider()
+        self.host_pool = get_host_pool()
+        self._model: Optional[str] = self.config['model'] or None
+        self._allowed: Optional[List[str]] = None
+        self._reported_missing = False
+
+    @property
+    def model(self) -> Optional[str]:
+        """
+        Embedding model đang dùng (phát hiện khi cần)
+
+        Chưa có model thì lần sau phát hiện lại; registry cache kết quả rỗng với TTL ngắn
+        nên model được tải sau khi khởi động vẫn được nhận
+        """
+        if self._model is None:
+            if self._allowed is None:
+                self._allowed = allowed_embedding_models()
+            # Probe chính các embedding model được cấp quyền nếu /api/tags không dùng được
+            available = get_model_registry().get_available_models(self._allowed) + self.host_pool.models()
+            self._model = resolve_embedding_model(available, self._allowed)
+            if self._model:
+                self.logger.info(f"🧭 Vector store dùng embedding model: {self._model}")
+            elif not self._reported_missing:
+                self._reported_missing = True
+                self.logger.info("Chưa có embedding model, tắt tìm kiếm ngữ nghĩa")
+        return self._model
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embedding cho từng đoạn (None nếu đoạn đó lỗi)"""
+        model = self.model
+        if not model:
+            return [None] * len(texts)
+        return [self._embed_one(model, text) for text in texts]
+
+    def _embed_one(self, model: str, text: str) -> Optional[List[float]]:
+        path, body = self.provider.embedding_request(model, text)
+        try:
+            with self.host_pool.lease(model) as base_url:
+                response = self.http.post(f"{base_url}{path}", json=body,
+                                          headers=self.provider.headers(), timeout=self.config['timeout'])
+                if response.status_code >= 500:
+                    raise Exception(f"API error: {response.status_code}")
+            if response.status_code != 200:
+                return None
+            return self.provider.parse_embedding(response.json())
+        except Exception as e:
+            self.logger.debug(f"Không thể tạo embedding: {str(e)[:50]}")
+            return None
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder(config: Optional[Dict[str, Any]] = None) -> Embedder:
+    """Embedder dùng chung của process (config chỉ có tác dụng ở lần gọi đầu)"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = Embedder(config)
+    return _embedder
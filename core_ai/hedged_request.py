@@ -0,0 +1,124 @@
+"""
+HEDGED REQUEST - Chạy song song model backup khi model chính chậm
+Response đạt chuẩn đến trước thắng, request còn lại bị hủy
+"""
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+DEFAULT_HEDGING_CONFIG = {
+    "enabled": False,
+    "delay_seconds": 20,        # Model chính chưa xong sau khoảng này -> chạy backup
+    "first_token_timeout": 8    # Chưa có token đầu tiên sau khoảng này -> chạy backup
+}
+
+logger = logging.getLogger(__name__)
+
+AsyncStreamFactory = Callable[[], AsyncIterator[str]]
+
+
+class _HedgeState:
+    """Theo dõi thời điểm cần khởi động backup và kết quả tốt nhất hiện có"""
+
+    def __init__(self, config: Dict[str, Any], is_adequate: Callable[[str], bool]):
+        self.delay = config['delay_seconds']
+        self.first_token_timeout = config['first_token_timeout']
+        self.is_adequate = is_adequate
+        self.started_at = time.monotonic()
+        self.fallback: Optional[Tuple[str, str]] = None
+        self.last_error: Optional[Exception] = None
+
+    def wait_timeout(self, got_first_token: bool) -> float:
+        """Thời gian còn lại trước khi phải khởi động backup"""
+        deadline = self.started_at + self.delay
+        if not got_first_token:
+            deadline = min(deadline, self.started_at + self.first_token_timeout)
+        return max(0.0, deadline - time.monotonic())
+
+    def should_hedge(self, got_first_token: bool) -> bool:
+        return self.wait_timeout(got_first_token) <= 0
+
+    def record(self, model: str, text: Optional[str], error: Optional[Exception]) -> bool:
+        """Ghi nhận một kết quả, trả về True nếu kết quả này thắng"""
+        if error is not None:
+            self.last_error = error
+            return False
+        if self.is_adequate(text):
+            return True
+        if text and (self.fallback is None or len(text) > len(self.fallback[1])):
+            self.fallback = (model, text)
+        return False
+
+    def result(self) -> Tuple[str, str]:
+        """Không có response đạt chuẩn: trả response dài nhất hoặc ném lỗi cuối cùng"""
+        if self.fallback is not None:
+            return self.fallback[1], self.fallback[0]
+        raise self.last_error or Exception("Không model nào trả về response")
+
+
+async def arun_hedged(primary: Tuple[str, AsyncStreamFactory], backup: Tuple[str, AsyncStreamFactory],
+                      is_adequate: Callable[[str], bool],
+                      config: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    """
+    Chạy model chính, khởi động backup khi chậm hoặc không đạt chuẩn
+
+    Args:
+        primary, backup: (tên model, hàm tạo async stream chunk)
+        is_adequate: Hàm kiểm tra response đạt chuẩn
+        config: delay_seconds / first_token_timeout
+
+    Returns:
+        (response, model thắng); request thua bị hủy bằng task.cancel()
+        (task con kế thừa context nên giữ lane ưu tiên của request)
+    """
+    settings = dict(DEFAULT_HEDGING_CONFIG)
+    settings.update(config or {})
+    state = _HedgeState(settings, is_adequate)
+    first_token = asyncio.Event()
+
+    async def consume(model: str, factory: AsyncStreamFactory, mark_first: bool):
+        chunks = []
+        async for chunk in factory():
+            chunks.append(chunk)
+            if mark_first:
+                first_token.set()
+        return model, ''.join(chunks)
+
+    tasks = {asyncio.ensure_future(consume(primary[0], primary[1], True)): primary[0]}
+    backup_started = False
+
+    def start_backup():
+        tasks[asyncio.ensure_future(consume(backup[0], backup[1], False))] = backup[0]
+        logger.info(f"🏁 Hedge: chạy song song backup {backup[0]}")
+
+    while tasks:
+        timeout = None if backup_started else state.wait_timeout(first_token.is_set())
+        done, _ = await asyncio.wait(tasks.keys(), timeout=timeout,
+                                     return_when=asyncio.FIRST_COMPLETED)
+
+        if not done:
+            if not backup_started and state.should_hedge(first_token.is_set()):
+                start_backup()
+                backup_started = True
+            continue
+
+        for task in done:
+            model = tasks.pop(task)
+            try:
+                _, text = task.result()
+                error = None
+            except Exception as e:
+                text, error = None, e
+
+            if state.record(model, text, error):
+                for other in tasks:
+                    other.cancel()
+                logger.info(f"🏁 Hedge: {model} thắng")
+                return text, model
+
+        if not backup_started:
+            start_backup()
+            backup_started = True
+
+    return state.result()
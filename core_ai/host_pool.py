@@ -0,0 +1,231 @@
+"""
+HOST POOL - Phân tải request LLM qua nhiều máy Ollama
+Chọn host theo số request đang chạy và độ trễ quan sát, ưu tiên host đã nạp sẵn model,
+health check định kỳ để rút host lỗi ra khỏi vòng quay
+"""
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Set
+
+from .http_transport import HTTPTransport, TransportConfigError, get_transport, load_ollama_settings
+from .llm_providers import LLMProvider, get_provider
+
+DEFAULT_HOST_POOL_CONFIG = {
+    "strategy": "latency_weighted",  # least_outstanding | latency_weighted
+    "health_interval": 15,           # Giây giữa hai lần health check
+    "health_timeout": 2,
+    "fail_threshold": 3,             # Số lỗi liên tiếp trước khi rút host
+    "drain_seconds": 30,             # Thời gian tối thiểu host bị rút
+    "cold_penalty": 3.0,             # Hệ số phạt host chưa nạp model (phải load lại)
+    "ewma_alpha": 0.3
+}
+
+
+class Host:
+    """Trạng thái một máy Ollama"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.drained_until = 0.0
+        self.models: Set[str] = set()       # Rỗng = chưa biết, coi như có mọi model
+        self.loaded: Set[str] = set()
+        self.latency: Dict[str, float] = {}  # EWMA độ trễ theo model
+        self.served = 0
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.drained_until
+
+    def has_model(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+    def expected_latency(self, model: str) -> float:
+        """Độ trễ kỳ vọng của model trên host (trung bình các model khác nếu chưa có mẫu)"""
+        if model in self.latency:
+            return self.latency[model]
+        if self.latency:
+            return sum(self.latency.values()) / len(self.latency)
+        return 1.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy and time.time() >= self.drained_until,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "loaded": sorted(self.loaded),
+            "latency": {m: round(v, 3) for m, v in self.latency.items()}
+        }
+
+
+class HostPool:
+    """Danh sách host và chính sách chọn host cho từng request"""
+
+    def __init__(self, transport: HTTPTransport, hosts: List[str],
+                 config: Optional[Dict[str, Any]] = None,
+                 provider: Optional[LLMProvider] = None):
+        self.logger = logging.getLogger(__name__)
+        self.transport = transport
+        self.provider = provider or LLMProvider()
+        self.config = dict(DEFAULT_HOST_POOL_CONFIG)
+        self.config.update(config or {})
+
+        self.hosts = [Host(url) for url in hosts]
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+
+        if len(self.hosts) > 1:
+            self.logger.info(f"🖧 Host pool: {[h.base_url for h in self.hosts]} ({self.config['strategy']})")
+            self.check_health()
+            self._start_health_checks()
+
+    def pick(self, model: str) -> Host:
+        """Chọn host tốt nhất cho model; không còn host khỏe thì dùng host ít lỗi nhất"""
+        if len(self.hosts) == 1:
+            return self.hosts[0]
+
+        now = time.time()
+        with self._lock:
+            candidates = [h for h in self.hosts if h.available(now) and h.has_model(model)]
+            if not candidates:
+                candidates = [h for h in self.hosts if h.available(now)] or \
+                             [min(self.hosts, key=lambda h: h.failures)]
+            return min(candidates, key=lambda h: self._score(h, model))
+
+    def capacity(self, model: str) -> int:
+        """Số host khỏe có model (ít nhất 1) - hàng đợi nhân số slot của model theo số này"""
+        if len(self.hosts) == 1:
+            return 1
+        now = time.time()
+        with self._lock:
+            return max(1, sum(1 for h in self.hosts if h.available(now) and h.has_model(model)))
+
+    def _score(self, host: Host, model: str):
+        """Điểm càng nhỏ càng được ưu tiên (gọi khi giữ lock)"""
+        cold = 1.0 if not host.loaded or model in host.loaded else self.config['cold_penalty']
+        if self.config['strategy'] == 'least_outstanding':
+            return host.outstanding, cold, host.expected_latency(model)
+        # Ước lượng thời gian chờ: số request phía trước * độ trễ mỗi request
+        return (host.outstanding + 1) * host.expected_latency(model) * cold
+
+    @contextmanager
+    def lease(self, model: str):
+        """
+        Giữ một host trong suốt request, trả về base url của host
+
+        Request lỗi được tính cho host; lỗi liên tiếp vượt ngưỡng thì host bị rút
+        """
+        host = self.pick(model)
+        with self._lock:
+            host.outstanding += 1
+        start_time = time.time()
+        try:
+            yield host.base_url
+        except (GeneratorExit, asyncio.CancelledError, TransportConfigError):
+            # Người đọc đóng stream / task bị hủy / cấu hình client sai - không phải lỗi của host
+            raise
+        except BaseException:
+            self._record_failure(host)
+            raise
+        else:
+            self._record_success(host, model, time.time() - start_time)
+        finally:
+            with self._lock:
+                host.outstanding -= 1
+
+    def _record_success(self, host: Host, model: str, latency: float):
+        alpha = self.config['ewma_alpha']
+        with self._lock:
+            host.failures = 0
+            host.served += 1
+            host.loaded.add(model)
+            previous = host.latency.get(model)
+            host.latency[model] = latency if previous is None else alpha * latency + (1 - alpha) * previous
+
+    def _record_failure(self, host: Host):
+        if len(self.hosts) == 1:
+            return
+        with self._lock:
+            host.failures += 1
+            if host.failures >= self.config['fail_threshold'] and host.healthy:
+                host.healthy = False
+                host.drained_until = time.time() + self.config['drain_seconds']
+                self.logger.warning(f"🚫 Rút host {host.base_url} sau {host.failures} lỗi liên tiếp")
+
+    def check_health(self):
+        """Health check mọi host: danh sách model, model đang nạp (nếu provider hỗ trợ)"""
+        for host in self.hosts:
+            models, loaded, ok = self._probe(host)
+            with self._lock:
+                if ok:
+                    if not host.healthy:
+                        self.logger.info(f"✅ Host {host.base_url} hoạt động lại")
+                    host.models, host.healthy, host.failures = models, True, 0
+                    if loaded is not None:
+                        host.loaded = loaded
+                elif host.healthy:
+                    self.logger.warning(f"🚫 Host {host.base_url} không phản hồi health check")
+                    host.healthy = False
+
+    def _probe(self, host: Host):
+        timeout = self.config['health_timeout']
+        try:
+            response = self.transport.get(f"{host.base_url}{self.provider.models_path}",
+                                          headers=self.provider.headers(), timeout=timeout)
+            if response.status_code != 200:
+                return set(), None, False
+            models = set(self.provider.parse_models(response.json()))
+
+            loaded = None
+            if self.provider.manages_residency:
+                ps = self.transport.get(f"{host.base_url}/api/ps", timeout=timeout)
+                if ps.status_code == 200:
+                    loaded = {m.get('name') for m in ps.json().get('models', [])}
+            return models, loaded, True
+        except Exception as e:
+            self.logger.debug(f"Health check {host.base_url}: {str(e)[:50]}")
+            return set(), None, False
+
+    def models(self) -> List[str]:
+        """Hợp các model có trên những host khỏe"""
+        now = time.time()
+        with self._lock:
+            found = set()
+            for host in self.hosts:
+                if host.available(now):
+                    found |= host.models
+            return sorted(found)
+
+    def _start_health_checks(self):
+        def loop():
+            while True:
+                time.sleep(self.config['health_interval'])
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=loop, daemon=True)
+        self._health_thread.start()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {host.base_url: host.snapshot() for host in self.hosts}
+
+
+_pool: Optional[HostPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_host_pool() -> HostPool:
+    """Host pool dùng chung của process (`ollama.hosts` trong settings.yaml, mặc định chỉ base_url)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                settings = load_ollama_settings()
+                transport = get_transport()
+                hosts = settings.get('hosts') or [transport.base_url]
+                _pool = HostPool(transport, hosts, settings.get('host_pool'), get_provider())
+    return _pool
@@ -0,0 +1,297 @@
+"""
+HTTP TRANSPORT - Lớp kết nối dùng chung tới Ollama
+Session keep-alive có pool, retry/backoff và giới hạn request đồng thời theo host
+"""
+import yaml
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, AsyncIterator, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+
+DEFAULT_TRANSPORT_CONFIG = {
+    "pool_connections": 4,      # Số host được giữ pool riêng
+    "pool_maxsize": 16,         # Số kết nối keep-alive tối đa mỗi host
+    "max_per_host": 8,          # Số request đồng thời tối đa mỗi host
+    "retries": 2,               # Retry khi lỗi kết nối / 502-504
+    "backoff_factor": 0.3,
+    "status_forcelist": [502, 503, 504]
+}
+
+
+class TransportConfigError(Exception):
+    """Lỗi phía client (thiếu thư viện, url sai) - không phải lỗi của model hay host"""
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise TransportConfigError("Thiếu thư viện aiohttp (pip install -r requirements.txt)") from e
+    return aiohttp
+
+
+def load_ollama_settings(path: str = 'config/settings.yaml') -> Dict[str, Any]:
+    """Đọc mục `ollama` trong settings.yaml (rỗng nếu không có)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            settings = yaml.safe_load(f) or {}
+        return settings.get('ollama', {}) or {}
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Không thể tải cấu hình ollama: {e}")
+        return {}
+
+
+def resolve_base_url(settings: Dict[str, Any]) -> str:
+    """Base url của server LLM; provider `stub` thì khởi động stub server trong process"""
+    if settings.get('provider') == 'stub':
+        from .stub_server import start_stub_server
+        return start_stub_server(settings.get('stub'))
+    return settings.get('base_url', DEFAULT_BASE_URL)
+
+
+class HTTPTransport:
+    """Session HTTP dùng chung cho mọi lời gọi Ollama"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 base_url: str = DEFAULT_BASE_URL):
+        self.logger = logging.getLogger(__name__)
+        self.base_url = base_url.rstrip('/')
+        self.config = dict(DEFAULT_TRANSPORT_CONFIG)
+        self.config.update(config or {})
+
+        self.session = self._build_session()
+
+        # Semaphore giới hạn request đồng thời cho từng host
+        self._host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._limits_lock = threading.Lock()
+
+    def _build_session(self) -> requests.Session:
+        """Tạo session với pool kết nối và chính sách retry"""
+        retry = Retry(
+            total=self.config['retries'],
+            connect=self.config['retries'],
+            read=0,  # Không retry khi đã gửi prompt và đang chờ sinh token
+            status=self.config['retries'],
+            backoff_factor=self.config['backoff_factor'],
+            status_forcelist=self.config['status_forcelist'],
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.config['pool_connections'],
+            pool_maxsize=self.config['pool_maxsize'],
+            max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        """Lấy semaphore của host trong url"""
+        host = urlsplit(url).netloc
+        with self._limits_lock:
+            semaphore = self._host_limits.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.config['max_per_host'])
+                self._host_limits[host] = semaphore
+            return semaphore
+
+    def url(self, path: str) -> str:
+        """Ghép path API với base url"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Gửi request qua session dùng chung, tôn trọng giới hạn theo host"""
+        if not url.startswith(('http://', 'https://')):
+            url = self.url(url)
+
+        with self._host_semaphore(url):
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stream_lines(self, method: str, url: str, **kwargs) -> Iterator[bytes]:
+        """
+        Gửi request dạng stream và trả về từng dòng (NDJSON của Ollama).
+        Slot của host được giữ cho đến khi stream kết thúc hoặc bị đóng.
+        """
+        if not url.startswith(('http://', 'https://')):
+            url = self.url(url)
+
+        with self._host_semaphore(url):
+            response = self.session.request(method, url, stream=True, **kwargs)
+            try:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        yield line
+            finally:
+                response.close()
+
+    def close(self):
+        """Đóng toàn bộ kết nối trong pool"""
+        self.session.close()
+
+
+class AsyncHTTPTransport:
+    """
+    Client aiohttp không chặn, dùng chung cấu hình pool/retry với HTTPTransport.
+    Session gắn với event loop nên mỗi loop (loop nền của API sync, loop của server) có session riêng.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 base_url: str = DEFAULT_BASE_URL):
+        self.logger = logging.getLogger(__name__)
+        self.base_url = base_url.rstrip('/')
+        self.config = dict(DEFAULT_TRANSPORT_CONFIG)
+        self.config.update(config or {})
+
+        self._sessions: Dict[Any, Any] = {}
+        self._closers: Dict[Any, AsyncIterator[None]] = {}
+        self._sessions_lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        """Ghép path API với base url"""
+        if path.startswith(('http://', 'https://')):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def _get_session(self):
+        """Lấy ClientSession của event loop hiện tại"""
+        aiohttp = _import_aiohttp()
+
+        loop = asyncio.get_running_loop()
+        with self._sessions_lock:
+            # Bỏ session của các loop đã đóng (đã được _close_on_shutdown đóng trước đó)
+            for old_loop in [l for l in self._sessions if l.is_closed()]:
+                del self._sessions[old_loop]
+                self._closers.pop(old_loop, None)
+            session = self._sessions.get(loop)
+            if session is not None and not session.closed:
+                return session
+            connector = aiohttp.TCPConnector(
+                limit=self.config['pool_maxsize'],
+                limit_per_host=self.config['max_per_host']
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[loop] = session
+            closer = self._close_on_shutdown(session)
+            self._closers[loop] = closer
+        # Generator đăng ký với loop ở lần chạy đầu; loop.shutdown_asyncgens() (cuối asyncio.run)
+        # gọi aclose() -> session được đóng trước khi loop đóng
+        await closer.__anext__()
+        return session
+
+    @staticmethod
+    async def _close_on_shutdown(session) -> AsyncIterator[None]:
+        """Giữ chỗ tới khi loop tắt rồi đóng session của loop đó"""
+        try:
+            yield
+        finally:
+            if not session.closed:
+                await session.close()
+
+    async def _send(self, method: str, url: str, timeout: float, **kwargs):
+        """Gửi request, retry với backoff khi lỗi kết nối hoặc status trong forcelist"""
+        aiohttp = _import_aiohttp()
+
+        session = await self._get_session()
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        retries = self.config['retries']
+        # NonHttpUrlClientError (url thiếu http://) chỉ có từ aiohttp 3.10
+        url_errors = tuple(getattr(aiohttp, name) for name in ('InvalidURL', 'NonHttpUrlClientError')
+                           if hasattr(aiohttp, name))
+
+        for attempt in range(retries + 1):
+            try:
+                response = await session.request(method, self.url(url), timeout=client_timeout, **kwargs)
+            except url_errors as e:
+                raise TransportConfigError(f"URL không hợp lệ: {e}") from e
+            except aiohttp.ClientConnectionError:
+                if attempt >= retries:
+                    raise
+            else:
+                if response.status not in self.config['status_forcelist'] or attempt >= retries:
+                    return response
+                response.release()
+
+            await asyncio.sleep(self.config['backoff_factor'] * (2 ** attempt))
+
+    async def request_json(self, method: str, url: str, timeout: float = 30,
+                           **kwargs) -> Tuple[int, Dict[str, Any]]:
+        """Gửi request và trả về (status, body JSON)"""
+        response = await self._send(method, url, timeout, **kwargs)
+        async with response:
+            if response.status != 200:
+                return response.status, {}
+            return response.status, await response.json(content_type=None)
+
+    async def stream_lines(self, method: str, url: str, timeout: float = 30,
+                           **kwargs) -> AsyncIterator[bytes]:
+        """Gửi request dạng stream và trả về từng dòng NDJSON"""
+        response = await self._send(method, url, timeout, **kwargs)
+        async with response:
+            response.raise_for_status()
+            async for line in response.content:
+                line = line.strip()
+                if line:
+                    yield line
+
+    async def close(self):
+        """Đóng session của loop hiện tại (loop tắt qua asyncio.run thì tự đóng)"""
+        loop = asyncio.get_running_loop()
+        with self._sessions_lock:
+            session = self._sessions.pop(loop, None)
+            closer = self._closers.pop(loop, None)
+        if closer is not None:
+            await closer.aclose()
+        if session is not None and not session.closed:
+            await session.close()
+
+
+_transport: Optional[HTTPTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HTTPTransport:
+    """Lấy transport dùng chung của process (khởi tạo lần đầu từ settings.yaml)"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                settings = load_ollama_settings()
+                _transport = HTTPTransport(
+                    config=settings.get('transport'),
+                    base_url=resolve_base_url(settings)
+                )
+    return _transport
+
+
+_async_transport: Optional[AsyncHTTPTransport] = None
+
+
+def get_async_transport() -> AsyncHTTPTransport:
+    """Lấy async transport dùng chung của process"""
+    global _async_transport
+    if _async_transport is None:
+        with _transport_lock:
+            if _async_transport is None:
+                settings = load_ollama_settings()
+                _async_transport = AsyncHTTPTransport(
+                    config=settings.get('transport'),
+                    base_url=resolve_base_url(settings)
+                )
+    return _async_transport
@@ -0,0 +1,196 @@
+"""
+LATENCY STATS - Thống kê độ trễ và tốc độ sinh token theo (model, llm_type)
+Timeout lấy từ p99 quan sát được, num_predict tính theo SLO độ trễ; lưu xuống memory/ để dùng lại
+Mỗi file thống kê chỉ có một LatencyStats trong process (get_latency_stats)
+"""
+import json
+import math
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+DEFAULT_ADAPTIVE_CONFIG = {
+    "enabled": True,
+    "window_size": 200,         # Số mẫu gần nhất giữ cho mỗi (model, llm_type)
+    "min_samples": 10,          # Chưa đủ mẫu thì dùng giá trị mặc định
+    "timeout_margin": 1.5,      # timeout = p99 * margin
+    "min_timeout": 10,
+    "max_timeout": 180,
+    "min_tokens": 512,
+    "token_step": 256,          # Làm tròn num_predict để key response cache ổn định
+    "latency_slo": {            # Độ trễ mục tiêu (giây) cho từng llm_type
+        "chat": 30,
+        "coding": 60,
+        "research": 60,
+        "web_search": 45,
+        "reasoning": 60
+    },
+    "default_slo": 30,
+    "path": "memory/latency_stats.json",
+    "save_interval_seconds": 30
+}
+
+
+def percentile(values, q: float) -> float:
+    """Percentile theo nearest-rank (values khác rỗng)"""
+    ordered = sorted(values)
+    index = min(len(ordered), max(1, math.ceil(q / 100 * len(ordered)))) - 1
+    return ordered[index]
+
+
+class LatencyStats:
+    """Ghi nhận độ trễ/tokens mỗi giây và đề xuất timeout, num_predict"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_ADAPTIVE_CONFIG)
+        self.config.update(config or {})
+        self.slo = dict(DEFAULT_ADAPTIVE_CONFIG['latency_slo'])
+        self.slo.update(self.config.get('latency_slo') or {})
+        self.path = Path(self.config['path']).resolve()
+
+        # (model, llm_type) -> {"latency": deque, "tps": deque}
+        self._samples: Dict[Tuple[str, str], Dict[str, deque]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.time()
+
+        if self.enabled:
+            self._load()
+            atexit.register(self.save)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def record(self, model: str, llm_type: str, latency: float,
+               eval_count: Optional[int] = None, eval_duration: Optional[int] = None):
+        """
+        Ghi nhận một lời gọi
+
+        Args:
+            latency: Tổng thời gian (giây), gồm cả thời gian load model
+            eval_count, eval_duration: Số token sinh ra và thời gian sinh (nano giây) từ Ollama
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            bucket = self._bucket(model, llm_type)
+            bucket['latency'].append(round(latency, 3))
+            if eval_count and eval_duration:
+                bucket['tps'].append(round(eval_count / (eval_duration / 1e9), 2))
+            self._dirty = True
+
+        if time.time() - self._last_save >= self.config['save_interval_seconds']:
+            self.save()
+
+    def record_timeout(self, model: str, llm_type: str, timeout: float):
+        """Lời gọi bị timeout: ghi nhận độ trễ bằng timeout để p99 (và timeout sau) tăng lên"""
+        self.record(model, llm_type, timeout)
+
+    def timeout_for(self, model: str, llm_type: str, default: float) -> float:
+        """Timeout = p99 độ trễ * margin, giới hạn trong [min_timeout, max_timeout]"""
+        with self._lock:
+            latencies = list(self._samples.get((model, llm_type), {}).get('latency', ()))
+        if not self.enabled or len(latencies) < self.config['min_samples']:
+            return default
+
+        timeout = percentile(latencies, 99) * self.config['timeout_margin']
+        return round(min(self.config['max_timeout'], max(self.config['min_timeout'], timeout)))
+
+    def max_tokens_for(self, model: str, llm_type: str, default: int) -> int:
+        """Số token sinh được trong SLO của llm_type, không vượt quá mức cấu hình"""
+        with self._lock:
+            rates = list(self._samples.get((model, llm_type), {}).get('tps', ()))
+        if not self.enabled or len(rates) < self.config['min_samples']:
+            return default
+
+        # Dùng p10 tốc độ để phần lớn request vẫn nằm trong SLO
+        slo = self.slo.get(llm_type, self.config['default_slo'])
+        budget = percentile(rates, 10) * slo
+        step = self.config['token_step']
+        budget = int(budget // step) * step
+        return max(self.config['min_tokens'], min(default, budget))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """p50/p99 độ trễ và tokens/s trung vị của từng (model, llm_type)"""
+        with self._lock:
+            items = [(key, list(b['latency']), list(b['tps'])) for key, b in self._samples.items()]
+        return {
+            f"{model}|{llm_type}": {
+                "samples": len(latencies),
+                "p50_latency": percentile(latencies, 50) if latencies else None,
+                "p99_latency": percentile(latencies, 99) if latencies else None,
+                "tokens_per_second": percentile(rates, 50) if rates else None
+            }
+            for (model, llm_type), latencies, rates in items
+        }
+
+    def save(self):
+        """Ghi thống kê xuống đĩa (chỉ khi có mẫu mới)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                f"{model}|{llm_type}": {"latency": list(b['latency']), "tps": list(b['tps'])}
+                for (model, llm_type), b in self._samples.items()
+            }
+            self._dirty = False
+            self._last_save = time.time()
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.path.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            tmp_file.replace(self.path)
+        except Exception as e:
+            self.logger.warning(f"Không thể lưu latency stats: {e}")
+
+    def _bucket(self, model: str, llm_type: str) -> Dict[str, deque]:
+        """Lấy/tạo cửa sổ mẫu (gọi khi đã giữ lock)"""
+        key = (model, llm_type)
+        if key not in self._samples:
+            size = self.config['window_size']
+            self._samples[key] = {"latency": deque(maxlen=size), "tps": deque(maxlen=size)}
+        return self._samples[key]
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.logger.warning(f"Không thể đọc latency stats: {e}")
+            return
+
+        for key, values in data.items():
+            model, _, llm_type = key.rpartition('|')
+            bucket = self._bucket(model, llm_type)
+            bucket['latency'].extend(values.get('latency', []))
+            bucket['tps'].extend(values.get('tps', []))
+        self.logger.info(f"📈 Đã tải latency stats cho {len(data)} cặp model/task")
+
+
+_stats: Dict[str, LatencyStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_latency_stats(config: Optional[Dict[str, Any]] = None) -> LatencyStats:
+    """
+    LatencyStats dùng chung theo đường dẫn file
+
+    Nhiều dispatcher cùng ghi một file thì mẫu được gộp trong RAM,
+    không có instance nào ghi đè file của instance khác lúc thoát
+    """
+    path = str(Path((config or {}).get('path', DEFAULT_ADAPTIVE_CONFIG['path'])).resolve())
+    with _stats_lock:
+        if path not in _stats:
+            _stats[path] = LatencyStats(config)
+        return _stats[path]
@@ -1,25 +1,109 @@
 """
 LLM DISPATCHER TỐI ƯU - Sử dụng model phù hợp cho từng task
 """
+import re
 import yaml
+import json
+import asyncio
+import hashlib
 import logging
 import time
-import requests
-from typing import Dict, Any
+import threading
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 import random
 
+from .http_transport import TransportConfigError, get_transport, get_async_transport
+from .async_bridge import get_loop_runner
+from .model_registry import get_model_registry
+from .stream_processor import ResponseStreamProcessor, process_response
+from .response_cache import ResponseCache, normalize_prompt
+from .semantic_cache import SemanticCache
+from .hedged_request import arun_hedged
+from .circuit_breaker import CircuitBreakerRegistry, CircuitOpenError
+from .latency_stats import get_latency_stats
+from .warm_pool import WarmPoolManager
+from .session_store import ChatSession, SessionStore
+from .dispatch_queue import DispatchQueue, current_lane
+from .prompt_budget import PromptBudget, estimate_tokens
+from .llm_providers import get_provider
+from .host_pool import get_host_pool
+from .param_profiles import ParamProfiles
+from .embeddings import allowed_embedding_models, resolve_embedding_model
+from .structured_output import (DEFAULT_STRUCTURED_CONFIG, JSONStreamValidator,
+                                StructuredOutputError)
+
+# Model nhỏ trả lời trước, chỉ gọi model lớn khi câu trả lời chưa đạt
+DEFAULT_TIERED_CONFIG = {
+    "enabled": True,
+    "llm_types": ["chat"],
+    "models": ["qwen2.5:7b", "llama3:8b"],   # Model nhỏ theo thứ tự ưu tiên
+    "max_input_chars": 600,                  # Câu hỏi dài/phức tạp đi thẳng tới model lớn
+    "check_chars": 240,                      # Stream: đoạn đầu được kiểm tra trước khi hiển thị
+    "uncertainty_markers": [
+        "tôi không chắc", "tôi không biết", "không có đủ thông tin", "không rõ",
+        "i'm not sure", "i am not sure", "i don't know", "as an ai"
+    ]
+}
+
+# Plan suy luận / nghiên cứu: chạy song song nhiều model rồi chọn câu trả lời tốt nhất
+DEFAULT_ENSEMBLE_CONFIG = {
+    "enabled": True,
+    "llm_types": ["reasoning", "research"],
+    "size": 2,                      # Số model chạy song song
+    "judge": "heuristic",           # heuristic | model
+    "judge_model": "qwen2.5:7b",    # Model nhỏ chấm điểm khi judge = model
+    "judge_excerpt_chars": 1500     # Mỗi câu trả lời chỉ gửi đoạn đầu cho judge
+}
+
 class LLMDispatcher:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.ollama_base = "http://localhost:11434"
+        self.http = get_transport()
+        self.ahttp = get_async_transport()
+        self.ollama_base = self.http.base_url
+        self.provider = get_provider()
+        self.host_pool = get_host_pool()
+        self.model_registry = get_model_registry()
         self.use_mock = False
         
         # Tải cấu hình
         self.llm_profiles = self._load_llm_profiles()
+        self.dispatcher_config = self.llm_profiles.get('dispatcher', {}) or {}
+        self.response_cache = ResponseCache(self.dispatcher_config.get('response_cache'))
+        self.semantic_cache = SemanticCache(self.dispatcher_config.get('semantic_cache'))
+        self.hedging_config = self.dispatcher_config.get('hedging') or {}
+        self.tiered_config = dict(DEFAULT_TIERED_CONFIG)
+        self.tiered_config.update(self.dispatcher_config.get('tiered') or {})
+        self.tier_stats = {"first_pass": 0, "escalated": 0}
+        self.model_optimization = self._load_model_optimization()
+        self.ensemble_config = dict(DEFAULT_ENSEMBLE_CONFIG)
+        self.ensemble_config.update(self.model_optimization.get('ensemble') or {})
+        self.circuit_breakers = CircuitBreakerRegistry(self.dispatcher_config.get('circuit_breaker'))
+        self.latency_stats = get_latency_stats(self.dispatcher_config.get('adaptive_limits'))
+        warm_pool_config = dict(self.dispatcher_config.get('warm_pool') or {})
+        if not self.provider.manages_residency:
+            # keep_alive và /api/ps chỉ có trên Ollama
+            warm_pool_config['enabled'] = False
+        elif len(self.host_pool.hosts) > 1:
+            # /api/ps và preload chỉ nhìn thấy một host; host pool đã tự theo dõi model
+            # đang nạp trên từng host (health check) và ưu tiên host có model nóng.
+            # Vẫn giữ keep_alive theo tỉ lệ sử dụng vì nó đi kèm từng request
+            warm_pool_config['preload'] = False
+        self.warm_pool = WarmPoolManager(self.http, warm_pool_config)
+        self.sessions = SessionStore(self.dispatcher_config.get('sessions'))
+        self.dispatch_queue = DispatchQueue(self.dispatcher_config.get('queue'), self.host_pool.capacity)
+        self.param_profiles = ParamProfiles(self.dispatcher_config.get('param_profiles'), self.llm_profiles)
+        self.prompt_budget = PromptBudget(self.llm_profiles.get('capabilities'),
+                                          self.dispatcher_config.get('prompt_budget'),
+                                          self.param_profiles.num_ctx)
+        self.structured_config = dict(DEFAULT_STRUCTURED_CONFIG)
+        self.structured_config.update(self.dispatcher_config.get('structured_output') or {})
+        self.embedding_model = None
         
         # Khởi tạo model
         self.available_models = []
         self.model_priority = {}
+        self.model_candidates = {}
         self._initialize_dispatcher()
         
     def _load_llm_profiles(self):
@@ -38,6 +122,15 @@ class LLMDispatcher:
                 }
             }
     
+    def _load_model_optimization(self) -> Dict[str, Any]:
+        """Tải fallback_strategy / ensemble từ model_optimization.yaml"""
+        try:
+            with open('config/model_optimization.yaml', 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or {}
+        except Exception as e:
+            self.logger.warning(f"Không thể tải model_optimization: {e}")
+            return {}
+    
     def _initialize_dispatcher(self):
         """Khởi tạo dispatcher với các model có sẵn"""
         try:
@@ -47,70 +140,71 @@ class LLMDispatcher:
                 self.use_mock = True
             else:
                 self._select_optimal_model()
+                self.embedding_model = self._resolve_embedding_model()
                 self.logger.info(f"Dispatcher khởi tạo thành công. Model có sẵn: {self.available_models}")
         except Exception as e:
             self.logger.error(f"Lỗi khởi tạo dispatcher: {e}")
             self.use_mock = True
     
     def _detect_available_models(self):
-        """Phát hiện model nào thực sự có sẵn và hoạt động"""
-        self.logger.info("🔍 Đang phát hiện model có sẵn...")
+        """Phát hiện model có sẵn qua registry dùng chung (cache theo TTL)"""
+        # Chỉ probe từng model khi /api/tags không dùng được
+        probe_models = ['llama3:8b', 'qwen2.5:14b', 'mixtral:latest', 'deepseek-coder:6.7b'] \
+            + allowed_embedding_models()
+        self.available_models = self.model_registry.get_available_models(probe_models)
+        # Nhiều host: gộp model có trên các host khác
+        for model in self.host_pool.models():
+            if model not in self.available_models:
+                self.available_models.append(model)
+    
+    def _resolve_embedding_model(self) -> Optional[str]:
+        """Chọn embedding model được cấp quyền trong permissions.yaml và có sẵn trên Ollama"""
+        if not self.semantic_cache.enabled:
+            return None
         
-        # Danh sách model để test
-        test_models = ['llama3:8b', 'qwen2.5:14b', 'mixtral:latest', 'deepseek-coder:6.7b']
-        self.available_models = []
+        allowed = allowed_embedding_models()
+        model = resolve_embedding_model(self.available_models, allowed)
+        if model:
+            self.logger.info(f"🧭 Semantic cache dùng embedding model: {model}")
+            return model
         
-        for model in test_models:
-            try:
-                # Test nhanh bằng API show
-                response = requests.get(
-                    f"{self.ollama_base}/api/show",
-                    json={"name": model},
-                    timeout=3
-                )
-                if response.status_code == 200:
-                    self.available_models.append(model)
-                    self.logger.info(f"  ✅ {model} có sẵn")
-                else:
-                    self.logger.debug(f"  ⚠️ {model} không khả dụng (HTTP {response.status_code})")
-            except requests.exceptions.Timeout:
-                self.logger.debug(f"  ⏰ {model}: timeout")
-            except Exception as e:
-                self.logger.debug(f"  ❌ {model}: {str(e)[:50]}")
-        
-        # Nếu không tìm thấy model, thử kiểm tra kết nối Ollama cơ bản
-        if not self.available_models:
-            try:
-                response = requests.get(f"{self.ollama_base}/api/tags", timeout=5)
-                if response.status_code == 200:
-                    models_data = response.json().get('models', [])
-                    self.available_models = [m['name'] for m in models_data]
-                    self.logger.info(f"  📊 Tìm thấy {len(self.available_models)} model từ API tags")
-            except Exception as e:
-                self.logger.warning(f"  Không thể kết nối đến Ollama: {e}")
+        if allowed:
+            self.logger.info("Embedding model chưa được tải, tắt semantic cache")
+        return None
     
     def _select_optimal_model(self):
         """Chọn model tối ưu dựa trên performance test"""
         # Ưu tiên theo thứ tự hiệu năng và chất lượng
+        self.model_candidates = {
+            'chat': self._get_candidate_models('chat'),
+            'coding': self._get_candidate_models('coding'),
+            'web_search': self._get_candidate_models('research'),
+            'research': self._get_candidate_models('research'),
+            'reasoning': self._get_candidate_models('reasoning')
+        }
         self.model_priority = {
-            'chat': self._get_best_model_for_type('chat'),
-            'coding': self._get_best_model_for_type('coding'),
-            'web_search': self._get_best_model_for_type('research'),
-            'research': self._get_best_model_for_type('research'),
-            'reasoning': self._get_best_model_for_type('reasoning')
+            llm_type: candidates[0] if candidates else 'llama3:8b'
+            for llm_type, candidates in self.model_candidates.items()
         }
         
         self.logger.info(f"🎯 Model tối ưu đã chọn: {self.model_priority}")
     
     def _get_best_model_for_type(self, llm_type: str) -> str:
         """Chọn model tốt nhất cho từng loại task"""
+        candidates = self._get_candidate_models(llm_type)
+        return candidates[0] if candidates else 'llama3:8b'
+    
+    def _get_candidate_models(self, llm_type: str) -> List[str]:
+        """Danh sách model có sẵn cho task, theo thứ tự ưu tiên (dùng khi ngắt mạch)"""
+        candidates = []
+        
         # Ưu tiên từ file cấu hình
         if self.llm_profiles and 'profiles' in self.llm_profiles:
             profiles = self.llm_profiles['profiles']
             if llm_type in profiles and 'models' in profiles[llm_type]:
                 for model in profiles[llm_type]['models']:
                     if model in self.available_models:
-                        return model
+                        candidates.append(model)
         
         # Fallback priority
         priority_lists = {
@@ -122,71 +216,735 @@ class LLMDispatcher:
         
         priority = priority_lists.get(llm_type, ['llama3:8b'])
         for model in priority:
-            if model in self.available_models:
-                return model
+            if model in self.available_models and model not in candidates:
+                candidates.append(model)
         
-        # Nếu không có model nào, trả về model đầu tiên có sẵn
-        return self.available_models[0] if self.available_models else 'llama3:8b'
+        # Nếu không có model nào, dùng model đầu tiên có sẵn
+        if not candidates and self.available_models:
+            candidates.append(self.available_models[0])
+        return candidates
+    
+    def _route_model(self, llm_type: str) -> Optional[str]:
+        """Model ưu tiên cao nhất chưa bị ngắt mạch (None nếu tất cả đều đang mở mạch)"""
+        candidates = self.model_candidates.get(llm_type) or [self.model_priority.get(llm_type, 'llama3:8b')]
+        for model in candidates:
+            if self.circuit_breakers.is_available(model):
+                if model != candidates[0]:
+                    self.logger.warning(f"🔌 {candidates[0]} đang ngắt mạch, chuyển sang {model}")
+                return model
+        return None
     
     def dispatch(self, plan: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Dispatch task đến model tối ưu nhất
+        Dispatch task đến model tối ưu nhất (wrapper đồng bộ của adispatch)
         
         Args:
-            plan: Kế hoạch từ ReasoningEngine
+            plan: Kế hoạch từ ReasoningEngine (có session_id nếu là hội thoại nhiều lượt)
             
         Returns:
             Phản hồi từ LLM
         """
+        self._set_lane(plan)
+        return get_loop_runner().run(self.adispatch(plan))
+    
+    async def adispatch(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        """Bản async của dispatch() - nhiều phiên có thể chờ LLM cùng lúc trên một event loop"""
+        self._set_lane(plan)
+        session = self._get_session(plan)
+        result = await self._dispatch_single(plan, self._history(session))
+        self._remember_turn(session, plan, result)
+        return result
+    
+    async def _dispatch_single(self, plan: Dict[str, Any],
+                               session: Optional[ChatSession] = None) -> Dict[str, Any]:
+        """
+        Dispatch một lượt: câu hỏi độc lập (prompt) hoặc lượt tiếp theo của hội thoại (messages)
+        
+        Cả hai dùng chung model nhỏ trước, ensemble, hedging và response cache;
+        semantic cache chỉ dùng cho câu hỏi độc lập vì lượt hội thoại phụ thuộc lịch sử
+        """
         if self.use_mock:
             self.logger.info("📝 Đang dùng mock LLM")
-            response = self._create_high_quality_mock_response(plan)
-            return {
-                "model": "mock",
-                "response": response,
-                "mode": "mock",
-                "quality": "high"
-            }
+            return self._mock_result(plan)
         
         llm_type = plan.get('llm_type', 'chat')
-        model = self.model_priority.get(llm_type, 'llama3:8b')
+        model = self._route_model(llm_type)
+        
+        # Câu hỏi tương tự đã được trả lời trước đó
+        vector, semantic_hit = (None, None) if session is not None else await self._semantic_lookup(plan)
+        if semantic_hit:
+            return self._semantic_result(semantic_hit)
         
-        # Tạo prompt tối ưu
-        prompt = self._create_optimized_prompt(plan, model)
+        if model is None:
+            self.logger.warning("🔌 Tất cả model đều đang ngắt mạch, dùng mock")
+            return self._mock_result(plan, "mock-fallback")
+        
+        # Model nhỏ trả lời trước
+        first_pass = await self._first_pass(plan, model, session)
+        if first_pass is not None:
+            self._semantic_store(plan, vector, first_pass['response'], first_pass['model'])
+            return first_pass
+        
+        # Plan suy luận: nhiều model trả lời song song
+        members = self._ensemble_models(llm_type, model)
+        if len(members) > 1:
+            result = await self._ensemble_call(plan, members, session)
+            if result is not None:
+                self._semantic_store(plan, vector, result['response'], result['model'])
+                return result
         
         # Gọi LLM với retry strategy thông minh
         try:
-            response = self._smart_llm_call(model, prompt, llm_type)
+            response, used_model, cache_hit = await self._generate_with_fallback(plan, model, session)
             
-            # Nếu response không đủ tốt, thử model khác
-            if not self._is_response_adequate(response, llm_type):
-                self.logger.warning(f"Response từ {model} không đủ tốt, thử model backup...")
-                backup_model = self._get_backup_model(model, llm_type)
-                if backup_model and backup_model != model:
-                    response = self._smart_llm_call(backup_model, prompt, llm_type)
-            
-            return {
-                "model": model,
-                "response": response,
-                "mode": "real",
-                "quality": "high" if len(response) > 300 else "medium"
-            }
+            self._semantic_store(plan, vector, response, used_model)
+            return self._real_result(used_model, response, "cache" if cache_hit else "real")
             
         except Exception as e:
             self.logger.error(f"Lỗi khi gọi LLM: {e}")
             # Fallback sang mock response chất lượng cao
-            response = self._create_high_quality_mock_response(plan)
-            return {
-                "model": "mock-fallback",
-                "response": response,
-                "mode": "mock",
-                "quality": "high"
-            }
+            return self._mock_result(plan, "mock-fallback")
+    
+    async def _generate_with_fallback(self, plan: Dict[str, Any], model: str,
+                                      session: Optional[ChatSession] = None) -> Tuple[str, str, bool]:
+        """
+        Gọi model chính, chuyển sang backup nếu response không đạt chuẩn
+        
+        Returns:
+            (response, model đã trả lời, cache_hit)
+        """
+        llm_type = plan.get('llm_type', 'chat')
+        backup_model = self._pick_backup_model(model, llm_type)
+        has_backup = backup_model is not None
+        
+        if self.hedging_config.get('enabled') and has_backup:
+            return await self._hedged_llm_call(plan, model, backup_model, session)
+        
+        try:
+            response, cache_hit = await self._ask_model(plan, model, session)
+        except CircuitOpenError:
+            # Mạch vừa mở sau khi chọn model (request song song khác vừa lỗi)
+            if not has_backup:
+                raise
+            self.logger.warning(f"🔌 {model} vừa bị ngắt mạch, thử model backup...")
+            response, cache_hit = await self._ask_model(plan, backup_model, session)
+            return response, backup_model, cache_hit
+        
+        # Nếu response không đủ tốt, thử model khác
+        if not self._is_response_adequate(response, llm_type) and has_backup:
+            self.logger.warning(f"Response từ {model} không đủ tốt, thử model backup...")
+            response, cache_hit = await self._ask_model(plan, backup_model, session)
+            return response, backup_model, cache_hit
+        
+        return response, model, cache_hit
+    
+    def _ensemble_models(self, llm_type: str, model: str) -> List[str]:
+        """Model tham gia ensemble: model đã chọn, rồi theo fallback_strategy và profile"""
+        config = self.ensemble_config
+        if not config['enabled'] or llm_type not in config['llm_types']:
+            return []
+        
+        strategy = (self.model_optimization.get('fallback_strategy') or {}).get(llm_type) or {}
+        ordered = [model] + [strategy.get(tier) for tier in ('primary', 'secondary', 'tertiary')] \
+            + self.model_candidates.get(llm_type, [])
+        
+        members = []
+        for candidate in ordered:
+            if candidate and candidate not in members and candidate in self.available_models \
+                    and self.circuit_breakers.is_available(candidate):
+                members.append(candidate)
+        return members[:config['size']]
+    
+    async def _ensemble_call(self, plan: Dict[str, Any], members: List[str],
+                             session: Optional[ChatSession] = None) -> Optional[Dict[str, Any]]:
+        """Gọi song song các model (thời gian = model chậm nhất), chọn câu trả lời tốt nhất"""
+        self.logger.info(f"🎼 Ensemble {members}")
+        
+        async def ask(model: str) -> Tuple[str, str]:
+            response, _ = await self._ask_model(plan, model, session)
+            return model, response
+        
+        # Task con kế thừa context nên giữ lane ưu tiên của request
+        answers = []
+        outcomes = await asyncio.gather(*[ask(model) for model in members], return_exceptions=True)
+        for member, outcome in zip(members, outcomes):
+            if isinstance(outcome, Exception):
+                self.logger.warning(f"Thành viên ensemble {member} lỗi: {outcome}")
+            else:
+                answers.append(outcome)
+        
+        if not answers:
+            return None
+        model, response, judge = await self._judge_answers(plan, answers)
+        return self._ensemble_result(model, response, judge, answers)
+    
+    async def _judge_answers(self, plan: Dict[str, Any], answers: List[Tuple[str, str]]) -> Tuple[str, str, str]:
+        """Chọn câu trả lời: judge model nếu cấu hình và chọn được, không thì chấm heuristic"""
+        if len(answers) > 1 and self.ensemble_config['judge'] == 'model':
+            judge_request = self._judge_request(plan, answers)
+            if judge_request is not None:
+                judge_model, prompt = judge_request
+                try:
+                    verdict = await self._smart_llm_call(judge_model, prompt, 'judge')
+                    choice = self._parse_judge_choice(verdict, len(answers))
+                    if choice is not None:
+                        return answers[choice][0], answers[choice][1], judge_model
+                except Exception as e:
+                    self.logger.warning(f"Judge {judge_model} lỗi, dùng heuristic: {e}")
+        
+        llm_type = plan.get('llm_type', 'chat')
+        model, response = max(answers, key=lambda answer: self._score_answer(answer[1], llm_type))
+        return model, response, "heuristic"
+    
+    def _judge_request(self, plan: Dict[str, Any], answers: List[Tuple[str, str]]) -> Optional[Tuple[str, str]]:
+        """(judge model, prompt) yêu cầu chọn số thứ tự câu trả lời tốt nhất"""
+        judge_model = self.ensemble_config['judge_model']
+        if judge_model not in self.available_models or not self.circuit_breakers.is_available(judge_model):
+            return None
+        
+        excerpt = self.ensemble_config['judge_excerpt_chars']
+        candidates = "\n\n".join(
+            f"[{index}]\n{response[:excerpt]}" for index, (_, response) in enumerate(answers, 1)
+        )
+        prompt = f"""Bạn là giám khảo. Chọn câu trả lời đúng, đầy đủ và rõ ràng nhất cho câu hỏi.
+
+CÂU HỎI: {plan.get('user_input', '')}
+
+{candidates}
+
+Chỉ trả lời bằng MỘT con số (1-{len(answers)}):"""
+        return judge_model, prompt
+    
+    @staticmethod
+    def _parse_judge_choice(verdict: str, count: int) -> Optional[int]:
+        match = re.search(r'\d+', verdict or '')
+        if match and 1 <= int(match.group()) <= count:
+            return int(match.group()) - 1
+        return None
+    
+    def _score_answer(self, response: str, llm_type: str) -> float:
+        """Điểm heuristic: đạt chuẩn, độ dài (có trần) và mức độ có cấu trúc"""
+        score = 10.0 if self._is_response_adequate(response, llm_type) else 0.0
+        score += min(len(response), 3000) / 300
+        structured = sum(1 for line in response.splitlines()
+                         if re.match(r'\s*(?:[-*•]|\d+[.)]|#+)\s', line))
+        return score + min(structured, 5)
+    
+    def _ensemble_result(self, model: str, response: str, judge: str,
+                         answers: List[Tuple[str, str]]) -> Dict[str, Any]:
+        self.logger.info(f"🏆 Ensemble chọn {model} ({judge})")
+        result = self._real_result(model, response)
+        result['ensemble'] = {"models": [m for m, _ in answers], "judge": judge}
+        return result
+    
+    def _pick_backup_model(self, model: str, llm_type: str) -> Optional[str]:
+        """Model backup chưa bị ngắt mạch, ưu tiên backup_map rồi tới danh sách profile"""
+        preferred = self._get_backup_model(model, llm_type)
+        for candidate in [preferred] + self.model_candidates.get(llm_type, []):
+            if candidate and candidate != model and self.circuit_breakers.is_available(candidate):
+                return candidate
+        return None
+    
+    async def _hedged_llm_call(self, plan: Dict[str, Any], model: str, backup_model: str,
+                               session: Optional[ChatSession] = None) -> Tuple[str, str, bool]:
+        """Đua model chính với backup (khởi động trễ), response đạt chuẩn đầu tiên thắng"""
+        llm_type = plan.get('llm_type', 'chat')
+        inputs = {candidate: self._call_input(plan, candidate, session) for candidate in (model, backup_model)}
+        keys = {candidate: self._cache_key(candidate, prompt, llm_type, messages)
+                for candidate, (prompt, messages) in inputs.items()}
+        for candidate in (model, backup_model):
+            cached = self.response_cache.get(keys[candidate])
+            if cached is not None:
+                return cached, candidate, True
+        
+        def stream(candidate: str):
+            prompt, messages = inputs[candidate]
+            return self._smart_llm_stream(candidate, prompt, llm_type, messages=messages)
+        
+        response, winner = await arun_hedged(
+            (model, lambda: stream(model)),
+            (backup_model, lambda: stream(backup_model)),
+            lambda text: self._is_response_adequate(text, llm_type),
+            self.hedging_config
+        )
+        
+        if self._is_response_adequate(response, llm_type):
+            self.response_cache.set(keys[winner], response)
+        return response, winner, False
+    
+    def _call_input(self, plan: Dict[str, Any], model: str,
+                    session: Optional[ChatSession] = None) -> Tuple[str, Optional[List[Dict[str, str]]]]:
+        """(prompt, messages) cho model: lượt hội thoại gửi messages /api/chat, câu hỏi độc lập gửi prompt"""
+        if session is not None:
+            return '', self._create_session_messages(plan, model, session)
+        return self._create_optimized_prompt(plan, model), None
+    
+    async def _ask_model(self, plan: Dict[str, Any], model: str,
+                         session: Optional[ChatSession] = None) -> Tuple[str, bool]:
+        """Hỏi một model qua response cache với prompt/messages tạo riêng cho model đó"""
+        prompt, messages = self._call_input(plan, model, session)
+        return await self._cached_llm_call(model, prompt, plan.get('llm_type', 'chat'), messages)
+    
+    def _real_result(self, model: str, response: str, mode: str = "real") -> Dict[str, Any]:
+        """Đóng gói kết quả từ LLM thực (mode 'cache'/'semantic_cache' nếu lấy từ cache, 'degraded' nếu stream bị đứt)"""
+        return {
+            "model": model,
+            "response": response,
+            "mode": mode,
+            "quality": "high" if len(response) > 300 else "medium",
+            "cache": self.response_cache.stats(),
+            "semantic_cache": self.semantic_cache.stats(),
+            "circuits": self.circuit_breakers.snapshot(),
+            "warm_pool": self.warm_pool.snapshot(),
+            "sessions": self.sessions.stats(),
+            "queue": self.dispatch_queue.stats(),
+            "hosts": self.host_pool.snapshot(),
+            "tiered": dict(self.tier_stats)
+        }
+    
+    def _semantic_result(self, hit: Dict[str, Any]) -> Dict[str, Any]:
+        """Kết quả lấy từ semantic cache, kèm độ tương đồng"""
+        self.logger.info(f"🧭 Semantic cache hit (similarity {hit['similarity']})")
+        result = self._real_result(hit['model'], hit['response'], "semantic_cache")
+        result['similarity'] = hit['similarity']
+        return result
+    
+    def _embedding_request(self, plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Request embedding ({"path", "body"}) cho user_input đã chuẩn hóa (None nếu không dùng)"""
+        user_input = plan.get('user_input', '')
+        if not self.embedding_model or not user_input.strip():
+            return None
+        path, body = self.provider.embedding_request(self.embedding_model, normalize_prompt(user_input))
+        return {"path": path, "body": body}
+    
+    async def _semantic_lookup(self, plan: Dict[str, Any]) -> Tuple[Optional[List[float]], Optional[Dict[str, Any]]]:
+        """Embed câu hỏi và tra semantic cache, trả về (vector, hit)"""
+        payload = self._embedding_request(plan)
+        if payload is None:
+            return None, None
+        
+        try:
+            with self.host_pool.lease(self.embedding_model) as base_url:
+                status, data = await self.ahttp.request_json(
+                    'POST', f"{base_url}{payload['path']}", json=payload['body'],
+                    headers=self.provider.headers(),
+                    timeout=self.semantic_cache.config['embedding_timeout']
+                )
+            vector = self.provider.parse_embedding(data) if status == 200 else None
+        except Exception as e:
+            self.logger.debug(f"Không thể tạo embedding: {str(e)[:50]}")
+            vector = None
+        
+        if not vector:
+            return None, None
+        return vector, self.semantic_cache.lookup(
+            vector, plan.get('intent', 'chat'), plan.get('language', 'vi'), self._semantic_context(plan)
+        )
+    
+    def _semantic_store(self, plan: Dict[str, Any], vector: Optional[List[float]],
+                        response: str, model: str):
+        """Lưu câu trả lời đạt chuẩn vào semantic cache"""
+        if vector and self._is_response_adequate(response, plan.get('llm_type', 'chat')):
+            self.semantic_cache.add(
+                vector, plan.get('intent', 'chat'), plan.get('language', 'vi'), response, model,
+                self._semantic_context(plan)
+            )
+    
+    def _semantic_context(self, plan: Dict[str, Any]) -> str:
+        """Id các tài liệu kèm prompt: cùng câu hỏi nhưng khác tài liệu thì không dùng lại câu trả lời"""
+        ids = []
+        for doc in plan.get('documents') or []:
+            doc_id = doc.get('doc_id') if isinstance(doc, dict) else None
+            if doc_id is None:
+                text = doc.get('content', '') if isinstance(doc, dict) else str(doc)
+                doc_id = hashlib.md5(text.encode('utf-8')).hexdigest()
+            elif doc.get('chunk') is not None:
+                doc_id = f"{doc_id}#{doc['chunk']}"
+            ids.append(str(doc_id))
+        return ",".join(ids)
+    
+    def _cache_key(self, model: str, prompt: str, llm_type: str,
+                   messages: Optional[List[Dict[str, str]]] = None) -> str:
+        """Key response cache: model + prompt (lượt hội thoại: toàn bộ messages) + options sinh thực tế"""
+        payload, _ = self._build_generate_request(model, prompt, llm_type, messages=messages)
+        if messages is not None:
+            prompt = json.dumps(messages, ensure_ascii=False)
+        return self.response_cache.make_key(model, prompt, payload['options'])
+    
+    async def _cached_llm_call(self, model: str, prompt: str, llm_type: str,
+                               messages: Optional[List[Dict[str, str]]] = None) -> Tuple[str, bool]:
+        """Gọi LLM qua response cache, trả về (response, cache_hit)"""
+        key = self._cache_key(model, prompt, llm_type, messages)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            self.logger.info(f"💾 Cache hit cho {model}")
+            return cached, True
+        
+        response = await self._smart_llm_call(model, prompt, llm_type, messages=messages)
+        # Chỉ cache response đạt chuẩn để lần retry sau không nhận lại response kém
+        if self._is_response_adequate(response, llm_type):
+            self.response_cache.set(key, response)
+        return response, False
+    
+    def _mock_result(self, plan: Dict[str, Any], model: str = "mock") -> Dict[str, Any]:
+        """Đóng gói mock response chất lượng cao"""
+        return {
+            "model": model,
+            "response": self._create_high_quality_mock_response(plan),
+            "mode": "mock",
+            "quality": "high"
+        }
+    
+    def dispatch_structured(self, plan: Dict[str, Any],
+                            schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Dispatch task cần output JSON (Ollama `format`: 'json' hoặc JSON schema)
+        
+        Output được kiểm tra trong lúc stream: prefix không thể thành JSON hợp lệ
+        thì dừng sinh ngay và chuyển sang model backup (tối đa max_attempts model)
+        
+        Returns:
+            {"model", "data", "response", "mode": "structured"}; data là None nếu
+            không model nào trả về JSON đúng schema
+        """
+        self._set_lane(plan)
+        return get_loop_runner().run(self.adispatch_structured(plan, schema))
+    
+    async def adispatch_structured(self, plan: Dict[str, Any],
+                                   schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Bản async của dispatch_structured()"""
+        self._set_lane(plan)
+        if self.use_mock:
+            return self._structured_result("mock", None, "", "mock")
+        
+        llm_type = plan.get('llm_type', 'chat')
+        output_format = schema or 'json'
+        for model in self._structured_models(llm_type):
+            prompt = self._create_structured_prompt(plan, model, schema)
+            validator = JSONStreamValidator(schema)
+            stream = self._smart_llm_stream(model, prompt, llm_type, output_format=output_format)
+            try:
+                async for chunk in stream:
+                    validator.feed(chunk)
+                return self._structured_result(model, validator.finish(), validator.text)
+            except StructuredOutputError as e:
+                self.logger.warning(f"🧩 {model} trả JSON không hợp lệ: {e}")
+            except Exception as e:
+                self.logger.error(f"Lỗi khi gọi LLM (structured): {e}")
+            finally:
+                # Đóng stream = đóng kết nối, server dừng sinh phần còn lại
+                await stream.aclose()
+        
+        return self._structured_result(None, None, "", "structured-failed")
+    
+    def _structured_models(self, llm_type: str) -> List[str]:
+        """Model chính rồi các model backup, tối đa max_attempts"""
+        model = self._route_model(llm_type)
+        if model is None:
+            return []
+        models = [model]
+        while len(models) < self.structured_config['max_attempts']:
+            backup = self._pick_backup_model(models[-1], llm_type)
+            if backup is None or backup in models:
+                break
+            models.append(backup)
+        return models
+    
+    def _structured_result(self, model: Optional[str], data: Any, response: str,
+                           mode: str = "structured") -> Dict[str, Any]:
+        return {"model": model, "data": data, "response": response, "mode": mode}
+    
+    def dispatch_stream(self, plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Dispatch task và trả về token theo dạng stream
+        
+        Args:
+            plan: Kế hoạch từ ReasoningEngine
+            
+        Yields:
+            {"chunk": str, "model": str, "done": False} cho từng đoạn text,
+            cuối cùng {"chunk": "", "done": True, "result": <như dispatch()>}
+        """
+        self._set_lane(plan)
+        return get_loop_runner().iterate(self.adispatch_stream(plan))
+    
+    async def adispatch_stream(self, plan: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Bản async của dispatch_stream() (cùng định dạng event)"""
+        self._set_lane(plan)
+        session = self._get_session(plan)
+        async for event in self._dispatch_single_stream(plan, self._history(session)):
+            if event.get('done'):
+                self._remember_turn(session, plan, event['result'])
+            yield event
+    
+    async def _dispatch_single_stream(self, plan: Dict[str, Any],
+                                      session: Optional[ChatSession] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Bản stream của _dispatch_single()"""
+        if self.use_mock:
+            self.logger.info("📝 Đang dùng mock LLM (stream)")
+            result = self._mock_result(plan)
+            yield {"chunk": result['response'], "model": "mock", "done": False}
+            yield {"chunk": "", "done": True, "result": result}
+            return
+        
+        llm_type = plan.get('llm_type', 'chat')
+        model = self._route_model(llm_type)
+        
+        vector, semantic_hit = (None, None) if session is not None else await self._semantic_lookup(plan)
+        if semantic_hit:
+            result = self._semantic_result(semantic_hit)
+            yield {"chunk": result['response'], "model": result['model'], "done": False}
+            yield {"chunk": "", "done": True, "result": result}
+            return
+        
+        if model is None:
+            self.logger.warning("🔌 Tất cả model đều đang ngắt mạch, dùng mock")
+            result = self._mock_result(plan, "mock-fallback")
+            yield {"chunk": result['response'], "model": "mock-fallback", "done": False}
+            yield {"chunk": "", "done": True, "result": result}
+            return
+        
+        # Model nhỏ trả lời trước; không có event nào nghĩa là phải lên model lớn
+        small_model = self._tier_model(plan, model)
+        if small_model is not None:
+            answered = False
+            async for event in self._first_pass_stream(plan, small_model, vector, session):
+                answered = True
+                yield event
+            if answered:
+                return
+        
+        prompt, messages = self._call_input(plan, model, session)
+        cache_key = self._cache_key(model, prompt, llm_type, messages)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f"💾 Cache hit cho {model}")
+            for event in self._result_events(self._real_result(model, cached, "cache")):
+                yield event
+            return
+        
+        # Response đã hiển thị cho user nên không đổi sang model backup giữa chừng
+        chunks, failed = [], False
+        try:
+            async for chunk in self._smart_llm_stream(model, prompt, llm_type, messages=messages):
+                chunks.append(chunk)
+                yield {"chunk": chunk, "model": model, "done": False}
+        except Exception as e:
+            self.logger.error(f"Lỗi khi stream LLM: {e}")
+            if not chunks:
+                result = self._mock_result(plan, "mock-fallback")
+                yield {"chunk": result['response'], "model": "mock-fallback", "done": False}
+                yield {"chunk": "", "done": True, "result": result}
+                return
+            failed = True
+        
+        response = ''.join(chunks)
+        yield {"chunk": "", "done": True,
+               "result": self._stream_result(plan, vector, model, response, cache_key, failed)}
+    
+    def _tier_model(self, plan: Dict[str, Any], model: str) -> Optional[str]:
+        """Model nhỏ cho lượt trả lời đầu (None nếu không áp dụng tiered cho plan)"""
+        config = self.tiered_config
+        if not config['enabled'] or plan.get('llm_type', 'chat') not in config['llm_types']:
+            return None
+        if len(plan.get('user_input', '')) > config['max_input_chars']:
+            return None
+        
+        for candidate in config['models']:
+            if candidate != model and candidate in self.available_models \
+                    and self.circuit_breakers.is_available(candidate):
+                return candidate
+        return None
+    
+    async def _first_pass(self, plan: Dict[str, Any], model: str,
+                          session: Optional[ChatSession] = None) -> Optional[Dict[str, Any]]:
+        """Hỏi model nhỏ trước; trả về kết quả nếu đạt, None nếu cần model lớn"""
+        small_model = self._tier_model(plan, model)
+        if small_model is None:
+            return None
+        
+        llm_type = plan.get('llm_type', 'chat')
+        try:
+            response, cache_hit = await self._ask_model(plan, small_model, session)
+        except Exception as e:
+            self.logger.warning(f"Model nhỏ {small_model} lỗi: {e}")
+            return None
+        
+        if not self._accept_first_pass(small_model, response, llm_type, complete=True):
+            return None
+        return self._real_result(small_model, response, "cache" if cache_hit else "real")
+    
+    async def _first_pass_stream(self, plan: Dict[str, Any], small_model: str,
+                                 vector: Optional[List[float]],
+                                 session: Optional[ChatSession] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Bản stream của _first_pass(): giữ lại đoạn đầu để kiểm tra trước khi hiển thị
+        
+        Không yield gì nếu model nhỏ không đạt (người gọi chuyển sang model lớn)
+        """
+        llm_type = plan.get('llm_type', 'chat')
+        prompt, messages = self._call_input(plan, small_model, session)
+        cache_key = self._cache_key(small_model, prompt, llm_type, messages)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f"💾 Cache hit cho {small_model}")
+            if self._accept_first_pass(small_model, cached, llm_type, complete=True):
+                for event in self._result_events(self._real_result(small_model, cached, "cache")):
+                    yield event
+            return
+        
+        stream = self._smart_llm_stream(small_model, prompt, llm_type, messages=messages)
+        
+        head, complete = [], True
+        try:
+            async for chunk in stream:
+                head.append(chunk)
+                if len(''.join(head)) >= self.tiered_config['check_chars']:
+                    complete = False
+                    break
+        except Exception as e:
+            self.logger.warning(f"Model nhỏ {small_model} lỗi: {e}")
+            return
+        
+        if not self._accept_first_pass(small_model, ''.join(head), llm_type, complete):
+            await stream.aclose()
+            return
+        
+        chunks, failed = list(head), False
+        yield {"chunk": ''.join(head), "model": small_model, "done": False}
+        try:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield {"chunk": chunk, "model": small_model, "done": False}
+        except Exception as e:
+            self.logger.error(f"Lỗi khi stream LLM: {e}")
+            failed = True
+        
+        response = ''.join(chunks)
+        yield {"chunk": "", "done": True,
+               "result": self._stream_result(plan, vector, small_model, response, cache_key, failed)}
+    
+    def _stream_result(self, plan: Dict[str, Any], vector: Optional[List[float]], model: str,
+                       response: str, cache_key: str, failed: bool) -> Dict[str, Any]:
+        """
+        Kết quả cuối của một stream
+        
+        Stream đứt giữa chừng: phần đã nhận vẫn trả cho user nhưng đánh dấu 'degraded'
+        và không lưu vào response cache / semantic cache
+        """
+        if failed:
+            self.logger.warning(f"⚠️ Stream {model} bị đứt, không cache response dở dang")
+            return self._real_result(model, response, "degraded")
+        if self._is_response_adequate(response, plan.get('llm_type', 'chat')):
+            self.response_cache.set(cache_key, response)
+        self._semantic_store(plan, vector, response, model)
+        return self._real_result(model, response)
+    
+    def _accept_first_pass(self, small_model: str, response: str, llm_type: str,
+                           complete: bool) -> bool:
+        """
+        Kiểm tra nhanh câu trả lời của model nhỏ
+        
+        Args:
+            complete: False nếu mới có đoạn đầu (stream) - chưa xét độ dài tối thiểu
+        """
+        lowered = response.lower()
+        confident = not any(marker in lowered for marker in self.tiered_config['uncertainty_markers'])
+        if complete:
+            confident = confident and self._is_response_adequate(response, llm_type)
+        else:
+            confident = confident and bool(response.strip())
+        
+        if confident:
+            self.tier_stats['first_pass'] += 1
+            self.logger.info(f"🪶 {small_model} trả lời đạt, không cần model lớn")
+        else:
+            self.tier_stats['escalated'] += 1
+            self.logger.info(f"⬆️ Response từ {small_model} chưa đạt, chuyển lên model lớn")
+        return confident
+    
+    def _set_lane(self, plan: Dict[str, Any]):
+        """Đặt lane ưu tiên của request hiện tại cho hàng đợi model"""
+        # Mỗi lần dispatch đều đặt lại nên không cần reset khi kết thúc
+        current_lane.set(plan.get('priority', 'interactive'))
+    
+    def _get_session(self, plan: Dict[str, Any]) -> Optional[ChatSession]:
+        """Session hội thoại của plan (None nếu không có session_id hoặc đang mock)"""
+        if self.use_mock:
+            return None
+        return self.sessions.get(plan.get('session_id'))
+    
+    def _history(self, session: Optional[ChatSession]) -> Optional[ChatSession]:
+        """Session chỉ dùng cho lời gọi khi đã có lịch sử, lượt đầu gửi prompt như câu hỏi độc lập"""
+        return session if session is not None and session.has_history else None
+    
+    def _remember_turn(self, session: Optional[ChatSession], plan: Dict[str, Any],
+                       result: Dict[str, Any]):
+        """Lưu lượt vừa trả lời vào session (bỏ qua mock)"""
+        if session is None or result.get('mode') == 'mock' or not result.get('response'):
+            return
+        session.add_turn(self._create_session_user_message(plan, result['model']), result['response'])
+    
+    def _result_events(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Event stream cho kết quả có sẵn (mock, cache): một chunk rồi event kết thúc"""
+        return [
+            {"chunk": result['response'], "model": result['model'], "done": False},
+            {"chunk": "", "done": True, "result": result}
+        ]
+    
+    def _create_session_messages(self, plan: Dict[str, Any], model: str,
+                                 session: ChatSession) -> List[Dict[str, str]]:
+        """Messages /api/chat: system prefix ổn định theo loại model, phần thay đổi nằm ở câu hỏi mới"""
+        system = self._create_session_system_prompt(model)
+        user = self._create_session_user_message(plan, model)
+        llm_type = plan.get('llm_type', 'chat')
+        budget = self.prompt_budget.input_budget(model, self._num_predict(model, llm_type), llm_type)
+        budget -= estimate_tokens(system) + estimate_tokens(user)
+        
+        # Tài liệu tham khảo chỉ gửi ở lượt hiện tại, không lưu vào lịch sử (tối đa nửa ngân sách còn lại)
+        references = self._format_references(self.prompt_budget.pack(self._plan_documents(plan), budget // 2))
+        if references:
+            user = f"{references.rstrip(' ')}{user}"
+            budget -= estimate_tokens(references)
+        # Lịch sử chỉ giữ các lượt gần nhất còn vừa context window
+        return session.build_messages(system, user, budget)
+    
+    def _create_session_system_prompt(self, model: str) -> str:
+        """System prefix không phụ thuộc câu hỏi để Ollama dùng lại KV cache giữa các lượt"""
+        if 'coder' in model.lower() or 'code' in model.lower():
+            return """You are an expert programming assistant.
+
+REQUIREMENTS:
+1. Write FULL, COMPLETE, RUNNABLE code
+2. Include comprehensive comments explaining the logic
+3. Include error handling
+4. Include example usage with test cases
+5. Use best practices and clean code principles"""
+        
+        return """Bạn là trợ lý AI của hệ thống ORCHESTRATOR.
+
+YÊU CẦU QUAN TRỌNG:
+1. Trả lời ĐẦY ĐỦ, CHI TIẾT, không cắt ngang
+2. Tổ chức thông tin có cấu trúc rõ ràng
+3. Đưa ví dụ cụ thể khi có thể"""
+    
+    def _create_session_user_message(self, plan: Dict[str, Any], model: str) -> str:
+        """Câu hỏi của lượt hiện tại kèm yêu cầu ngôn ngữ và yêu cầu theo intent"""
+        llm_type = plan.get('llm_type', 'chat')
+        num_predict = self._num_predict(model, llm_type)
+        user_input = self.prompt_budget.fit_text(plan.get('user_input', ''),
+                                                 self.prompt_budget.input_budget(model, num_predict, llm_type) // 2)
+        
+        if 'coder' in model.lower() or 'code' in model.lower():
+            target_lang = self._detect_code_language(user_input)
+            return f"USER REQUEST: {user_input}\n\nComplete {target_lang.upper()} code:"
+        
+        lang_requirement = "Trả lời bằng TIẾNG VIỆT 100%." if plan.get('language', 'vi') == 'vi' else "Answer in ENGLISH 100%."
+        return f"{lang_requirement}\n\n{user_input}{self._intent_requirements(plan.get('intent', 'chat'))}"
     
     def _create_optimized_prompt(self, plan: Dict[str, Any], model: str) -> str:
         """Tạo prompt tối ưu cho từng model"""
         intent = plan.get('intent', 'chat')
-        user_input = plan.get('user_input', '')
         language = plan.get('language', 'vi')
         
         # ĐẶC BIỆT: Nếu là coding model (deepseek-coder), dùng prompt tiếng Anh
@@ -196,108 +954,286 @@ class LLMDispatcher:
         # Xác định yêu cầu ngôn ngữ cho các model khác
         lang_requirement = "Trả lời bằng TIẾNG VIỆT 100%." if language == 'vi' else "Answer in ENGLISH 100%."
         
-        # Prompt base
-        prompt_base = f"""{lang_requirement}
+        # Prompt base (+ yêu cầu đặc biệt theo intent)
+        return self._fit_prompt(plan, model, lambda user_input, references: f"""{lang_requirement}
 
     YÊU CẦU QUAN TRỌNG:
     1. Trả lời ĐẦY ĐỦ, CHI TIẾT, không cắt ngang
     2. Tổ chức thông tin có cấu trúc rõ ràng
     3. Đưa ví dụ cụ thể khi có thể
 
-    CÂU HỎI/ YÊU CẦU: {user_input}
+    {references}CÂU HỎI/ YÊU CẦU: {user_input}
 
-    BẮT ĐẦU TRẢ LỜI:"""
+    BẮT ĐẦU TRẢ LỜI:""" + self._intent_requirements(intent))
+    
+    def _create_structured_prompt(self, plan: Dict[str, Any], model: str,
+                                  schema: Optional[Dict[str, Any]]) -> str:
+        """Prompt yêu cầu output chỉ gồm một object JSON (kèm schema nếu có)"""
+        language = plan.get('language', 'vi')
+        lang_requirement = "Nội dung bằng TIẾNG VIỆT." if language == 'vi' else "Content in ENGLISH."
+        schema_text = (f"\n    JSON SCHEMA:\n    {json.dumps(schema, ensure_ascii=False)}\n"
+                       if schema else "")
+        
+        return self._fit_prompt(plan, model, lambda user_input, references: f"""Chỉ trả lời bằng MỘT object JSON hợp lệ, không thêm văn bản hay markdown. {lang_requirement}
+    {schema_text}
+    {references}YÊU CẦU: {user_input}""")
+    
+    def _fit_prompt(self, plan: Dict[str, Any], model: str, render) -> str:
+        """
+        Dựng prompt vừa context window của model
+        
+        Args:
+            render: Hàm (user_input, references) -> prompt
+        
+        Phần cố định được đo trước; câu hỏi quá dài bị rút gọn, tài liệu tham khảo
+        (plan['documents'], đã xếp theo độ liên quan) lấp phần ngân sách còn lại
+        """
+        llm_type = plan.get('llm_type', 'chat')
+        num_predict = self._num_predict(model, llm_type)
+        budget = self.prompt_budget.input_budget(model, num_predict, llm_type) - estimate_tokens(render('', ''))
         
-        # Thêm yêu cầu đặc biệt theo intent
+        user_input = self.prompt_budget.fit_text(plan.get('user_input', ''), budget)
+        documents = self.prompt_budget.pack(self._plan_documents(plan),
+                                            budget - estimate_tokens(user_input))
+        return render(user_input, self._format_references(documents))
+    
+    def _plan_documents(self, plan: Dict[str, Any]) -> List[str]:
+        """Nội dung tài liệu truy xuất kèm theo plan (chuỗi hoặc dict có 'content')"""
+        documents = []
+        for doc in plan.get('documents') or []:
+            text = doc.get('content', '') if isinstance(doc, dict) else str(doc)
+            if text.strip():
+                documents.append(text.strip())
+        return documents
+    
+    def _format_references(self, documents: List[str]) -> str:
+        """Khối tài liệu tham khảo đặt trước câu hỏi (rỗng nếu không có)"""
+        if not documents:
+            return ""
+        body = "\n\n".join(f"[{i}] {doc}" for i, doc in enumerate(documents, 1))
+        return f"TÀI LIỆU THAM KHẢO:\n{body}\n\n    "
+    
+    def _intent_requirements(self, intent: str) -> str:
+        """Yêu cầu bổ sung theo intent, nối vào cuối prompt"""
         if intent == 'coding':
-            prompt_base += "\n\n[YÊU CẦU CODE]\n- Code phải đầy đủ, có thể chạy được\n- Có comment giải thích\n- Có ví dụ sử dụng\n- Có xử lý lỗi"
+            return "\n\n[YÊU CẦU CODE]\n- Code phải đầy đủ, có thể chạy được\n- Có comment giải thích\n- Có ví dụ sử dụng\n- Có xử lý lỗi"
         elif intent in ['research', 'web_search']:
-            prompt_base += "\n\n[YÊU CẦU NGHIÊN CỨU]\n- Cung cấp thông tin chi tiết, có cấu trúc\n- Đưa ra các khía cạnh quan trọng\n- Kết thúc với tóm tắt"
-        
-        return prompt_base
+            return "\n\n[YÊU CẦU NGHIÊN CỨU]\n- Cung cấp thông tin chi tiết, có cấu trúc\n- Đưa ra các khía cạnh quan trọng\n- Kết thúc với tóm tắt"
+        return ""
     
-    def _smart_llm_call(self, model: str, prompt: str, llm_type: str) -> str:
-        """Gọi LLM với strategy thông minh"""
-        # Điều chỉnh timeout dựa trên model
+    def _build_generate_request(self, model: str, prompt: str, llm_type: str,
+                                stream: bool = False, messages: Optional[List[Dict[str, str]]] = None,
+                                output_format: Any = None):
+        """
+        Tạo payload /api/generate (hoặc /api/chat nếu có messages) và timeout cho model
+        
+        output_format: 'json' hoặc JSON schema - Ollama ràng buộc output theo grammar tương ứng
+        """
+        # Giá trị khởi điểm, được thay bằng số liệu quan sát khi đã đủ mẫu
         timeouts = {
             'qwen2.5:14b': 45,
             'mixtral:latest': 60,
             'llama3:8b': 30,
             'deepseek-coder:6.7b': 40
         }
-        timeout = timeouts.get(model, 30)
+        timeout = self.latency_stats.timeout_for(model, llm_type, timeouts.get(model, 30))
         
-        # Điều chỉnh max_tokens dựa trên task
+        # Tham số theo profile llm_type + model (llm_profiles.yaml, nạp lại nóng)
+        options = self.param_profiles.resolve(llm_type, model)
+        options['num_predict'] = self._num_predict(model, llm_type)
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": options
+        }
+        if self.prompt_budget.enabled or 'num_ctx' in options:
+            # Khai báo rõ num_ctx để Ollama không âm thầm cắt prompt ở context mặc định
+            payload['options']['num_ctx'] = self.prompt_budget.num_ctx(model, llm_type)
+        if messages is not None:
+            del payload['prompt']
+            payload['messages'] = messages
+        if output_format is not None:
+            payload['format'] = output_format
+            payload['options']['temperature'] = self.structured_config['temperature']
+        keep_alive = self.warm_pool.keep_alive_for(model)
+        if keep_alive:
+            payload['keep_alive'] = keep_alive
+        return payload, timeout
+    
+    def _num_predict(self, model: str, llm_type: str) -> int:
+        """Số token tối đa model được sinh cho task (max_tokens của profile, giới hạn theo SLO và context)"""
+        # Mặc định cho llm_type không khai báo max_tokens trong profile
         max_tokens_map = {
             'coding': 4096,
             'research': 3072,
             'web_search': 3072,
-            'chat': 2048
+            'chat': 2048,
+            'judge': 16
         }
-        max_tokens = max_tokens_map.get(llm_type, 2048)
+        configured = self.param_profiles.resolve(llm_type, model).get('num_predict')
+        max_tokens = int(configured or max_tokens_map.get(llm_type, 2048))
+        if self.prompt_budget.enabled:
+            max_tokens = min(max_tokens, self.prompt_budget.max_predict(model, llm_type))
+        return self.latency_stats.max_tokens_for(model, llm_type, max_tokens)
+    
+    async def _smart_llm_call(self, model: str, prompt: str, llm_type: str,
+                              messages: Optional[List[Dict[str, str]]] = None) -> str:
+        """Gọi LLM qua hàng đợi của model; prompt giống hệt đang chạy thì dùng chung kết quả"""
+        return await self.dispatch_queue.arun(
+            model, self._inflight_key(model, prompt, llm_type, messages),
+            lambda: self._guarded_llm_call(model, prompt, llm_type, messages)
+        )
+    
+    def _inflight_key(self, model: str, prompt: str, llm_type: str,
+                      messages: Optional[List[Dict[str, str]]] = None) -> str:
+        """Key gộp request: toàn bộ payload sinh (trừ keep_alive)"""
+        payload, _ = self._build_generate_request(model, prompt, llm_type, messages=messages)
+        payload.pop('keep_alive', None)
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    async def _guarded_llm_call(self, model: str, prompt: str, llm_type: str,
+                                messages: Optional[List[Dict[str, str]]] = None) -> str:
+        """Gọi LLM qua circuit breaker của model, ghi nhận lỗi và độ trễ"""
+        breaker = self.circuit_breakers.acquire(model)
+        start_time = time.time()
+        try:
+            result = await self._ollama_generate(model, prompt, llm_type, messages)
+        except (asyncio.CancelledError, TransportConfigError):
+            # Task bị hủy (thua hedge, caller dừng) / thiếu aiohttp, url sai - không phải lỗi của model
+            if breaker:
+                breaker.release_probe()
+            raise
+        except Exception:
+            if breaker:
+                breaker.record_failure(time.time() - start_time)
+            raise
+        if breaker:
+            breaker.record_success(time.time() - start_time)
+        self.warm_pool.after_request(model)
+        return result
+    
+    async def _smart_llm_stream(self, model: str, prompt: str, llm_type: str,
+                                messages: Optional[List[Dict[str, str]]] = None,
+                                output_format: Any = None) -> AsyncIterator[str]:
+        """Bản stream của _smart_llm_call() (chỉ xếp hàng, không gộp), dừng đọc giữa chừng không tính là lỗi"""
+        async with self.dispatch_queue.aslot(model):
+            breaker = self.circuit_breakers.acquire(model)
+            start_time = time.time()
+            try:
+                async for chunk in self._ollama_generate_stream(model, prompt, llm_type, messages,
+                                                                output_format):
+                    yield chunk
+            except (GeneratorExit, asyncio.CancelledError, TransportConfigError):
+                # Người đọc đóng stream / task bị hủy (vd. thua hedge) / lỗi cấu hình client
+                # - không phải lỗi của model
+                if breaker:
+                    breaker.release_probe()
+                raise
+            except Exception:
+                if breaker:
+                    breaker.record_failure(time.time() - start_time)
+                raise
+            if breaker:
+                breaker.record_success(time.time() - start_time)
+            self.warm_pool.after_request(model)
+    
+    async def _ollama_generate(self, model: str, prompt: str, llm_type: str,
+                               messages: Optional[List[Dict[str, str]]] = None) -> str:
+        """Gọi LLM với strategy thông minh"""
+        payload, timeout = self._build_generate_request(model, prompt, llm_type, messages=messages)
+        max_tokens = payload['options']['num_predict']
+        path, body = self.provider.generate_request(payload)
         
         try:
-            payload = {
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": max_tokens,
-                    "top_p": 0.9,
-                    "repeat_penalty": 1.1
-                }
-            }
-            
             self.logger.info(f"🤖 Gọi {model} (timeout: {timeout}s, tokens: {max_tokens})")
             start_time = time.time()
             
-            response = requests.post(
-                f"{self.ollama_base}/api/generate",
-                json=payload,
-                timeout=timeout
-            )
+            with self.host_pool.lease(model) as base_url:
+                status, data = await self.ahttp.request_json(
+                    'POST', f"{base_url}{path}", json=body, headers=self.provider.headers(), timeout=timeout
+                )
+                if status >= 500:
+                    # Lỗi phía server tính cho host để host hỏng bị rút khỏi vòng quay
+                    raise Exception(f"API error: {status}")
             
             elapsed = time.time() - start_time
             self.logger.info(f"⏱️  {model} phản hồi trong {elapsed:.2f}s")
             
-            if response.status_code == 200:
-                result = response.json().get('response', '').strip()
+            if status == 200:
+                text, eval_count, eval_duration = self.provider.parse_response(data)
+                self.latency_stats.record(model, llm_type, elapsed, eval_count, eval_duration)
+                result = text.strip()
                 
                 # Kiểm tra và sửa response nếu cần
                 result = self._post_process_response(result, llm_type)
                 
                 return result
             else:
-                raise Exception(f"API error: {response.status_code}")
+                raise Exception(f"API error: {status}")
                 
-        except requests.exceptions.Timeout:
+        except asyncio.TimeoutError:
             self.logger.error(f"⏰ Timeout với {model} sau {timeout}s")
+            self.latency_stats.record_timeout(model, llm_type, timeout)
             raise Exception(f"Model {model} timeout")
         except Exception as e:
             self.logger.error(f"❌ Lỗi với {model}: {e}")
             raise
     
-    def _post_process_response(self, response: str, llm_type: str) -> str:
-        """Xử lý hậu kỳ để cải thiện chất lượng response"""
-        if not response:
-            return "Xin lỗi, tôi không thể tạo phản hồi lúc này."
+    async def _ollama_generate_stream(self, model: str, prompt: str, llm_type: str,
+                                      messages: Optional[List[Dict[str, str]]] = None,
+                                      output_format: Any = None) -> AsyncIterator[str]:
+        """Gọi LLM ở chế độ stream, hậu xử lý phần đuôi theo từng chunk (output có cấu trúc giữ nguyên)"""
+        payload, timeout = self._build_generate_request(model, prompt, llm_type, stream=True,
+                                                        messages=messages, output_format=output_format)
+        path, body = self.provider.generate_request(payload)
+        repair = ResponseStreamProcessor() if output_format is None else None
+        usage = {}
         
-        # Đảm bảo response không bị cắt ngang
-        endings = ['.', '!', '?', '```', '```python', '```bash']
+        self.logger.info(f"🤖 Stream {model} (timeout: {timeout}s, tokens: {payload['options']['num_predict']})")
+        start_time = time.time()
+        first_token_time = None
         
-        # Nếu response không kết thúc bằng dấu kết thúc hợp lý
-        last_char = response.strip()[-1] if response.strip() else ''
+        try:
+            with self.host_pool.lease(model) as base_url:
+                # Timeout áp dụng cho từng lần đọc: tới token đầu và giữa các token
+                async for line in self.ahttp.stream_lines('POST', f"{base_url}{path}", json=body,
+                                                          headers=self.provider.headers(), timeout=timeout):
+                    data = self.provider.parse_stream_line(line)
+                    if data is None:
+                        continue
+                    if data['eval_count']:
+                        usage = data
+                
+                    token = data['text']
+                    if token and first_token_time is None:
+                        first_token_time = time.time() - start_time
+                        self.logger.info(f"⚡ {model} token đầu tiên sau {first_token_time:.2f}s")
+                
+                    ready = repair.feed(token) if repair else token
+                    if ready:
+                        yield ready
+                
+                    if data['done']:
+                        self.latency_stats.record(model, llm_type, time.time() - start_time,
+                                                  usage.get('eval_count'), usage.get('eval_duration'))
+                        break
+        except asyncio.TimeoutError:
+            self.logger.error(f"⏰ Timeout với {model} sau {timeout}s")
+            self.latency_stats.record_timeout(model, llm_type, timeout)
+            raise Exception(f"Model {model} timeout")
         
-        if last_char not in endings and len(response) > 100:
-            # Tìm vị trí kết thúc hợp lý cuối cùng
-            for end_marker in ['.', '!', '?', '\n\n']:
-                end_pos = response.rfind(end_marker)
-                if end_pos > len(response) * 0.7:  # Nếu gần cuối
-                    response = response[:end_pos + 1]
-                    break
+        tail = repair.finish() if repair else ''
+        if tail:
+            yield tail
         
-        return response
+        self.logger.info(f"⏱️  {model} stream xong trong {time.time() - start_time:.2f}s")
+    
+    def _post_process_response(self, response: str, llm_type: str) -> str:
+        """Xử lý hậu kỳ để cải thiện chất lượng response"""
+        # Cùng bộ xử lý với chế độ stream: bỏ lặp + sửa cắt ngang trong một lượt
+        return process_response(response)
     
     def _is_response_adequate(self, response: str, llm_type: str) -> bool:
         """Kiểm tra xem response có đủ chất lượng không"""
@@ -339,27 +1275,12 @@ class LLMDispatcher:
         """
         Tạo prompt đặc biệt cho coding models (tiếng Anh)
         """
-        user_input = plan.get('user_input', '')
-        
-        # Phát hiện ngôn ngữ lập trình từ input
-        language_hints = {
-            'python': ['python', 'pandas', 'numpy', 'def ', 'import '],
-            'javascript': ['javascript', 'js', 'node', 'react', 'function('],
-            'java': ['java', 'class ', 'public static'],
-            'html': ['html', '<div>', '<p>', 'website'],
-            'sql': ['sql', 'database', 'select ', 'insert ']
-        }
-        
-        target_lang = 'python'  # Mặc định
-        for lang, hints in language_hints.items():
-            if any(hint in user_input.lower() for hint in hints):
-                target_lang = lang
-                break
+        target_lang = self._detect_code_language(plan.get('user_input', ''))
         
         # Prompt tiếng Anh cho deepseek-coder
-        prompt = f"""You are an expert programming assistant. Write complete, runnable code in {target_lang.upper()}.
+        return self._fit_prompt(plan, model, lambda user_input, references: f"""You are an expert programming assistant. Write complete, runnable code in {target_lang.upper()}.
 
-    USER REQUEST: {user_input}
+    {references}USER REQUEST: {user_input}
 
     REQUIREMENTS:
     1. Write FULL, COMPLETE, RUNNABLE code
@@ -373,9 +1294,22 @@ class LLMDispatcher:
     - Then provide the complete code in a code block
     - End with example usage and expected output
 
-    Complete {target_lang.upper()} code:"""
+    Complete {target_lang.upper()} code:""")
+    
+    def _detect_code_language(self, user_input: str) -> str:
+        """Phát hiện ngôn ngữ lập trình từ input (mặc định python)"""
+        language_hints = {
+            'python': ['python', 'pandas', 'numpy', 'def ', 'import '],
+            'javascript': ['javascript', 'js', 'node', 'react', 'function('],
+            'java': ['java', 'class ', 'public static'],
+            'html': ['html', '<div>', '<p>', 'website'],
+            'sql': ['sql', 'database', 'select ', 'insert ']
+        }
         
-        return prompt
+        for lang, hints in language_hints.items():
+            if any(hint in user_input.lower() for hint in hints):
+                return lang
+        return 'python'  # Mặc định
     def _create_high_quality_mock_response(self, plan: Dict[str, Any]) -> str:
         """Tạo mock response chất lượng cao"""
         intent = plan.get('intent', 'chat')
@@ -437,4 +1371,18 @@ Hãy kết nối với Ollama để trải nghiệm đầy đủ! 🚀"""
 ✅ Permission and security ready
 ⏳ Waiting for real LLM connection
 
-Connect to Ollama for full experience! 🚀"""
\ No newline at end of file
+Connect to Ollama for full experience! 🚀"""
+
+
+_dispatcher: Optional[LLMDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_llm_dispatcher() -> LLMDispatcher:
+    """Dispatcher dùng chung của process (một bộ cache, hàng đợi, circuit breaker, session)"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = LLMDispatcher()
+    return _dispatcher
@@ -0,0 +1,182 @@
+"""
+LLM PROVIDERS - Giao thức của từng loại server LLM
+Dispatcher luôn dựng payload theo dạng Ollama; provider đổi sang API thực tế của server
+và đọc kết quả về dạng chung (text, eval_count, eval_duration)
+"""
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from .http_transport import load_ollama_settings
+
+
+class LLMProvider:
+    """Giao thức mặc định (Ollama native API)"""
+
+    name = "ollama"
+    manages_residency = True     # Có /api/ps và keep_alive để warm pool điều khiển
+    supports_probe = True        # Có /api/show để probe từng model
+    models_path = "/api/tags"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = config or {}
+
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def generate_request(self, payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """(path, body) cho payload sinh dạng Ollama"""
+        return ("/api/chat" if 'messages' in payload else "/api/generate"), payload
+
+    def parse_response(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        """(text, eval_count, eval_duration nano giây) từ response không stream"""
+        return self._text(data), data.get('eval_count'), data.get('eval_duration')
+
+    def parse_stream_line(self, line: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Đọc một dòng stream
+
+        Returns:
+            {"text", "done", "eval_count", "eval_duration"} hoặc None nếu dòng không mang dữ liệu
+        """
+        data = json.loads(line)
+        if data.get('error'):
+            raise Exception(f"API error: {data['error']}")
+        return {
+            "text": self._text(data),
+            "done": bool(data.get('done')),
+            "eval_count": data.get('eval_count'),
+            "eval_duration": data.get('eval_duration')
+        }
+
+    def embedding_request(self, model: str, text: str) -> Tuple[str, Dict[str, Any]]:
+        return "/api/embeddings", {"model": model, "prompt": text}
+
+    def parse_embedding(self, data: Dict[str, Any]) -> Optional[List[float]]:
+        return data.get('embedding')
+
+    def parse_models(self, data: Dict[str, Any]) -> List[str]:
+        return [m['name'] for m in data.get('models', [])]
+
+    @staticmethod
+    def _text(data: Dict[str, Any]) -> str:
+        """Text trong một response/chunk của /api/generate hoặc /api/chat"""
+        if 'message' in data:
+            return data['message'].get('content', '')
+        return data.get('response', '')
+
+
+OllamaProvider = LLMProvider
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Server theo API OpenAI (llama.cpp server, vLLM, LM Studio...)"""
+
+    name = "openai"
+    manages_residency = False
+    supports_probe = False
+    models_path = "/v1/models"
+
+    def headers(self) -> Dict[str, str]:
+        api_key = self.config.get('api_key')
+        return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def generate_request(self, payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        options = payload.get('options', {})
+        messages = payload.get('messages') or [{"role": "user", "content": payload.get('prompt', '')}]
+        body = {
+            "model": payload['model'],
+            "messages": messages,
+            "stream": payload.get('stream', False),
+            "max_tokens": options.get('num_predict'),
+            "temperature": options.get('temperature'),
+            "top_p": options.get('top_p')
+        }
+        if 'repeat_penalty' in options:
+            # llama.cpp đọc repeat_penalty, vLLM đọc repetition_penalty
+            body['repeat_penalty'] = body['repetition_penalty'] = options['repeat_penalty']
+        if body['stream']:
+            body['stream_options'] = {"include_usage": True}
+        output_format = payload.get('format')
+        if isinstance(output_format, dict):
+            body['response_format'] = {"type": "json_schema",
+                                       "json_schema": {"name": "output", "schema": output_format}}
+        elif output_format == 'json':
+            body['response_format'] = {"type": "json_object"}
+        return "/v1/chat/completions", {k: v for k, v in body.items() if v is not None}
+
+    def parse_response(self, data: Dict[str, Any]) -> Tuple[str, Optional[int], Optional[int]]:
+        choices = data.get('choices') or [{}]
+        text = (choices[0].get('message') or {}).get('content') or ''
+        eval_count, eval_duration = self._usage(data)
+        return text, eval_count, eval_duration
+
+    def parse_stream_line(self, line: bytes) -> Optional[Dict[str, Any]]:
+        # Server-sent events: "data: {...}", kết thúc bằng "data: [DONE]"
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.startswith('data:'):
+            return None
+        raw = line[5:].strip()
+        if raw == '[DONE]':
+            return {"text": "", "done": True, "eval_count": None, "eval_duration": None}
+
+        data = json.loads(raw)
+        if data.get('error'):
+            raise Exception(f"API error: {data['error']}")
+        choices = data.get('choices') or [{}]
+        eval_count, eval_duration = self._usage(data)
+        return {
+            "text": (choices[0].get('delta') or {}).get('content') or '',
+            "done": False,
+            "eval_count": eval_count,
+            "eval_duration": eval_duration
+        }
+
+    def embedding_request(self, model: str, text: str) -> Tuple[str, Dict[str, Any]]:
+        return "/v1/embeddings", {"model": model, "input": text}
+
+    def parse_embedding(self, data: Dict[str, Any]) -> Optional[List[float]]:
+        items = data.get('data') or []
+        return items[0].get('embedding') if items else None
+
+    def parse_models(self, data: Dict[str, Any]) -> List[str]:
+        return [m['id'] for m in data.get('data', [])]
+
+    @staticmethod
+    def _usage(data: Dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+        """Số token sinh ra và thời gian sinh (nano giây) nếu server báo"""
+        timings = data.get('timings') or {}
+        if timings.get('predicted_n') and timings.get('predicted_ms'):
+            # llama.cpp server
+            return timings['predicted_n'], int(timings['predicted_ms'] * 1e6)
+        usage = data.get('usage') or {}
+        return usage.get('completion_tokens'), None
+
+
+PROVIDERS = {
+    "ollama": OllamaProvider,
+    "openai": OpenAICompatibleProvider
+}
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    """Provider dùng chung của process, theo `ollama.provider` trong settings.yaml"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                settings = load_ollama_settings()
+                name = settings.get('provider', 'ollama')
+                if name == 'stub':
+                    # Stub server nói được cả hai giao thức
+                    name = (settings.get('stub') or {}).get('protocol', 'ollama')
+                if name not in PROVIDERS:
+                    logging.getLogger(__name__).warning(f"Provider không hỗ trợ: {name}, dùng ollama")
+                    name = 'ollama'
+                _provider = PROVIDERS[name](settings)
+    return _provider
@@ -0,0 +1,151 @@
+"""
+MODEL REGISTRY - Danh sách model Ollama dùng chung toàn process
+Một lần gọi /api/tags, probe /api/show song song khi cần, cache theo TTL
+(TTL ngắn khi không kết nối được hoặc không tìm thấy model)
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Set
+
+import requests
+
+from .http_transport import HTTPTransport, get_transport, load_ollama_settings
+from .llm_providers import LLMProvider, get_provider
+
+DEFAULT_REGISTRY_CONFIG = {
+    "ttl_seconds": 300,     # Thời gian giữ kết quả phát hiện model
+    "negative_ttl_seconds": 15,  # Thời gian giữ kết quả rỗng / Ollama không kết nối được
+    "tags_timeout": 3,      # Timeout cho /api/tags
+    "probe_timeout": 3      # Timeout cho mỗi probe /api/show
+}
+
+
+class ModelRegistry:
+    """Cache danh sách model có sẵn trên Ollama"""
+
+    def __init__(self, transport: HTTPTransport, config: Optional[Dict[str, Any]] = None,
+                 provider: Optional[LLMProvider] = None):
+        self.logger = logging.getLogger(__name__)
+        self.transport = transport
+        self.provider = provider or LLMProvider()
+        self.config = dict(DEFAULT_REGISTRY_CONFIG)
+        self.config.update(config or {})
+
+        self._models: List[str] = []
+        self._reachable = False
+        self._fetched_at = 0.0
+        self._ttl = 0.0
+        # Các model đã probe từng cái; None nếu không cần probe thêm
+        # (đã có danh sách đầy đủ từ /api/tags hoặc Ollama không kết nối được)
+        self._probed: Optional[Set[str]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def reachable(self) -> bool:
+        """Lần phát hiện gần nhất có kết nối được Ollama không"""
+        return self._reachable
+
+    def is_fresh(self) -> bool:
+        return self._fetched_at > 0 and time.time() - self._fetched_at < self._ttl
+
+    def get_available_models(self, candidates: Optional[List[str]] = None,
+                             refresh: bool = False) -> List[str]:
+        """
+        Lấy danh sách model có sẵn (dùng cache nếu còn hạn)
+
+        Args:
+            candidates: Model cần probe nếu /api/tags không dùng được; cache đang là
+                kết quả probe thì candidate chưa probe được probe bổ sung
+            refresh: Bỏ qua cache
+
+        Returns:
+            Danh sách tên model
+        """
+        candidates = candidates or []
+        with self._lock:
+            if refresh or not self.is_fresh():
+                self._models = self._detect(candidates)
+                self._fetched_at = time.time()
+                self._ttl = self.config['ttl_seconds' if self._models else 'negative_ttl_seconds']
+            elif self._probed is not None:
+                missing = [model for model in candidates if model not in self._probed]
+                if missing:
+                    self._probed.update(missing)
+                    self._models += self._probe_models(missing)
+            return list(self._models)
+
+    def invalidate(self):
+        """Xóa cache để lần sau phát hiện lại"""
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def _detect(self, candidates: List[str]) -> List[str]:
+        """Phát hiện model: /api/tags trước, probe /api/show song song nếu cần"""
+        self.logger.info("🔍 Đang phát hiện model có sẵn...")
+        self._reachable = False
+        self._probed = set()
+
+        try:
+            response = self.transport.get(self.provider.models_path, headers=self.provider.headers(),
+                                          timeout=self.config['tags_timeout'])
+            self._reachable = True
+            if response.status_code == 200:
+                models = self.provider.parse_models(response.json())
+                self._probed = None
+                self.logger.info(f"  📊 Tìm thấy {len(models)} model từ API tags")
+                return models
+            self.logger.debug(f"  ⚠️ /api/tags trả về HTTP {response.status_code}")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # Ollama không chạy - không cần probe từng model
+            self.logger.warning(f"  Không thể kết nối đến Ollama: {e}")
+            self._probed = None
+            return []
+        except Exception as e:
+            self.logger.debug(f"  ❌ /api/tags: {str(e)[:50]}")
+
+        self._probed.update(candidates)
+        return self._probe_models(candidates)
+
+    def _probe_models(self, candidates: List[str]) -> List[str]:
+        """Probe song song từng model bằng /api/show"""
+        if not candidates or not self.provider.supports_probe:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            found = list(pool.map(self._probe_model, candidates))
+
+        return [model for model, ok in zip(candidates, found) if ok]
+
+    def _probe_model(self, model: str) -> bool:
+        try:
+            response = self.transport.post(
+                "/api/show",
+                json={"name": model},
+                timeout=self.config['probe_timeout']
+            )
+            if response.status_code == 200:
+                self.logger.info(f"  ✅ {model} có sẵn")
+                return True
+            self.logger.debug(f"  ⚠️ {model} không khả dụng (HTTP {response.status_code})")
+        except requests.exceptions.Timeout:
+            self.logger.debug(f"  ⏰ {model}: timeout")
+        except Exception as e:
+            self.logger.debug(f"  ❌ {model}: {str(e)[:50]}")
+        return False
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    """Lấy model registry dùng chung của process"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                settings = load_ollama_settings()
+                _registry = ModelRegistry(get_transport(), settings.get('model_registry'), get_provider())
+    return _registry
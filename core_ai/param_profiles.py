@@ -0,0 +1,132 @@
+"""
+PARAM PROFILES - Tham số sinh theo llm_type và model từ llm_profiles.yaml
+Biên dịch một lần thành options dạng Ollama, tự nạp lại khi file cấu hình thay đổi
+"""
+import os
+import time
+import yaml
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+DEFAULT_PARAM_PROFILES_CONFIG = {
+    "path": "config/llm_profiles.yaml",
+    "reload_interval": 5      # Giây giữa hai lần kiểm tra file thay đổi (0 = không hot reload)
+}
+
+# Giá trị khi profile không khai báo
+DEFAULT_OPTIONS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "repeat_penalty": 1.1
+}
+
+# Tên trong yaml -> tên option của Ollama
+OPTION_ALIASES = {"max_tokens": "num_predict"}
+
+SUPPORTED_OPTIONS = {
+    "temperature", "top_p", "top_k", "min_p", "repeat_penalty", "seed", "num_predict",
+    "num_ctx", "num_batch", "num_thread", "num_gpu"
+}
+
+
+class ParamProfiles:
+    """
+    Options sinh đã biên dịch: DEFAULT_OPTIONS < profiles.<llm_type>.parameters < model_parameters.<model>
+
+    Chỉ tham số được nạp lại nóng; danh sách model của profile vẫn cần khởi động lại dispatcher
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 llm_profiles: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_PARAM_PROFILES_CONFIG)
+        self.config.update(config or {})
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._resolved: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._mtime = self._stat()
+        self._checked_at = time.time()
+        self.version = 0
+
+        if llm_profiles is not None:
+            self._compile(llm_profiles)
+        else:
+            self._compile(self._read() or {})
+
+    def resolve(self, llm_type: str, model: str) -> Dict[str, Any]:
+        """Options sinh cho (llm_type, model), bản sao để người gọi sửa tự do"""
+        self._maybe_reload()
+        key = (llm_type, model)
+        options = self._resolved.get(key)
+        if options is None:
+            options = dict(DEFAULT_OPTIONS)
+            options.update(self._profiles.get(llm_type, {}))
+            options.update(self._models.get(model, {}))
+            self._resolved[key] = options
+        return dict(options)
+
+    def num_ctx(self, model: str, llm_type: Optional[str] = None) -> Optional[int]:
+        """num_ctx khai báo cho model, không có thì của profile llm_type (None = để prompt budget quyết định)"""
+        self._maybe_reload()
+        value = self._models.get(model, {}).get('num_ctx') or self._profiles.get(llm_type, {}).get('num_ctx')
+        return int(value) if value else None
+
+    def reload(self) -> bool:
+        """Đọc lại file cấu hình; giữ options cũ nếu file lỗi"""
+        data = self._read()
+        if data is None:
+            return False
+        with self._lock:
+            self._compile(data)
+        self.logger.info(f"🔄 Đã nạp lại tham số sinh (phiên bản {self.version})")
+        return True
+
+    def _maybe_reload(self):
+        interval = self.config['reload_interval']
+        now = time.time()
+        if not interval or now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        mtime = self._stat()
+        if mtime is not None and mtime != self._mtime:
+            self._mtime = mtime
+            self.reload()
+
+    def _compile(self, data: Dict[str, Any]):
+        profiles = {}
+        for llm_type, profile in (data.get('profiles') or {}).items():
+            profiles[llm_type] = self._options((profile or {}).get('parameters'), f"profiles.{llm_type}")
+        models = {}
+        for model, params in (data.get('model_parameters') or {}).items():
+            models[model] = self._options(params, f"model_parameters.{model}")
+
+        # Gán một lượt để thread đang đọc không thấy trạng thái nửa vời
+        self._profiles, self._models, self._resolved = profiles, models, {}
+        self.version += 1
+
+    def _options(self, params: Optional[Dict[str, Any]], where: str) -> Dict[str, Any]:
+        options = {}
+        for name, value in (params or {}).items():
+            name = OPTION_ALIASES.get(name, name)
+            if name not in SUPPORTED_OPTIONS:
+                self.logger.warning(f"Bỏ qua tham số không hỗ trợ {where}.{name}")
+                continue
+            if value is not None:
+                options[name] = value
+        return options
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.config['path'], 'r', encoding='utf-8') as f:
+                return yaml.safe_load(f) or {}
+        except Exception as e:
+            self.logger.warning(f"Không thể tải tham số sinh: {e}")
+            return None
+
+    def _stat(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.config['path'])
+        except OSError:
+            return None
@@ -0,0 +1,115 @@
+"""
+PROMPT BUDGET - Ước lượng token và xếp nội dung prompt vừa context window của model
+Context window lấy từ capabilities trong llm_profiles.yaml, trừ phần dành cho num_predict
+"""
+import re
+import math
+import logging
+from typing import Callable, Dict, Any, List, Optional
+
+DEFAULT_BUDGET_CONFIG = {
+    "enabled": True,
+    "default_context": 4096,    # Model không khai báo trong capabilities
+    "max_num_ctx": 8192,        # Trần num_ctx gửi cho Ollama (giới hạn bộ nhớ KV cache)
+    "reserve_tokens": 256,      # Dự phòng sai số ước lượng và template của model
+    "min_input_tokens": 512,    # Luôn chừa tối thiểu chừng này cho prompt
+    "min_chunk_tokens": 64,     # Phần tài liệu còn lại nhỏ hơn mức này thì bỏ hẳn
+    "max_output_share": 0.5     # num_predict chiếm tối đa phần này của context
+}
+
+TRUNCATION_MARKER = " …[đã rút gọn]"
+
+_SENTENCE_END = re.compile(r'(?<=[.!?。])\s+|\n{2,}')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng số token không cần tokenizer
+
+    Ký tự ASCII ~4 ký tự/token; ký tự có dấu (tiếng Việt) bị tách nhỏ hơn nên ~2 ký tự/token
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return math.ceil((len(text) - non_ascii) / 4 + non_ascii / 2)
+
+
+class PromptBudget:
+    """Tính ngân sách token cho prompt và cắt/xếp nội dung theo ngân sách"""
+
+    def __init__(self, capabilities: Optional[Dict[str, Any]] = None,
+                 config: Optional[Dict[str, Any]] = None,
+                 context_override: Optional[Callable[[str, Optional[str]], Optional[int]]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.capabilities = capabilities or {}
+        self.context_override = context_override   # num_ctx cấu hình theo (model, llm_type) nếu có
+        self.config = dict(DEFAULT_BUDGET_CONFIG)
+        self.config.update(config or {})
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def num_ctx(self, model: str, llm_type: Optional[str] = None) -> int:
+        """Context window dùng cho model: num_ctx cấu hình (model / profile), hoặc capabilities giới hạn bởi max_num_ctx"""
+        explicit = self.context_override(model, llm_type) if self.context_override else None
+        if explicit:
+            return explicit
+        declared = (self.capabilities.get(model) or {}).get('context', self.config['default_context'])
+        return min(int(declared), self.config['max_num_ctx'])
+
+    def max_predict(self, model: str, llm_type: Optional[str] = None) -> int:
+        """num_predict tối đa: không quá max_output_share của context và vẫn chừa min_input_tokens cho prompt"""
+        num_ctx = self.num_ctx(model, llm_type)
+        limit = min(int(num_ctx * self.config['max_output_share']),
+                    num_ctx - self.config['reserve_tokens'] - self.config['min_input_tokens'])
+        return max(1, limit)
+
+    def input_budget(self, model: str, num_predict: int, llm_type: Optional[str] = None) -> int:
+        """Số token tối đa cho prompt = num_ctx - num_predict - dự phòng"""
+        budget = self.num_ctx(model, llm_type) - num_predict - self.config['reserve_tokens']
+        return max(self.config['min_input_tokens'], budget)
+
+    def fit_text(self, text: str, max_tokens: int) -> str:
+        """Cắt text vừa max_tokens, ưu tiên dừng ở ranh giới câu"""
+        if not self.enabled or estimate_tokens(text) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+
+        # Cắt theo tỉ lệ rồi lùi về cuối câu gần nhất
+        cut = int(len(text) * max_tokens / estimate_tokens(text))
+        while cut > 0 and estimate_tokens(text[:cut]) + estimate_tokens(TRUNCATION_MARKER) > max_tokens:
+            cut = int(cut * 0.9)
+        head = text[:cut]
+        boundaries = [m.start() for m in _SENTENCE_END.finditer(head)]
+        if boundaries and boundaries[-1] > cut // 2:
+            head = head[:boundaries[-1]]
+
+        self.logger.info(f"✂️ Rút gọn nội dung {estimate_tokens(text)} → ~{max_tokens} token")
+        return head.rstrip() + TRUNCATION_MARKER
+
+    def pack(self, items: List[str], max_tokens: int) -> List[str]:
+        """
+        Xếp các đoạn (đã sắp theo độ liên quan) vào ngân sách
+
+        Đoạn đầu tiên không vừa được rút gọn vào phần còn lại, các đoạn sau bị bỏ
+        """
+        if not self.enabled:
+            return list(items)
+
+        packed, remaining = [], max_tokens
+        for index, item in enumerate(items):
+            cost = estimate_tokens(item)
+            if cost <= remaining:
+                packed.append(item)
+                remaining -= cost
+                continue
+
+            if remaining >= self.config['min_chunk_tokens']:
+                packed.append(self.fit_text(item, remaining))
+            dropped = len(items) - len(packed)
+            if dropped:
+                self.logger.info(f"✂️ Bỏ {dropped}/{len(items)} đoạn tài liệu vượt context window")
+            break
+        return packed
@@ -42,6 +42,9 @@ class ReasoningEngine:
         # Xác định agent cần gọi (nếu có)
         agent = self._determine_agent(intent)
         
+        # Lane ưu tiên khi xếp hàng gọi model
+        priority = self._determine_priority(task, intent)
+        
         plan = {
             "intent": intent,
             "language": language,
@@ -50,7 +53,9 @@ class ReasoningEngine:
             "agent": agent,
             "user_input": task.get('content', ''),
             "requires_web_search": intent in ['research', 'web_search'],
-            "requires_code": intent in ['coding', 'code_review']
+            "requires_code": intent in ['coding', 'code_review'],
+            "session_id": task.get('session_id'),
+            "priority": priority
         }
         
         self.logger.debug(f"Kế hoạch tạo: {plan}")
@@ -67,6 +72,16 @@ class ReasoningEngine:
         }
         return mapping.get(intent, 'chat')
     
+    def _determine_priority(self, task: Dict[str, Any], intent: str) -> str:
+        """Xác định lane ưu tiên: chat trực tiếp trước, nghiên cứu và tác vụ nền sau"""
+        if task.get('priority'):
+            return task['priority']
+        if intent in ['research', 'web_search']:
+            return 'research'
+        if task.get('source') == 'chat_interface':
+            return 'interactive'
+        return 'background'
+    
     def _determine_tools(self, intent: str) -> list:
         """Xác định tools cần dùng"""
         mapping = {
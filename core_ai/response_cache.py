@@ -0,0 +1,158 @@
+"""
+RESPONSE CACHE - Cache phản hồi LLM theo (model, prompt, options)
+Tầng bộ nhớ LRU/TTL, tầng đĩa (tùy chọn) dưới memory/
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+DEFAULT_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 256,
+    "ttl_seconds": 3600,
+    "disk": {
+        "enabled": False,
+        "path": "memory/response_cache",
+        "max_entries": 5000
+    }
+}
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Chuẩn hóa prompt: Unicode NFC, bỏ khác biệt hoa/thường và khoảng trắng"""
+    prompt = unicodedata.normalize('NFC', prompt)
+    return ' '.join(prompt.casefold().split())
+
+
+class ResponseCache:
+    """Cache exact-match (sau chuẩn hóa) cho phản hồi LLM"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        config = config or {}
+        self.enabled = config.get('enabled', DEFAULT_CACHE_CONFIG['enabled'])
+        self.max_entries = config.get('max_entries', DEFAULT_CACHE_CONFIG['max_entries'])
+        self.ttl_seconds = config.get('ttl_seconds', DEFAULT_CACHE_CONFIG['ttl_seconds'])
+
+        disk_config = dict(DEFAULT_CACHE_CONFIG['disk'])
+        disk_config.update(config.get('disk') or {})
+        self.disk_path = Path(disk_config['path']) if disk_config['enabled'] else None
+        self.disk_max_entries = disk_config['max_entries']
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._disk_count = 0
+        if self.enabled and self.disk_path is not None:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+            self._disk_count = sum(1 for _ in self.disk_path.glob("*.json"))
+
+    @staticmethod
+    def make_key(model: str, prompt: str, options: Dict[str, Any]) -> str:
+        """Tạo key cache từ model, prompt đã chuẩn hóa và options sinh"""
+        raw = json.dumps(
+            {"model": model, "prompt": normalize_prompt(prompt), "options": options},
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Lấy response đã cache (None nếu miss hoặc hết hạn)"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+
+        response = self._disk_get(key, now)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._memory_set(key, response, now + self.ttl_seconds)
+        return response
+
+    def set(self, key: str, response: str):
+        """Lưu response vào cache"""
+        if not self.enabled or not response:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._memory_set(key, response, expires_at)
+        self._disk_set(key, response, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """Bộ đếm hit/miss của cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "size": len(self._entries)
+            }
+
+    def _memory_set(self, key: str, response: str, expires_at: float):
+        """Ghi vào tầng bộ nhớ (gọi khi đã giữ lock), loại entry ít dùng nhất"""
+        self._entries[key] = (response, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        if self.disk_path is None:
+            return None
+
+        cache_file = self.disk_path / f"{key}.json"
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if entry.get('expires_at', 0) <= now:
+            cache_file.unlink(missing_ok=True)
+            return None
+        return entry.get('response')
+
+    def _disk_set(self, key: str, response: str, expires_at: float):
+        if self.disk_path is None:
+            return
+
+        cache_file = self.disk_path / f"{key}.json"
+        try:
+            is_new = not cache_file.exists()
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                json.dump({"response": response, "expires_at": expires_at}, f, ensure_ascii=False)
+            if is_new:
+                self._disk_count += 1
+            if self._disk_count > self.disk_max_entries:
+                self._evict_disk()
+        except Exception as e:
+            self.logger.warning(f"Không thể ghi response cache: {e}")
+
+    def _evict_disk(self):
+        """Xóa 10% file cũ nhất khi tầng đĩa vượt giới hạn"""
+        files = sorted(self.disk_path.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        to_remove = max(1, len(files) - self.disk_max_entries + self.disk_max_entries // 10)
+        for cache_file in files[:to_remove]:
+            cache_file.unlink(missing_ok=True)
+        self._disk_count = len(files) - to_remove
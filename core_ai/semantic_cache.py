@@ -0,0 +1,115 @@
+"""
+SEMANTIC CACHE - Cache phản hồi theo độ tương đồng ngữ nghĩa của câu hỏi
+Embedding lấy từ model local qua Ollama, ngưỡng cosine riêng cho từng intent
+"""
+import math
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+DEFAULT_SEMANTIC_CONFIG = {
+    "enabled": True,
+    "max_entries": 512,
+    "ttl_seconds": 3600,
+    "default_threshold": 0.92,
+    "thresholds": {
+        "chat": 0.90,
+        "coding": 0.97
+    },
+    "embedding_timeout": 5
+}
+
+
+def normalize_vector(vector: List[float]) -> List[float]:
+    """Chuẩn hóa vector về độ dài 1 để cosine = tích vô hướng"""
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+class SemanticCache:
+    """Lưu (embedding câu hỏi → response), tìm câu hỏi gần nhất theo cosine"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_SEMANTIC_CONFIG)
+        self.config.update(config or {})
+        self.thresholds = dict(DEFAULT_SEMANTIC_CONFIG['thresholds'])
+        self.thresholds.update(self.config.get('thresholds') or {})
+
+        # Phân vùng theo (intent, language, context) - chỉ so sánh câu hỏi cùng loại,
+        # cùng bộ tài liệu tham khảo đi kèm
+        self._entries: Dict[tuple, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def threshold_for(self, intent: str) -> float:
+        return self.thresholds.get(intent, self.config['default_threshold'])
+
+    def lookup(self, vector: List[float], intent: str, language: str,
+               context: str = '') -> Optional[Dict[str, Any]]:
+        """
+        Tìm response của câu hỏi tương tự nhất
+
+        Args:
+            context: Định danh ngữ cảnh kèm câu hỏi (vd. id tài liệu tham khảo); chỉ khớp cùng context
+
+        Returns:
+            Entry {"response", "model", "similarity"} nếu vượt ngưỡng, ngược lại None
+        """
+        query = normalize_vector(vector)
+        threshold = self.threshold_for(intent)
+        now = time.time()
+
+        with self._lock:
+            entries = self._entries.get((intent, language, context), [])
+            entries[:] = [e for e in entries if e['expires_at'] > now]
+
+            best, best_score = None, -1.0
+            for entry in entries:
+                if len(entry['vector']) != len(query):
+                    continue
+                score = sum(a * b for a, b in zip(entry['vector'], query))
+                if score > best_score:
+                    best, best_score = entry, score
+
+            if best is not None and best_score >= threshold:
+                self.hits += 1
+                return {"response": best['response'], "model": best['model'],
+                        "similarity": round(best_score, 4)}
+
+            self.misses += 1
+            return None
+
+    def add(self, vector: List[float], intent: str, language: str, response: str, model: str,
+            context: str = ''):
+        """Lưu câu hỏi đã trả lời, loại entry cũ nhất khi vượt giới hạn"""
+        entry = {
+            "vector": normalize_vector(vector),
+            "response": response,
+            "model": model,
+            "expires_at": time.time() + self.config['ttl_seconds']
+        }
+        with self._lock:
+            self._entries.setdefault((intent, language, context), []).append(entry)
+            total = sum(len(v) for v in self._entries.values())
+            if total > self.config['max_entries']:
+                # Cùng TTL nên entry hết hạn sớm nhất cũng là entry cũ nhất
+                oldest = min((v for v in self._entries.values() if v),
+                             key=lambda v: v[0]['expires_at'])
+                oldest.pop(0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": sum(len(v) for v in self._entries.values())
+            }
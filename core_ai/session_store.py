@@ -0,0 +1,120 @@
+"""
+SESSION STORE - Lịch sử hội thoại theo session_id cho /api/chat
+System prefix ổn định + các lượt trước giữ nguyên thứ tự để Ollama dùng lại KV cache,
+lượt sau chỉ phải prefill phần mới
+"""
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional
+
+from .prompt_budget import estimate_tokens
+
+DEFAULT_SESSION_CONFIG = {
+    "enabled": True,
+    "max_sessions": 64,         # Vượt quá thì loại session lâu không dùng nhất
+    "ttl_seconds": 1800,        # Session không hoạt động quá lâu bị xóa
+    "max_turns": 8,             # Số lượt (user, assistant) giữ lại mỗi session
+    "max_history_chars": 12000  # Giới hạn độ dài lịch sử để không vượt context của model
+}
+
+
+class ChatSession:
+    """Lịch sử hội thoại của một session"""
+
+    def __init__(self, session_id: str, max_turns: int, max_history_chars: int):
+        self.session_id = session_id
+        self.max_history_chars = max_history_chars
+        self.turns: deque = deque(maxlen=max_turns)
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.turns)
+
+    def build_messages(self, system: str, user: str,
+                       history_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Messages cho /api/chat: system, các lượt trước, câu hỏi mới
+
+        Args:
+            history_tokens: Ngân sách token cho lịch sử - chỉ giữ các lượt gần nhất vừa ngân sách
+        """
+        with self._lock:
+            turns = list(self.turns)
+
+        if history_tokens is not None:
+            kept, used = [], 0
+            for question, answer in reversed(turns):
+                used += estimate_tokens(question) + estimate_tokens(answer)
+                if used > history_tokens:
+                    break
+                kept.append((question, answer))
+            turns = list(reversed(kept))
+
+        messages = [{"role": "system", "content": system}]
+        for question, answer in turns:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": user})
+        return messages
+
+    def add_turn(self, user: str, assistant: str):
+        """Lưu lượt vừa trả lời, bỏ lượt cũ nhất khi lịch sử quá dài"""
+        with self._lock:
+            self.turns.append((user, assistant))
+            # Bỏ từ đầu để phần còn lại vẫn là prefix của lần gọi trước
+            while len(self.turns) > 1 and \
+                    sum(len(q) + len(a) for q, a in self.turns) > self.max_history_chars:
+                self.turns.popleft()
+            self.updated_at = time.time()
+
+
+class SessionStore:
+    """Kho session giới hạn số lượng và thời gian sống"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(DEFAULT_SESSION_CONFIG)
+        self.config.update(config or {})
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def get(self, session_id: Optional[str]) -> Optional[ChatSession]:
+        """Lấy (hoặc tạo) session; None nếu tắt hoặc không có session_id"""
+        if not self.enabled or not session_id:
+            return None
+
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.updated_at > self.config['ttl_seconds']:
+                session = None
+            if session is None:
+                session = ChatSession(session_id, self.config['max_turns'],
+                                      self.config['max_history_chars'])
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return session
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now: float):
+        """Loại session hết hạn và session cũ nhất khi vượt giới hạn (gọi khi giữ lock)"""
+        expired = [sid for sid, s in self._sessions.items()
+                   if now - s.updated_at > self.config['ttl_seconds']]
+        for sid in expired:
+            del self._sessions[sid]
+        while len(self._sessions) > self.config['max_sessions']:
+            self._sessions.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._sessions)}
@@ -0,0 +1,352 @@
+"""
+STREAM PROCESSOR - Hậu xử lý response theo từng chunk
+Bỏ đoạn/dòng lặp, sửa lỗi cắt ngang ở phần đuôi và tách câu trong một lượt duyệt,
+không cần quét lại toàn bộ chuỗi
+"""
+from collections import deque
+from typing import List
+
+RESPONSE_ENDINGS = ('.', '!', '?', '```')
+BOUNDARY_MARKERS = ('.', '!', '?', '\n\n')
+
+EMPTY_RESPONSE_FALLBACK = "Xin lỗi, tôi không thể tạo phản hồi lúc này."
+
+SIGNATURE_CHARS = 100       # Số ký tự đầu đoạn dùng làm chữ ký đoạn (bỏ khoảng trắng)
+SENTENCE_ENDINGS = '.!?'
+CODE_FENCE = '```'
+
+
+class ParagraphDedupStream:
+    """
+    Bỏ đoạn trùng lặp (các đoạn cách nhau bởi dòng trống), so theo chữ ký đầu đoạn.
+
+    Đoạn mới chỉ bị giữ lại khi chữ ký đang có còn là tiền tố của một đoạn đã gặp;
+    khác đi là trả ra ngay, nên text vẫn chảy theo từng token.
+    """
+
+    def __init__(self, signature_chars: int = SIGNATURE_CHARS):
+        self.signature_chars = signature_chars
+        self._seen = set()          # Chữ ký các đoạn đã gặp
+        self._prefixes = set()      # Mọi tiền tố của các chữ ký đó
+        self._signature: List[str] = []
+        self._consumed = 0          # Số ký tự của đoạn đã đưa vào chữ ký
+        self._state = None          # None = chưa quyết định, True = giữ, False = bỏ
+        self._held: List[str] = []  # Text đoạn hiện tại khi chưa quyết định
+        self._newlines = 0
+        self._in_paragraph = False
+        self._dropped_last = False  # Đoạn trước bị bỏ -> bỏ luôn khoảng trắng sau nó
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        for ch in chunk:
+            if ch == '\n':
+                self._newlines += 1
+                if self._in_paragraph and self._newlines >= 2:
+                    self._end_paragraph(out)
+            elif not ch.isspace():
+                self._newlines = 0
+                self._in_paragraph = True
+
+            if self._in_paragraph and self._consumed < self.signature_chars:
+                self._extend_signature(ch, out)
+
+            if not self._in_paragraph:
+                if not self._dropped_last:
+                    out.append(ch)
+            elif self._state is None:
+                self._held.append(ch)
+            elif self._state:
+                out.append(ch)
+        return ''.join(out)
+
+    def finish(self) -> str:
+        out: List[str] = []
+        if self._in_paragraph:
+            self._end_paragraph(out)
+        return ''.join(out)
+
+    def _extend_signature(self, ch: str, out: List[str]):
+        self._consumed += 1
+        if not ch.isspace():
+            self._signature.append(ch.lower())
+        signature = ''.join(self._signature)
+        if self._consumed == self.signature_chars:
+            if self._state is None:
+                self._decide(signature not in self._seen, out)
+            self._register(signature)
+        elif self._state is None and signature and signature not in self._prefixes:
+            self._decide(True, out)
+
+    def _decide(self, keep: bool, out: List[str]):
+        self._state = keep
+        if keep:
+            out.extend(self._held)
+        self._held = []
+
+    def _register(self, signature: str):
+        if signature and signature not in self._seen:
+            self._seen.add(signature)
+            self._prefixes.update(signature[:end] for end in range(1, len(signature) + 1))
+
+    def _end_paragraph(self, out: List[str]):
+        signature = ''.join(self._signature)
+        if self._state is None:
+            self._decide(signature not in self._seen, out)
+        if self._consumed < self.signature_chars:
+            self._register(signature)
+        self._dropped_last = self._state is False
+        self._in_paragraph = False
+        self._signature = []
+        self._consumed = 0
+        self._state = None
+
+
+class LineDedupStream:
+    """
+    Bỏ dòng lặp lại liền kề (không áp dụng trong code block).
+
+    Dòng chỉ bị giữ lại khi phần đã nhận còn trùng với đầu dòng trước đó.
+    """
+
+    def __init__(self):
+        self._line: List[str] = []
+        self._held: List[str] = []
+        self._holding = True
+        self._match = 0             # Số ký tự (sau khoảng trắng đầu dòng) trùng với dòng trước
+        self._previous = ""         # Dòng không rỗng gần nhất (đã strip)
+        self._in_code = False
+
+    def feed(self, chunk: str) -> str:
+        out: List[str] = []
+        for ch in chunk:
+            if ch == '\n':
+                self._end_line(out, ch)
+                continue
+
+            self._line.append(ch)
+            if not self._holding:
+                out.append(ch)
+                continue
+
+            self._held.append(ch)
+            if self._in_code or not self._previous:
+                self._release(out)
+            elif ch.isspace() and (self._match == 0 or self._match == len(self._previous)):
+                continue
+            elif self._match < len(self._previous) and self._previous[self._match] == ch:
+                self._match += 1
+            else:
+                self._release(out)
+        return ''.join(out)
+
+    def finish(self) -> str:
+        out: List[str] = []
+        if self._line:
+            self._end_line(out, '')
+        return ''.join(out)
+
+    def _release(self, out: List[str]):
+        out.extend(self._held)
+        self._held = []
+        self._holding = False
+
+    def _end_line(self, out: List[str], newline: str):
+        stripped = ''.join(self._line).strip()
+        if stripped and not self._in_code and stripped == self._previous:
+            self._held = []
+        else:
+            self._release(out)
+            out.append(newline)
+
+        if stripped.startswith(CODE_FENCE):
+            self._in_code = not self._in_code
+        if stripped:
+            self._previous = stripped
+        self._line = []
+        self._holding = True
+        self._match = 0
+
+
+class SentenceSegmenter:
+    """Tách câu tăng dần: câu kết thúc ở dấu câu + khoảng trắng hoặc xuống dòng"""
+
+    def __init__(self):
+        self.sentences: List[str] = []
+        self._current: List[str] = []
+        self._after_ending = False
+
+    def feed(self, text: str):
+        for ch in text:
+            if ch == '\n' or (self._after_ending and ch.isspace()):
+                self._close()
+                continue
+            self._current.append(ch)
+            self._after_ending = ch in SENTENCE_ENDINGS
+
+    def finish(self) -> List[str]:
+        self._close()
+        return self.sentences
+
+    def _close(self):
+        sentence = ''.join(self._current).strip()
+        if sentence:
+            self.sentences.append(sentence)
+        self._current = []
+        self._after_ending = False
+
+
+class TruncationRepairStream:
+    """
+    Nhận response theo chunk và trả ra ngay phần chắc chắn được giữ lại.
+
+    Quy tắc giống bản không stream: nếu response dài hơn min_length và không kết
+    thúc bằng dấu câu, duyệt BOUNDARY_MARKERS theo thứ tự, marker đầu tiên có lần
+    xuất hiện cuối nằm trong 30% cuối là chỗ cắt. Vì độ dài chỉ tăng, một vị trí
+    chỉ còn có thể là chỗ cắt khi nó còn nằm sau keep_ratio * độ dài hiện tại;
+    phần trước vị trí sớm nhất như vậy được trả ra từng token.
+    """
+
+    def __init__(self, min_length: int = 100, keep_ratio: float = 0.7):
+        self.min_length = min_length
+        self.keep_ratio = keep_ratio
+        self._pending = deque()     # Các chunk (hoặc phần cuối chunk) đã nhận nhưng chưa trả ra
+        self._head_offset = 0       # Số ký tự đầu của _pending[0] đã trả ra
+        self._released = 0          # Tổng số ký tự đã trả ra
+        self._total_length = 0      # Tổng số ký tự đã nhận
+        self._last_positions = {}   # marker -> vị trí tuyệt đối của lần xuất hiện cuối
+        self._last_char = ""        # Ký tự cuối của chunk trước ('\n' + '\n' vắt qua chunk)
+        self._ending = ""           # Vài ký tự cuối (bỏ khoảng trắng) để xét dấu kết thúc
+        self._has_text = False
+
+    def _update_boundaries(self, chunk: str, chunk_start: int):
+        """Cập nhật vị trí xuất hiện cuối của từng marker sau khi nhận chunk"""
+        window = self._last_char + chunk
+        offset = chunk_start - len(self._last_char)
+        for marker in BOUNDARY_MARKERS:
+            pos = window.rfind(marker)
+            if pos >= 0:
+                self._last_positions[marker] = max(self._last_positions.get(marker, -1), offset + pos)
+
+    def _safe_length(self) -> int:
+        """Độ dài phần đầu không thể bị cắt bỏ dù stream còn dài thêm bao nhiêu"""
+        threshold = self._total_length * self.keep_ratio
+        candidates = [pos + 1 for pos in self._last_positions.values() if pos > threshold]
+        return min(candidates) if candidates else self._total_length
+
+    def _cut_position(self) -> int:
+        """Chỗ cắt khi stream kết thúc (-1 nếu không cắt)"""
+        if self._total_length <= self.min_length or self._ending.endswith(RESPONSE_ENDINGS):
+            return -1
+        for marker in BOUNDARY_MARKERS:
+            pos = self._last_positions.get(marker, -1)
+            if pos > self._total_length * self.keep_ratio:
+                return pos + 1
+        return -1
+
+    def feed(self, chunk: str) -> str:
+        """Nhận thêm một chunk, trả về phần có thể hiển thị ngay"""
+        if not chunk:
+            return ""
+
+        chunk_start = self._total_length
+        self._total_length += len(chunk)
+        self._update_boundaries(chunk, chunk_start)
+        self._last_char = chunk[-1]
+        self._ending = (self._ending + chunk).rstrip()[-len(CODE_FENCE):]
+        self._has_text = self._has_text or bool(chunk.strip())
+        self._pending.append(chunk)
+
+        # Giữ lại phần từ chỗ cắt sớm nhất còn có thể xảy ra, trả phần trước đó
+        return self._release(self._safe_length())
+
+    def _release(self, end: int) -> str:
+        """
+        Trả ra phần đang giữ tới vị trí tuyệt đối end
+
+        Chunk nằm trọn trước end được lấy nguyên; chỉ chunk chứa end bị cắt,
+        nên mỗi ký tự chỉ được sao chép một lần trong cả stream
+        """
+        ready = []
+        while self._pending and self._released < end:
+            head = self._pending[0]
+            take = min(len(head) - self._head_offset, end - self._released)
+            ready.append(head[self._head_offset:self._head_offset + take])
+            self._released += take
+            self._head_offset += take
+            if self._head_offset == len(head):
+                self._pending.popleft()
+                self._head_offset = 0
+        return ''.join(ready)
+
+    def finish(self) -> str:
+        """Kết thúc stream, trả về phần đuôi còn lại (bỏ phần sau chỗ cắt nếu có)"""
+        if not self._has_text:
+            self._pending.clear()
+            return EMPTY_RESPONSE_FALLBACK
+
+        cut = self._cut_position()
+        tail = self._release(cut if cut >= 0 else self._total_length)
+        self._pending.clear()
+        self._head_offset = 0
+        return tail
+
+
+def repair_truncation(response: str) -> str:
+    """Áp dụng TruncationRepairStream cho một response hoàn chỉnh"""
+    processor = TruncationRepairStream()
+    head = processor.feed(response.strip())
+    tail = processor.finish()
+    if tail == EMPTY_RESPONSE_FALLBACK and not head:
+        return tail
+    return head + tail
+
+
+class ResponseStreamProcessor:
+    """
+    Hậu xử lý response trong một lượt duyệt: bỏ đoạn trùng -> bỏ dòng lặp ->
+    sửa cắt ngang ở đuôi, đồng thời tách câu trên phần đã trả ra.
+
+    Dùng chung cho chế độ stream (feed từng chunk) và không stream (process_response).
+    """
+
+    def __init__(self, min_length: int = 100, keep_ratio: float = 0.7):
+        self._paragraphs = ParagraphDedupStream()
+        self._lines = LineDedupStream()
+        self._repair = TruncationRepairStream(min_length, keep_ratio)
+        self._segmenter = SentenceSegmenter()
+
+    @property
+    def sentences(self) -> List[str]:
+        """Các câu đã hoàn chỉnh trong phần đã trả ra"""
+        return self._segmenter.sentences
+
+    def feed(self, chunk: str) -> str:
+        """Nhận thêm một chunk, trả về phần có thể hiển thị ngay"""
+        ready = self._repair.feed(self._lines.feed(self._paragraphs.feed(chunk)))
+        self._segmenter.feed(ready)
+        return ready
+
+    def finish(self) -> str:
+        """Kết thúc stream, trả về phần đuôi còn lại"""
+        rest = self._lines.feed(self._paragraphs.finish()) + self._lines.finish()
+        ready = self._repair.feed(rest) + self._repair.finish()
+        self._segmenter.feed(ready)
+        self._segmenter.finish()
+        return ready
+
+
+def process_response(response: str) -> str:
+    """Áp dụng ResponseStreamProcessor cho một response hoàn chỉnh"""
+    processor = ResponseStreamProcessor()
+    head = processor.feed(response.strip())
+    tail = processor.finish()
+    if tail == EMPTY_RESPONSE_FALLBACK and not head:
+        return tail
+    return (head + tail).strip()
+
+
+def split_sentences(text: str) -> List[str]:
+    """Tách text thành câu (cùng quy tắc với ResponseStreamProcessor)"""
+    segmenter = SentenceSegmenter()
+    segmenter.feed(text)
+    return segmenter.finish()
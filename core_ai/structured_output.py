@@ -0,0 +1,271 @@
+"""
+STRUCTURED OUTPUT - Kiểm tra JSON ngay trong lúc model đang stream
+Lỗi cú pháp hoặc sai kiểu so với schema được phát hiện ở ký tự đầu tiên sai,
+để dừng sinh sớm thay vì chờ hết response rồi mới parse
+"""
+import re
+import json
+from typing import Dict, Any, List, Optional
+
+DEFAULT_STRUCTURED_CONFIG = {
+    "max_attempts": 2,          # Model chính + một model backup
+    "temperature": 0.2
+}
+
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$')
+_NUMBER_CHARS = set('0123456789+-.eE')
+_LITERALS = {'t': 'true', 'f': 'false', 'n': 'null'}
+_START_TYPES = {'{': 'object', '[': 'array', '"': 'string', 't': 'boolean', 'f': 'boolean', 'n': 'null'}
+
+
+class StructuredOutputError(Exception):
+    """Output không phải JSON hợp lệ hoặc không khớp schema"""
+
+
+def _allowed_types(schema: Optional[Dict[str, Any]]) -> Optional[List[str]]:
+    if not schema or 'type' not in schema:
+        return None
+    types = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+    # Số nguyên cũng là number; ngược lại 'integer' không nhận số có phần thập phân / mũ
+    if 'number' in types and 'integer' not in types:
+        types = types + ['integer']
+    return types
+
+
+class JSONStreamValidator:
+    """
+    Kiểm tra cú pháp JSON tăng dần theo từng chunk (máy trạng thái có ngăn xếp).
+
+    Với schema, kiểu của mỗi giá trị được kiểm tra ngay khi gặp ký tự mở đầu và
+    tên thuộc tính được kiểm tra khi đóng chuỗi key (additionalProperties: false).
+    Phần còn lại của schema (required, enum, minItems...) kiểm tra ở finish().
+    """
+
+    def __init__(self, schema: Optional[Dict[str, Any]] = None):
+        self.schema = schema
+        self._stack: List[Dict[str, Any]] = []   # {"kind", "schema", "key"}
+        self._expect = 'value'      # value | value_or_end | key_or_end | key | colon | comma_or_end | end
+        self._token = None          # string | number | literal
+        self._token_chars: List[str] = []
+        self._is_key = False
+        self._integer_only = False
+        self._escape = False
+        self._unicode_left = 0
+        self._literal = ''
+        self._text: List[str] = []
+        self._position = 0
+
+    # ---- API ----
+
+    def feed(self, chunk: str):
+        """Nhận thêm một chunk; ném StructuredOutputError ngay khi prefix không thể hợp lệ"""
+        for ch in chunk:
+            self._text.append(ch)
+            self._step(ch)
+            self._position += 1
+
+    def finish(self) -> Any:
+        """Kết thúc stream: trả về object đã parse và đã kiểm tra schema"""
+        if self._token == 'number':
+            self._end_number()
+        if self._token is not None or self._expect != 'end':
+            self._fail("JSON chưa hoàn chỉnh")
+        data = json.loads(''.join(self._text))
+        if self.schema:
+            validate_schema(data, self.schema)
+        return data
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._text)
+
+    # ---- Máy trạng thái ----
+
+    def _fail(self, reason: str):
+        raise StructuredOutputError(f"{reason} (ký tự {self._position})")
+
+    def _step(self, ch: str):
+        if self._token == 'string':
+            return self._string_char(ch)
+        if self._token == 'literal':
+            return self._literal_char(ch)
+        if self._token == 'number':
+            if ch in _NUMBER_CHARS:
+                self._token_chars.append(ch)
+                return
+            self._end_number()
+
+        if ch.isspace():
+            return
+
+        expect = self._expect
+        if expect in ('value', 'value_or_end'):
+            if expect == 'value_or_end' and ch == ']':
+                return self._close('array')
+            return self._start_value(ch)
+        if expect in ('key_or_end', 'key'):
+            if expect == 'key_or_end' and ch == '}':
+                return self._close('object')
+            if ch != '"':
+                self._fail("Thiếu tên thuộc tính")
+            return self._start_string(is_key=True)
+        if expect == 'colon':
+            if ch != ':':
+                self._fail("Thiếu dấu ':'")
+            self._expect = 'value'
+            return
+        if expect == 'comma_or_end':
+            frame = self._stack[-1]
+            if ch == ',':
+                self._expect = 'key' if frame['kind'] == 'object' else 'value'
+                return
+            if ch == ('}' if frame['kind'] == 'object' else ']'):
+                return self._close(frame['kind'])
+            self._fail(f"Ký tự không hợp lệ '{ch}'")
+        self._fail(f"Dư ký tự sau JSON '{ch}'")
+
+    def _value_schema(self) -> Optional[Dict[str, Any]]:
+        """Schema của giá trị sắp bắt đầu"""
+        if not self._stack:
+            return self.schema
+        frame = self._stack[-1]
+        schema = frame['schema'] or {}
+        if frame['kind'] == 'array':
+            return schema.get('items')
+        properties = schema.get('properties') or {}
+        if frame['key'] in properties:
+            return properties[frame['key']]
+        extra = schema.get('additionalProperties')
+        return extra if isinstance(extra, dict) else None
+
+    def _start_value(self, ch: str):
+        value_type = _START_TYPES.get(ch)
+        if value_type is None and (ch == '-' or ch.isdigit()):
+            value_type = 'number'
+        if value_type is None:
+            self._fail(f"Không phải giá trị JSON '{ch}'")
+
+        schema = self._value_schema()
+        allowed = _allowed_types(schema)
+        # Ký tự đầu của số chưa cho biết là số nguyên hay không - kiểm tra lại ở _end_number
+        start_type = 'integer' if value_type == 'number' and allowed and 'number' not in allowed else value_type
+        if allowed is not None and start_type not in allowed:
+            self._fail(f"Sai kiểu: cần {allowed}, nhận {value_type}")
+
+        if ch == '{':
+            self._stack.append({"kind": "object", "schema": schema, "key": None})
+            self._expect = 'key_or_end'
+        elif ch == '[':
+            self._stack.append({"kind": "array", "schema": schema, "key": None})
+            self._expect = 'value_or_end'
+        elif ch == '"':
+            self._start_string(is_key=False)
+        elif value_type == 'number':
+            self._token, self._token_chars = 'number', [ch]
+            self._integer_only = start_type == 'integer'
+        else:
+            self._token, self._literal, self._token_chars = 'literal', _LITERALS[ch], [ch]
+
+    def _after_value(self):
+        self._token = None
+        self._expect = 'comma_or_end' if self._stack else 'end'
+
+    def _close(self, kind: str):
+        self._stack.pop()
+        self._after_value()
+
+    def _start_string(self, is_key: bool):
+        self._token, self._token_chars, self._is_key = 'string', [], is_key
+
+    def _string_char(self, ch: str):
+        if self._unicode_left:
+            if ch not in '0123456789abcdefABCDEF':
+                self._fail("Mã \\u không hợp lệ")
+            self._unicode_left -= 1
+            self._token_chars.append(ch)
+            return
+        if self._escape:
+            if ch not in '"\\/bfnrtu':
+                self._fail(f"Escape không hợp lệ '\\{ch}'")
+            self._escape = False
+            self._unicode_left = 4 if ch == 'u' else 0
+            self._token_chars.append('\\' + ch)
+            return
+        if ch == '\\':
+            self._escape = True
+            return
+        if ch == '"':
+            return self._end_string()
+        if ord(ch) < 0x20:
+            self._fail("Ký tự điều khiển trong chuỗi")
+        self._token_chars.append(ch)
+
+    def _end_string(self):
+        if not self._is_key:
+            return self._after_value()
+
+        # Escape được giữ nguyên dạng gốc, giải mã một lần khi đóng key (\uXXXX, cặp surrogate)
+        key = json.loads('"' + ''.join(self._token_chars) + '"')
+        frame = self._stack[-1]
+        schema = frame['schema'] or {}
+        if schema.get('additionalProperties') is False and key not in (schema.get('properties') or {}):
+            self._fail(f"Thuộc tính không có trong schema '{key}'")
+        frame['key'] = key
+        self._token = None
+        self._expect = 'colon'
+
+    def _literal_char(self, ch: str):
+        expected = self._literal[len(self._token_chars)]
+        if ch != expected:
+            self._fail(f"Giá trị không hợp lệ, cần '{self._literal}'")
+        self._token_chars.append(ch)
+        if len(self._token_chars) == len(self._literal):
+            self._after_value()
+
+    def _end_number(self):
+        number = ''.join(self._token_chars)
+        if not _NUMBER.match(number):
+            self._fail(f"Số không hợp lệ '{number}'")
+        if self._integer_only and any(c in number for c in '.eE'):
+            self._fail(f"Cần số nguyên, nhận '{number}'")
+        self._after_value()
+
+
+def validate_schema(data: Any, schema: Dict[str, Any], path: str = '$'):
+    """Kiểm tra tập con JSON schema hay dùng: type, properties, required, items, enum, minItems"""
+    allowed = _allowed_types(schema)
+    if allowed is not None and _json_type(data) not in allowed:
+        raise StructuredOutputError(f"{path}: cần kiểu {allowed}")
+    if 'enum' in schema and data not in schema['enum']:
+        raise StructuredOutputError(f"{path}: giá trị không thuộc {schema['enum']}")
+
+    if isinstance(data, dict):
+        for key in schema.get('required', []):
+            if key not in data:
+                raise StructuredOutputError(f"{path}: thiếu thuộc tính '{key}'")
+        properties = schema.get('properties') or {}
+        for key, value in data.items():
+            if key in properties:
+                validate_schema(value, properties[key], f"{path}.{key}")
+    elif isinstance(data, list):
+        if len(data) < schema.get('minItems', 0):
+            raise StructuredOutputError(f"{path}: cần ít nhất {schema['minItems']} phần tử")
+        if isinstance(schema.get('items'), dict):
+            for index, item in enumerate(data):
+                validate_schema(item, schema['items'], f"{path}[{index}]")
+
+
+def _json_type(value: Any) -> str:
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, list):
+        return 'array'
+    return 'object'
@@ -0,0 +1,365 @@
+"""
+STUB LLM SERVER - Server LLM giả lập, kết quả xác định theo prompt
+Nói cả API Ollama lẫn OpenAI, độ trễ và tokens/s cấu hình được - dùng để đo hiệu năng
+toàn pipeline khi máy không cài model nào
+
+Chạy riêng: python -m core_ai.stub_server --port 11435 --latency-ms 200 --tokens-per-second 40
+"""
+import json
+import math
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Iterator, List, Optional
+
+DEFAULT_STUB_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 0,                      # 0 = chọn cổng trống
+    "latency_ms": 200,              # Thời gian tới token đầu (prefill + load)
+    "tokens_per_second": 40,        # Tốc độ sinh token
+    "model_tokens_per_second": {},  # Ghi đè tốc độ theo model
+    "response_tokens": 120,         # Độ dài câu trả lời (bị giới hạn bởi num_predict)
+    "embedding_dim": 256,
+    "models": [
+        "qwen2.5:14b", "qwen2.5:7b", "llama3:8b", "mixtral:latest",
+        "deepseek-coder:6.7b", "nomic-embed-text"
+    ]
+}
+
+_WORDS = (
+    "hệ thống xử lý dữ liệu mô hình phân tích kết quả thông tin yêu cầu người dùng "
+    "tối ưu hiệu năng bộ nhớ truy vấn câu trả lời ví dụ cấu trúc quan trọng chi tiết "
+    "nghiên cứu giải pháp kiểm tra đánh giá nguồn tài liệu ngữ cảnh thời gian"
+).split()
+
+_CODE = (
+    "```python\n"
+    "def solve(items):\n"
+    "    result = []\n"
+    "    for item in items:\n"
+    "        if item is not None:\n"
+    "            result.append(item)\n"
+    "    return result\n"
+    "```\n"
+)
+
+
+class StubModel:
+    """Sinh câu trả lời xác định từ prompt và tính thời gian theo cấu hình"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+
+    def tokens_per_second(self, model: str) -> float:
+        return float(self.config['model_tokens_per_second'].get(model, self.config['tokens_per_second']))
+
+    def tokens(self, prompt: str, num_predict: Optional[int], output_format: Any = None) -> List[str]:
+        """Danh sách token của câu trả lời - cùng prompt luôn ra cùng kết quả"""
+        count = self.config['response_tokens']
+        if num_predict and num_predict > 0:
+            count = min(count, num_predict)
+
+        seed = hashlib.sha256(prompt.encode('utf-8')).digest()
+        if output_format:
+            # Output JSON không bị cắt theo num_predict để luôn là JSON hoàn chỉnh
+            text = json.dumps(self._sample_json(output_format, seed), ensure_ascii=False)
+            return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+        words = []
+        if 'code' in prompt.lower():
+            words.extend(line + "\n" for line in _CODE.split("\n") if line)
+        while len(words) < count:
+            index = seed[len(words) % len(seed)] + len(words)
+            word = _WORDS[index % len(_WORDS)]
+            words.append((word.capitalize() if len(words) % 12 == 0 else word) +
+                         (". " if len(words) % 12 == 11 else " "))
+        return words[:count]
+
+    def _sample_json(self, output_format: Any, seed: bytes) -> Any:
+        """Giá trị JSON theo schema (format = 'json' thì là object một trường)"""
+        if not isinstance(output_format, dict):
+            return {"response": " ".join(_WORDS[b % len(_WORDS)] for b in seed[:6])}
+
+        def sample(schema: Dict[str, Any], depth: int) -> Any:
+            if schema.get('enum'):
+                return schema['enum'][seed[depth % len(seed)] % len(schema['enum'])]
+            kind = schema.get('type')
+            if isinstance(kind, list):
+                kind = kind[0] if kind else None
+            if kind == 'object' or (kind is None and 'properties' in schema):
+                return {name: sample(sub, depth + i + 1)
+                        for i, (name, sub) in enumerate((schema.get('properties') or {}).items())}
+            if kind == 'array':
+                size = max(1, int(schema.get('minItems', 1)))
+                return [sample(schema.get('items') or {}, depth + i + 1) for i in range(size)]
+            if kind == 'integer':
+                return seed[depth % len(seed)]
+            if kind == 'number':
+                return seed[depth % len(seed)] / 4
+            if kind == 'boolean':
+                return bool(seed[depth % len(seed)] % 2)
+            if kind == 'null':
+                return None
+            return _WORDS[seed[depth % len(seed)] % len(_WORDS)]
+
+        return sample(output_format, 0)
+
+    def stream(self, model: str, prompt: str, num_predict: Optional[int],
+               output_format: Any = None) -> Iterator[str]:
+        """Trả từng token theo đúng nhịp latency_ms + tokens_per_second"""
+        time.sleep(self.config['latency_ms'] / 1000)
+        interval = 1 / self.tokens_per_second(model)
+        for token in self.tokens(prompt, num_predict, output_format):
+            time.sleep(interval)
+            yield token
+
+    def eval_stats(self, model: str, count: int) -> Dict[str, int]:
+        return {
+            "eval_count": count,
+            "eval_duration": int(count / self.tokens_per_second(model) * 1e9),
+            "load_duration": int(self.config['latency_ms'] * 1e6)
+        }
+
+    def embedding(self, text: str) -> List[float]:
+        """Vector bag-of-words băm - câu gần giống nhau cho vector gần nhau"""
+        dim = self.config['embedding_dim']
+        vector = [0.0] * dim
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % dim] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+
+def _openai_format(body: Dict[str, Any]) -> Any:
+    """response_format của OpenAI đổi về dạng `format` của Ollama ('json' / schema / None)"""
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        return (response_format.get('json_schema') or {}).get('schema') or 'json'
+    if response_format.get('type') == 'json_object':
+        return 'json'
+    return None
+
+
+def _prompt_of(body: Dict[str, Any]) -> str:
+    """Prompt gộp từ prompt hoặc messages"""
+    if body.get('messages'):
+        return "\n".join(str(m.get('content', '')) for m in body['messages'])
+    return str(body.get('prompt', ''))
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: StubModel = None
+    loaded: Dict[str, float] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- HTTP helpers ----
+
+    def _read_body(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, obj: Dict[str, Any], status: int = 200):
+        data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # ---- Routes ----
+
+    def do_GET(self):
+        models = self.stub.config['models']
+        if self.path == '/api/tags':
+            return self._send_json({"models": [{"name": m, "model": m, "size": 0} for m in models]})
+        if self.path == '/api/ps':
+            return self._send_json({"models": [{"name": m, "model": m} for m in self.loaded]})
+        if self.path == '/v1/models':
+            return self._send_json({"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+        self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        try:
+            body = self._read_body()
+        except ValueError:
+            return self._send_json({"error": "invalid json"}, 400)
+
+        model = body.get('model') or body.get('name')
+        if model and model not in self.stub.config['models']:
+            return self._send_json({"error": f"model '{model}' not found"}, 404)
+
+        routes = {
+            '/api/show': lambda: self._send_json({"modelfile": "", "details": {}}),
+            '/api/generate': lambda: self._ollama_generate(body, 'response'),
+            '/api/chat': lambda: self._ollama_generate(body, 'message'),
+            '/api/embeddings': lambda: self._send_json({"embedding": self.stub.embedding(body.get('prompt', ''))}),
+            '/v1/chat/completions': lambda: self._openai_chat(body),
+            '/v1/embeddings': lambda: self._openai_embeddings(body)
+        }
+        route = routes.get(self.path)
+        if route is None:
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            route()
+        except (ConnectionResetError, BrokenPipeError):
+            # Client đóng stream giữa chừng (thua hedge, JSON sai, kiểm tra tier) - dừng sinh
+            self.close_connection = True
+
+    def _ollama_generate(self, body: Dict[str, Any], key: str):
+        model = body['model']
+        prompt = _prompt_of(body)
+        num_predict = (body.get('options') or {}).get('num_predict')
+        output_format = body.get('format')
+
+        if key == 'response' and not prompt:
+            # Request nạp model (warm pool)
+            self.loaded[model] = time.time()
+            return self._send_json({"model": model, "response": "", "done": True})
+        self.loaded[model] = time.time()
+
+        def piece(text: str) -> Dict[str, Any]:
+            return {key: {"role": "assistant", "content": text}} if key == 'message' else {key: text}
+
+        if body.get('stream', True):
+            self._start_chunked('application/x-ndjson')
+            count = 0
+            for token in self.stub.stream(model, prompt, num_predict, output_format):
+                count += 1
+                self._write_chunk((json.dumps({"model": model, **piece(token), "done": False},
+                                              ensure_ascii=False) + "\n").encode('utf-8'))
+            final = {"model": model, **piece(""), "done": True, **self.stub.eval_stats(model, count)}
+            self._write_chunk((json.dumps(final) + "\n").encode('utf-8'))
+            return self._end_chunked()
+
+        text = "".join(self.stub.stream(model, prompt, num_predict, output_format))
+        count = len(self.stub.tokens(prompt, num_predict, output_format))
+        self._send_json({"model": model, **piece(text), "done": True, **self.stub.eval_stats(model, count)})
+
+    def _openai_chat(self, body: Dict[str, Any]):
+        model = body['model']
+        prompt = _prompt_of(body)
+        num_predict = body.get('max_tokens')
+        output_format = _openai_format(body)
+        self.loaded[model] = time.time()
+
+        if body.get('stream'):
+            self._start_chunked('text/event-stream')
+            count = 0
+            for token in self.stub.stream(model, prompt, num_predict, output_format):
+                count += 1
+                event = {"model": model, "choices": [{"index": 0, "delta": {"content": token}}]}
+                self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+            usage = {"model": model, "choices": [], "usage": {"completion_tokens": count}}
+            self._write_chunk(f"data: {json.dumps(usage)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            return self._end_chunked()
+
+        text = "".join(self.stub.stream(model, prompt, num_predict, output_format))
+        count = len(self.stub.tokens(prompt, num_predict, output_format))
+        stats = self.stub.eval_stats(model, count)
+        self._send_json({
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                         "finish_reason": "stop"}],
+            "usage": {"completion_tokens": count},
+            "timings": {"predicted_n": count, "predicted_ms": stats['eval_duration'] / 1e6}
+        })
+
+    def _openai_embeddings(self, body: Dict[str, Any]):
+        inputs = body.get('input', '')
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        self._send_json({
+            "object": "list",
+            "data": [{"index": i, "embedding": self.stub.embedding(text)} for i, text in enumerate(inputs)]
+        })
+
+
+class StubLLMServer:
+    """Stub server chạy trong thread nền"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_STUB_CONFIG)
+        self.config.update(config or {})
+
+        handler = type('StubHandler', (_StubHandler,), {"stub": StubModel(self.config), "loaded": {}})
+        self.httpd = ThreadingHTTPServer((self.config['host'], int(self.config['port'])), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'StubLLMServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        self.logger.info(f"🧪 Stub LLM server tại {self.base_url} "
+                         f"({self.config['latency_ms']}ms, {self.config['tokens_per_second']} tok/s)")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+_server: Optional[StubLLMServer] = None
+_server_lock = threading.Lock()
+
+
+def start_stub_server(config: Optional[Dict[str, Any]] = None) -> str:
+    """Khởi động stub server dùng chung của process (một lần), trả về base url"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = StubLLMServer(config).start()
+        return _server.base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub LLM server (Ollama + OpenAI API)")
+    parser.add_argument('--host', default=DEFAULT_STUB_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency-ms', type=float, default=DEFAULT_STUB_CONFIG['latency_ms'])
+    parser.add_argument('--tokens-per-second', type=float, default=DEFAULT_STUB_CONFIG['tokens_per_second'])
+    parser.add_argument('--response-tokens', type=int, default=DEFAULT_STUB_CONFIG['response_tokens'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = StubLLMServer({
+        "host": args.host,
+        "port": args.port,
+        "latency_ms": args.latency_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "response_tokens": args.response_tokens
+    }).start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
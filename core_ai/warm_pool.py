@@ -0,0 +1,159 @@
+"""
+WARM POOL - Giữ model Ollama đang dùng nhiều trong bộ nhớ, nạp trước model sắp dùng
+Theo dõi model resident qua /api/ps, gợi ý keep_alive theo tỉ lệ sử dụng gần đây
+"""
+import time
+import logging
+import threading
+from collections import Counter, deque
+from typing import Dict, Any, List, Optional
+
+from .http_transport import HTTPTransport
+
+DEFAULT_WARM_POOL_CONFIG = {
+    "enabled": True,
+    "preload": True,                # Nạp trước model kế tiếp (chỉ khi có một host)
+    "max_loaded_models": 1,         # Số model lớn vừa bộ nhớ cùng lúc (OLLAMA_MAX_LOADED_MODELS)
+    "history_size": 20,             # Số request gần nhất dùng để tính tỉ lệ sử dụng
+    "hot_share": 0.3,               # Model chiếm từ tỉ lệ này trở lên là model "nóng"
+    "hot_keep_alive": "30m",
+    "cold_keep_alive": "5m",
+    "preload_threshold": 0.3,       # Xác suất tối thiểu để nạp trước khi còn chỗ trống
+    "swap_threshold": 0.6,          # Chỉ có một chỗ: chỉ đổi model khi khả năng cao
+    "preload_cooldown": 60,         # Không nạp lại cùng một model trong khoảng này (giây)
+    "ps_ttl_seconds": 5,
+    "ps_timeout": 2,
+    "preload_timeout": 120
+}
+
+
+class WarmPoolManager:
+    """Quản lý model resident trên Ollama để tránh load/unload khi đổi intent"""
+
+    def __init__(self, transport: HTTPTransport, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.transport = transport
+        self.config = dict(DEFAULT_WARM_POOL_CONFIG)
+        self.config.update(config or {})
+
+        self._history: deque = deque(maxlen=self.config['history_size'])
+        # Đếm chuyển tiếp model trước -> model sau để đoán model kế tiếp
+        self._transitions: Dict[str, Counter] = {}
+        self._resident: List[str] = []
+        self._ps_fetched_at = 0.0
+        self._last_preload: Dict[str, float] = {}
+        self._preloading = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def resident_models(self, refresh: bool = False) -> List[str]:
+        """Model đang nằm trong bộ nhớ Ollama (/api/ps, cache ngắn)"""
+        with self._lock:
+            fresh = time.time() - self._ps_fetched_at < self.config['ps_ttl_seconds']
+            if fresh and not refresh:
+                return list(self._resident)
+
+        try:
+            response = self.transport.get("/api/ps", timeout=self.config['ps_timeout'])
+            models = [m.get('name') or m.get('model') for m in response.json().get('models', [])] \
+                if response.status_code == 200 else []
+        except Exception as e:
+            self.logger.debug(f"Không thể đọc /api/ps: {str(e)[:50]}")
+            models = []
+
+        with self._lock:
+            self._resident = models
+            self._ps_fetched_at = time.time()
+        return list(models)
+
+    def note_usage(self, model: str):
+        """Ghi nhận model được chọn cho một request"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._history:
+                self._transitions.setdefault(self._history[-1], Counter())[model] += 1
+            self._history.append(model)
+
+    def keep_alive_for(self, model: str) -> Optional[str]:
+        """Gợi ý keep_alive: model dùng nhiều được giữ lâu, model ít dùng theo mặc định"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            total = len(self._history)
+            share = self._history.count(model) / total if total else 0.0
+        return self.config['hot_keep_alive'] if share >= self.config['hot_share'] else self.config['cold_keep_alive']
+
+    def predict_next(self, model: str) -> Optional[tuple]:
+        """Model có khả năng được dùng tiếp theo sau model hiện tại, kèm xác suất"""
+        with self._lock:
+            counts = self._transitions.get(model)
+            if not counts:
+                return None
+            next_model, count = counts.most_common(1)[0]
+            return next_model, count / sum(counts.values())
+
+    def after_request(self, model: str):
+        """Sau khi request xong: ghi nhận model, nạp trước model kế tiếp ở thread nền"""
+        if not self.enabled:
+            return
+        self.note_usage(model)
+        if not self.config['preload']:
+            return
+        threading.Thread(target=self._maybe_preload, args=(model,), daemon=True).start()
+
+    def _maybe_preload(self, model: str):
+        """Nạp trước model kế tiếp nếu đáng và không gây thrashing"""
+        prediction = self.predict_next(model)
+        if prediction is None:
+            return
+        next_model, probability = prediction
+        if next_model == model:
+            return
+
+        resident = self.resident_models()
+        if next_model in resident:
+            return
+
+        # Còn chỗ trống thì nạp khi đủ khả năng; hết chỗ thì việc nạp sẽ đẩy model đang chạy ra,
+        # chỉ làm khi model kế tiếp gần như chắc chắn được dùng
+        has_room = len(resident) < self.config['max_loaded_models']
+        threshold = self.config['preload_threshold'] if has_room else self.config['swap_threshold']
+        if probability < threshold:
+            return
+
+        with self._lock:
+            recent = time.time() - self._last_preload.get(next_model, 0) < self.config['preload_cooldown']
+            if recent or next_model in self._preloading:
+                return
+            self._preloading.add(next_model)
+            self._last_preload[next_model] = time.time()
+
+        self._preload(next_model, probability)
+
+    def _preload(self, model: str, probability: float):
+        """Nạp model bằng request /api/generate không có prompt"""
+        self.logger.info(f"🔥 Nạp trước {model} (khả năng dùng tiếp {probability:.0%})")
+        try:
+            self.transport.post(
+                "/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive_for(model)},
+                timeout=self.config['preload_timeout']
+            )
+            with self._lock:
+                self._ps_fetched_at = 0.0
+        except Exception as e:
+            self.logger.debug(f"Không thể nạp trước {model}: {str(e)[:50]}")
+        finally:
+            with self._lock:
+                self._preloading.discard(model)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident": list(self._resident),
+                "usage": dict(Counter(self._history))
+            }
@@ -3,6 +3,7 @@ MAIN FILE - Điểm khởi chạy hệ thống ORCHESTRATOR
 """
 import os
 import sys
+import uuid
 import logging
 from datetime import datetime
 
@@ -49,17 +50,17 @@ Hướng dẫn:
 - Gõ 'model' để xem thông tin model
 """)
     
-    # Kiểm tra trạng thái hệ thống
+    # Kiểm tra trạng thái hệ thống (registry được cache, dispatcher dùng lại kết quả)
     try:
-        from core_ai.llm_dispatcher import LLMDispatcher
-        dispatcher = LLMDispatcher()
+        from core_ai.model_registry import get_model_registry
+        available_models = get_model_registry().get_available_models()
         
-        if dispatcher.use_mock:
+        if not available_models:
             print("\n⚠️  CHẾ ĐỘ: DEMO (chưa kết nối Ollama)")
             print("   Chạy 'ollama serve' để kích hoạt LLM thực")
         else:
             print(f"\n✅ CHẾ ĐỘ: FULL (với Ollama)")
-            print(f"📊 Model có sẵn: {', '.join(dispatcher.available_models)}")
+            print(f"📊 Model có sẵn: {', '.join(available_models)}")
             
         print("\n" + "="*60)
     except Exception as e:
@@ -79,6 +80,8 @@ def main():
         # Khởi tạo hệ thống
         logger.info("Khởi động hệ thống ORCHESTRATOR...")
         router = ChatRouter()
+        # Mỗi lần chạy là một hội thoại - các lượt sau dùng lại lịch sử với LLM
+        session_id = uuid.uuid4().hex[:12]
         logger.info("Hệ thống đã sẵn sàng!")
         
         print("\nHệ thống đã sẵn sàng. Bắt đầu chat...\n")
@@ -136,39 +139,32 @@ def main():
                     print("🤖 ORCHESTRATOR: Bạn muốn hỏi gì?")
                     continue
                 
-                # Xử lý input
-                print("🤖 ORCHESTRATOR: Đang xử lý...", end="\r")
+                # Xử lý input - hiển thị token ngay khi model sinh ra
+                print("🤖 ORCHESTRATOR: Đang xử lý...", end="\r", flush=True)
                 
-                result = router.route(user_input)
-                response = format_response(result)
-                # Kiểm tra nếu user muốn thêm chi tiết
-                if 'chi tiết' in user_input.lower() or 'detail' in user_input.lower():
-                    # Thêm marker yêu cầu response dài hơn
-                    if 'result' in result and isinstance(result['result'], dict):
-                        result['result']['require_detail'] = True
-
-                
-                # Hiển thị response
-                print(" " * 50, end="\r")  # Xóa dòng "đang xử lý"
-                # Kiểm tra và xử lý response trước khi in
-                if response.strip():
-                    # Chia response thành các dòng
-                    lines = response.strip().split('\n')
-                    
-                    # Loại bỏ các dòng trống và trùng lặp liền kề
-                    unique_lines = []
-                    for i, line in enumerate(lines):
-                        line_stripped = line.strip()
-                        if line_stripped and (i == 0 or line_stripped != lines[i-1].strip()):
-                            unique_lines.append(line_stripped)
+                result = {}
+                streamed = False
+                for event in router.route_stream(user_input, session_id):
+                    if event.get('done'):
+                        result = event
+                        break
                     
-                    # Ghép lại thành response duy nhất
-                    clean_response = '\n'.join(unique_lines)
-                    
-                    # Chỉ in một lần
-                    print(f"🤖 ORCHESTRATOR: {clean_response}\n")
+                    if not streamed:
+                        print(" " * 50, end="\r")  # Xóa dòng "đang xử lý"
+                        print("🤖 ORCHESTRATOR: ", end="", flush=True)
+                        streamed = True
+                    print(event.get('chunk', ''), end="", flush=True)
+                
+                if streamed:
+                    print("\n")
                 else:
-                    print("🤖 ORCHESTRATOR: Không có phản hồi.\n")
+                    # Không có token nào (lỗi pipeline) - hiển thị fallback
+                    print(" " * 50, end="\r")
+                    response = format_response(result)
+                    if response.strip():
+                        print(f"🤖 ORCHESTRATOR: {response.strip()}\n")
+                    else:
+                        print("🤖 ORCHESTRATOR: Không có phản hồi.\n")
                 
                 # Log kết quả
                 logger.info(f"Input: {user_input[:50]}... | Status: {result.get('status', 'unknown')}")
@@ -0,0 +1,116 @@
+"""
+ACCESS STATS - Đếm lượt truy cập bộ nhớ dài hạn trong RAM, ghi xuống storage theo lô
+Lượt đọc không còn ghi đĩa; thread nền flush định kỳ, khi dồn quá nhiều, lúc close hoặc lúc thoát.
+Mỗi thư mục memory chỉ có một AccessStats trong process (MemorySystem dùng chung)
+"""
+import atexit
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from .storage import MemoryStorage
+
+DEFAULT_ACCESS_STATS_CONFIG = {
+    "flush_interval": 10,     # Giây giữa hai lần flush
+    "max_pending": 1000       # Số entry chờ flush tối đa trước khi flush sớm
+}
+
+
+class AccessStats:
+    """Bảng (category, key_hash) -> số lượt truy cập chưa ghi và thời điểm truy cập gần nhất"""
+
+    def __init__(self, storage: MemoryStorage, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.config = dict(DEFAULT_ACCESS_STATS_CONFIG)
+        self.config.update(config or {})
+        self._pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        # Chỉ một lần flush chạy tại một thời điểm để lô sau không ghi trước lô trước
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._users = 0
+        atexit.register(self.flush)
+
+    def attach(self):
+        """Thêm một MemorySystem dùng instance này"""
+        with self._lock:
+            self._users += 1
+
+    def detach(self) -> bool:
+        """Bớt một MemorySystem, trả về True nếu không còn ai dùng"""
+        with self._lock:
+            self._users -= 1
+            return self._users <= 0
+
+    def close(self):
+        """Dừng thread flush, ghi nốt phần còn chờ và gỡ hook atexit"""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        atexit.unregister(self.flush)
+        self.flush()
+
+    def record(self, category: str, key_hash: str, accessed_at: str):
+        """Ghi nhận một lượt truy cập (chỉ trong RAM)"""
+        with self._lock:
+            entry = self._pending.setdefault((category, key_hash), {"count": 0, "last_accessed": accessed_at})
+            entry['count'] += 1
+            entry['last_accessed'] = max(entry['last_accessed'], accessed_at)
+            too_many = len(self._pending) >= self.config['max_pending']
+        self._ensure_thread()
+        if too_many:
+            self._wake.set()
+
+    def apply(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Cộng lượt truy cập chưa flush vào entry đọc từ storage"""
+        with self._lock:
+            pending = self._pending.get((entry['category'], entry['key_hash']))
+            if pending:
+                entry['access_count'] = entry.get('access_count', 0) + pending['count']
+                entry['last_accessed'] = max(entry.get('last_accessed', ''), pending['last_accessed'])
+        return entry
+
+    def flush(self) -> int:
+        """Ghi toàn bộ lượt truy cập đang chờ trong một lô, trả về số entry đã ghi"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            updates = [(category, key_hash, item['last_accessed'], item['count'])
+                       for (category, key_hash), item in batch.items()]
+            try:
+                self.storage.record_access(updates)
+            except Exception as e:
+                self.logger.warning(f"Không thể ghi access stats: {e}")
+                self._restore(batch)
+                return 0
+            return len(updates)
+
+    def _restore(self, batch: Dict[Tuple[str, str], Dict[str, Any]]):
+        """Trả lô ghi lỗi về bảng chờ để lần flush sau thử lại"""
+        with self._lock:
+            for key, item in batch.items():
+                entry = self._pending.setdefault(key, {"count": 0, "last_accessed": item['last_accessed']})
+                entry['count'] += item['count']
+                entry['last_accessed'] = max(entry['last_accessed'], item['last_accessed'])
+
+    def _ensure_thread(self):
+        if self._thread is not None or self._closed:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            def loop():
+                while not self._closed:
+                    self._wake.wait(self.config['flush_interval'])
+                    self._wake.clear()
+                    self.flush()
+
+            self._thread = threading.Thread(target=loop, daemon=True)
+            self._thread.start()
@@ -0,0 +1,123 @@
+"""
+LONG TERM INDEX - Chỉ mục từ khóa + metadata cho bộ nhớ dài hạn
+Truy vấn theo từ khóa, category, khoảng thời gian tạo và phân trang mà không quét storage
+"""
+import bisect
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from .text_index import InvertedIndex
+
+EntryId = Tuple[str, str]   # (category, key_hash)
+
+
+def entry_text(entry: Dict[str, Any]) -> str:
+    """Text được lập chỉ mục: key, category và toàn bộ tên trường / giá trị trong data"""
+    parts = [entry.get('key', ''), entry.get('category', '')]
+
+    def walk(value):
+        if isinstance(value, dict):
+            for field, item in value.items():
+                parts.append(str(field))
+                walk(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                walk(item)
+        elif value is not None:
+            parts.append(str(value))
+
+    walk(entry.get('data'))
+    return ' '.join(parts)
+
+
+class LongTermIndex:
+    """
+    Từ khóa: InvertedIndex (BM25, có/không dấu); category: tập entry theo category;
+    thời gian: danh sách (created_at, id) đã sắp xếp để cắt khoảng bằng bisect
+    """
+
+    def __init__(self):
+        self._text = InvertedIndex()
+        self._categories: Dict[str, Set[EntryId]] = {}
+        self._created: Dict[EntryId, str] = {}
+        self._timeline: List[Tuple[str, EntryId]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._created)
+
+    @classmethod
+    def build(cls, entries: Iterable[Dict[str, Any]]) -> 'LongTermIndex':
+        """Dựng lại toàn bộ chỉ mục từ một lượt quét storage"""
+        index = cls()
+        for entry in entries:
+            index.add(entry)
+        return index
+
+    def add(self, entry: Dict[str, Any]):
+        """Thêm hoặc thay entry (cùng category + key_hash)"""
+        entry_id = (entry['category'], entry['key_hash'])
+        created_at = entry.get('created_at', '')
+        self._text.add(self._doc_id(entry_id), entry_text(entry))
+        with self._lock:
+            self._remove_meta(entry_id)
+            self._categories.setdefault(entry_id[0], set()).add(entry_id)
+            self._created[entry_id] = created_at
+            bisect.insort(self._timeline, (created_at, entry_id))
+
+    def remove(self, category: str, key_hash: str):
+        entry_id = (category, key_hash)
+        self._text.remove(self._doc_id(entry_id))
+        with self._lock:
+            self._remove_meta(entry_id)
+
+    def _remove_meta(self, entry_id: EntryId):
+        created_at = self._created.pop(entry_id, None)
+        if created_at is None:
+            return
+        self._categories.get(entry_id[0], set()).discard(entry_id)
+        position = bisect.bisect_left(self._timeline, (created_at, entry_id))
+        if position < len(self._timeline) and self._timeline[position] == (created_at, entry_id):
+            del self._timeline[position]
+
+    def query(self, keyword: Optional[str] = None, category: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              offset: int = 0, limit: Optional[int] = None) -> Tuple[List[EntryId], int]:
+        """
+        Entry khớp mọi điều kiện, kèm tổng số để phân trang
+
+        Có keyword: xếp theo điểm BM25; không có: entry mới tạo trước.
+        since/until là chuỗi ISO của created_at (since tính cả, until không tính)
+        """
+        with self._lock:
+            allowed: Optional[Set[EntryId]] = None
+            if category is not None:
+                allowed = set(self._categories.get(category, ()))
+            if since is not None or until is not None:
+                start = bisect.bisect_left(self._timeline, (since,)) if since else 0
+                end = bisect.bisect_left(self._timeline, (until,)) if until else len(self._timeline)
+                in_range = {entry_id for _, entry_id in self._timeline[start:end]}
+                allowed = in_range if allowed is None else allowed & in_range
+
+            if not keyword:
+                candidates = allowed if allowed is not None else set(self._created)
+                ordered = sorted(candidates, key=lambda entry_id: self._created[entry_id], reverse=True)
+
+        if keyword:
+            ordered = []
+            for doc_id, _ in self._text.search(keyword, top_k=None):
+                entry_id = self._entry_id(doc_id)
+                if allowed is None or entry_id in allowed:
+                    ordered.append(entry_id)
+
+        end = None if limit is None else offset + limit
+        return ordered[offset:end], len(ordered)
+
+    @staticmethod
+    def _doc_id(entry_id: EntryId) -> str:
+        return f"{entry_id[0]}/{entry_id[1]}"
+
+    @staticmethod
+    def _entry_id(doc_id: str) -> EntryId:
+        category, key_hash = doc_id.rsplit('/', 1)
+        return category, key_hash
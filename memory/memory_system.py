@@ -1,22 +1,47 @@
 """
 MEMORY SYSTEM - Hệ thống bộ nhớ thông minh
+Dữ liệu lưu qua backend trong storage.py (mặc định SQLite WAL)
 """
-import os
-import json
-import pickle
 import hashlib
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 import logging
+import threading
 from pathlib import Path
 
+from .storage import MemoryStorage, create_storage, load_memory_settings
+from .text_index import InvertedIndex
+from .access_stats import AccessStats
+from .long_term_index import LongTermIndex
+from .vector_store import VectorStore, chunk_text
+
+DEFAULT_RETRIEVAL_CONFIG = {
+    "enabled": True,
+    "intents": ["research", "web_search"],  # Intent được kèm tài liệu vào prompt
+    "max_documents": 3,
+    "min_similarity": 0.5,            # Ngưỡng cosine cho đoạn từ vector store
+    "min_bm25_score": 0.2             # Ngưỡng BM25 chuẩn hóa (InvertedIndex.reference_score) khi không có vector store
+}
+
+# Chỉ mục trong RAM và AccessStats dùng chung giữa các MemorySystem cùng base_path trong process
+_shared_indexes: Dict[tuple, Any] = {}
+_shared_lock = threading.Lock()
+
 class MemorySystem:
     """Hệ thống quản lý bộ nhớ thông minh"""
     
-    def __init__(self, base_path: str = "memory"):
+    def __init__(self, base_path: str = "memory", storage: Optional[MemoryStorage] = None,
+                 embedder=None):
         self.logger = logging.getLogger(__name__)
         self.base_path = Path(base_path)
         self._init_memory_structure()
+        settings = load_memory_settings()
+        self.storage = storage or create_storage(self.base_path, settings)
+        self.access_stats = self._attach_access_stats(settings.get('access_stats'))
+        self.vector_config = settings.get('vector_store') or {}
+        self.retrieval_config = dict(DEFAULT_RETRIEVAL_CONFIG)
+        self.retrieval_config.update(settings.get('retrieval') or {})
+        self._embedder = embedder
         
     def _init_memory_structure(self):
         """Khởi tạo cấu trúc thư mục memory"""
@@ -25,43 +50,15 @@ class MemorySystem:
         for dir_name in dirs:
             dir_path = self.base_path / dir_name
             dir_path.mkdir(parents=True, exist_ok=True)
-        
-        # Tạo file index
-        index_file = self.base_path / "memory_index.json"
-        if not index_file.exists():
-            with open(index_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "total_entries": 0,
-                    "last_updated": datetime.now().isoformat(),
-                    "categories": {
-                        "short_term": 0,
-                        "long_term": 0,
-                        "vector": 0,
-                        "documents": 0,
-                        "knowledge": 0
-                    }
-                }, f, indent=2)
     
     def save_short_term(self, session_id: str, data: Dict[str, Any]) -> str:
         """Lưu bộ nhớ ngắn hạn (session-based)"""
         try:
-            session_file = self.base_path / "short_term" / f"{session_id}.json"
+            # Merge dữ liệu với session cũ
+            update = dict(data)
+            update['_last_updated'] = datetime.now().isoformat()
+            self.storage.merge_short_term(session_id, update)
             
-            # Đọc dữ liệu cũ nếu có
-            existing_data = {}
-            if session_file.exists():
-                with open(session_file, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            
-            # Merge dữ liệu
-            existing_data.update(data)
-            existing_data['_last_updated'] = datetime.now().isoformat()
-            
-            # Lưu file
-            with open(session_file, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, indent=2, ensure_ascii=False)
-            
-            self._update_index("short_term")
             return f"Đã lưu {len(data)} mục vào bộ nhớ ngắn hạn"
             
         except Exception as e:
@@ -74,13 +71,6 @@ class MemorySystem:
             # Tạo hash từ key
             key_hash = hashlib.md5(key.encode()).hexdigest()
             
-            # Tạo thư mục category nếu chưa có
-            category_dir = self.base_path / "long_term" / category
-            category_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Tạo file lưu trữ
-            memory_file = category_dir / f"{key_hash}.json"
-            
             memory_data = {
                 "key": key,
                 "key_hash": key_hash,
@@ -91,10 +81,10 @@ class MemorySystem:
                 "access_count": 1
             }
             
-            with open(memory_file, 'w', encoding='utf-8') as f:
-                json.dump(memory_data, f, indent=2, ensure_ascii=False)
-            
-            self._update_index("long_term")
+            self.storage.put_long_term(memory_data)
+            index = self._peek_index("long_term")
+            if index is not None:
+                index.add(memory_data)
             return f"Đã lưu '{key}' vào bộ nhớ dài hạn ({category})"
             
         except Exception as e:
@@ -102,62 +92,61 @@ class MemorySystem:
             return f"Lỗi: {e}"
     
     def retrieve_long_term(self, key: str = None, category: str = None, 
-                          keyword: str = None) -> List[Dict[str, Any]]:
-        """Truy xuất bộ nhớ dài hạn"""
+                          keyword: str = None, since: str = None, until: str = None,
+                          offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Truy xuất bộ nhớ dài hạn
+        
+        key: tra chính xác; còn lại trả lời từ chỉ mục: keyword (xếp theo BM25),
+        category, khoảng created_at [since, until) dạng ISO, phân trang offset/limit
+        """
         try:
-            results = []
-            base_dir = self.base_path / "long_term"
-            
-            if not base_dir.exists():
-                return results
-            
             # Tìm theo key chính xác
             if key:
+                results = []
                 key_hash = hashlib.md5(key.encode()).hexdigest()
-                for category_dir in base_dir.iterdir():
-                    if category_dir.is_dir():
-                        memory_file = category_dir / f"{key_hash}.json"
-                        if memory_file.exists():
-                            with open(memory_file, 'r', encoding='utf-8') as f:
-                                data = json.load(f)
-                                data['last_accessed'] = datetime.now().isoformat()
-                                data['access_count'] += 1
-                                results.append(data)
-                            
-                            # Cập nhật access time
-                            with open(memory_file, 'w', encoding='utf-8') as f:
-                                json.dump(data, f, indent=2, ensure_ascii=False)
-            
-            # Tìm theo category
-            elif category:
-                category_dir = base_dir / category
-                if category_dir.exists():
-                    for memory_file in category_dir.glob("*.json"):
-                        with open(memory_file, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            
-                            # Kiểm tra keyword nếu có
-                            if keyword:
-                                if (keyword.lower() in data['key'].lower() or 
-                                    keyword.lower() in str(data['data']).lower()):
-                                    results.append(data)
-                            else:
-                                results.append(data)
+                for data in self.storage.get_long_term(key_hash):
+                    if category and data['category'] != category:
+                        continue
+                    # Lượt truy cập chỉ ghi vào RAM, flush xuống storage theo lô
+                    self.access_stats.record(data['category'], key_hash, datetime.now().isoformat())
+                    results.append(data)
             
-            # Tìm toàn bộ
+            # Tìm theo keyword / category / thời gian qua chỉ mục
             else:
-                for category_dir in base_dir.iterdir():
-                    if category_dir.is_dir():
-                        for memory_file in category_dir.glob("*.json"):
-                            with open(memory_file, 'r', encoding='utf-8') as f:
-                                results.append(json.load(f))
+                ids, _ = self._get_long_term_index().query(keyword, category, since, until, offset, limit)
+                results = self.storage.get_long_term_entries(ids)
             
-            return results
+            return [self.access_stats.apply(data) for data in results]
             
         except Exception as e:
             self.logger.error(f"Lỗi truy xuất memory: {e}")
             return []
     
+    def count_long_term(self, keyword: str = None, category: str = None,
+                        since: str = None, until: str = None) -> int:
+        """Tổng số entry khớp điều kiện (để phân trang retrieve_long_term)"""
+        _, total = self._get_long_term_index().query(keyword, category, since, until, limit=0)
+        return total
+    
+    def save_knowledge(self, key: str, data: Dict[str, Any]) -> str:
+        """Lưu mục kiến thức (ghi đè nếu key đã có)"""
+        try:
+            self.storage.put_knowledge(key, data)
+            return f"Đã lưu kiến thức '{key}'"
+            
+        except Exception as e:
+            self.logger.error(f"Lỗi lưu knowledge: {e}")
+            return f"Lỗi: {e}"
+    
+    def get_knowledge(self, key: str) -> Optional[Dict[str, Any]]:
+        """Mục kiến thức theo key ({"key", "data", "updated_at"}), None nếu chưa có"""
+        try:
+            return self.storage.get_knowledge(key)
+        except Exception as e:
+            self.logger.error(f"Lỗi đọc knowledge: {e}")
+            return None
+    
     def save_document(self, content: str, metadata: Dict[str, Any] = None) -> str:
         """Lưu tài liệu học tập"""
         try:
@@ -177,12 +166,11 @@ class MemorySystem:
                 "source": "user_upload"
             }
             
-            # Lưu file
-            doc_file = self.base_path / "documents" / f"{content_hash}.json"
-            with open(doc_file, 'w', encoding='utf-8') as f:
-                json.dump(doc_data, f, indent=2, ensure_ascii=False)
-            
-            self._update_index("documents")
+            self.storage.put_document(doc_data)
+            index = self._peek_index("documents")
+            if index is not None:
+                index.add(content_hash, self._document_text(doc_data))
+            self._embed_document(content_hash, content)
             return f"Đã lưu tài liệu (ID: {content_hash[:8]})"
             
         except Exception as e:
@@ -190,29 +178,14 @@ class MemorySystem:
             return f"Lỗi: {e}"
     
     def search_documents(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
-        """Tìm kiếm tài liệu theo từ khóa"""
+        """Tìm kiếm tài liệu theo từ khóa (BM25 trên chỉ mục ngược, có/không dấu đều khớp)"""
         try:
             results = []
-            docs_dir = self.base_path / "documents"
-            
-            if not docs_dir.exists():
-                return results
-            
-            query_lower = query.lower()
-            
-            for doc_file in docs_dir.glob("*.json"):
-                with open(doc_file, 'r', encoding='utf-8') as f:
-                    doc_data = json.load(f)
-                    
-                    # Tìm kiếm trong content và metadata
-                    content = doc_data.get('content', '').lower()
-                    metadata = str(doc_data.get('metadata', {})).lower()
-                    
-                    if query_lower in content or query_lower in metadata:
-                        results.append(doc_data)
-                
-                if len(results) >= max_results:
-                    break
+            for doc_id, score in self._get_document_index().search(query, max_results):
+                doc_data = self.storage.get_document(doc_id)
+                if doc_data is not None:
+                    doc_data['score'] = round(score, 4)
+                    results.append(doc_data)
             
             return results
             
@@ -220,39 +193,174 @@ class MemorySystem:
             self.logger.error(f"Lỗi tìm kiếm documents: {e}")
             return []
     
-    def _update_index(self, category: str):
-        """Cập nhật memory index"""
+    def similarity_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        k đoạn tài liệu gần nghĩa nhất với query (cosine trên embedding)
+        
+        Mỗi kết quả: doc_id, chunk, text, score, metadata; rỗng nếu chưa có embedding model
+        """
         try:
-            index_file = self.base_path / "memory_index.json"
-            
-            if index_file.exists():
-                with open(index_file, 'r', encoding='utf-8') as f:
-                    index = json.load(f)
-            else:
-                index = {
-                    "total_entries": 0,
-                    "last_updated": datetime.now().isoformat(),
-                    "categories": {}
-                }
-            
-            # Đếm file trong category
-            if category in ["short_term", "long_term", "documents", "knowledge"]:
-                category_dir = self.base_path / category
-                if category_dir.exists():
-                    if category == "long_term":
-                        count = sum(1 for _ in category_dir.rglob("*.json"))
-                    else:
-                        count = sum(1 for _ in category_dir.glob("*.json"))
-                    
-                    index["categories"][category] = count
-            
-            # Tính tổng
-            total = sum(index["categories"].values())
-            index["total_entries"] = total
-            index["last_updated"] = datetime.now().isoformat()
+            store = self._get_vector_store()
+            if store is None or not len(store):
+                return []
+            vector = self._get_embedder().embed([query])[0]
+            results = store.search(vector, k)
+            for result in results:
+                doc_data = self.storage.get_document(result['doc_id']) or {}
+                result['metadata'] = doc_data.get('metadata', {})
+            return results
             
-            with open(index_file, 'w', encoding='utf-8') as f:
-                json.dump(index, f, indent=2, ensure_ascii=False)
-                
         except Exception as e:
-            self.logger.error(f"Lỗi update index: {e}")
\ No newline at end of file
+            self.logger.error(f"Lỗi tìm kiếm ngữ nghĩa: {e}")
+            return []
+    
+    def retrieve_context(self, query: str, intent: str = "chat") -> List[Dict[str, Any]]:
+        """
+        Tài liệu liên quan để kèm vào prompt (plan['documents']), đã xếp theo độ liên quan
+        
+        Có vector store thì lấy đoạn gần nghĩa (đạt min_similarity), không thì BM25 trên tài liệu
+        (đạt min_bm25_score sau chuẩn hóa); mỗi kết quả: content, doc_id, chunk, score, source
+        """
+        config = self.retrieval_config
+        if not config['enabled'] or intent not in config['intents'] or not query.strip():
+            return []
+        
+        store = self._get_vector_store()
+        if store is not None and len(store):
+            return [
+                {"content": match['text'], "doc_id": match['doc_id'], "chunk": match['chunk'],
+                 "score": match['score'], "source": match['metadata'].get('source', 'unknown')}
+                for match in self.similarity_search(query, config['max_documents'])
+                if match['score'] >= config['min_similarity']
+            ]
+        
+        # Điểm BM25 không có thang cố định: chuẩn hóa để một từ phổ biến trùng không kéo tài liệu vào prompt
+        reference = self._get_document_index().reference_score(query)
+        if reference <= 0:
+            return []
+        return [
+            {"content": doc['content'], "doc_id": doc['id'], "chunk": 0,
+             "score": round(doc['score'] / reference, 4),
+             "source": doc.get('metadata', {}).get('source', 'unknown')}
+            for doc in self.search_documents(query, config['max_documents'])
+            if doc['score'] / reference >= config['min_bm25_score']
+        ]
+    
+    def rebuild_vector_store(self) -> int:
+        """Nhúng lại mọi tài liệu trong storage (vd. sau khi đổi embedding model), trả về số đoạn"""
+        store = self._get_vector_store()
+        if store is None:
+            return 0
+        store.reset()
+        return sum(self._embed_document(doc_data['id'], doc_data.get('content', ''))
+                   for doc_data in self.storage.iter_documents())
+    
+    def _embed_document(self, doc_id: str, content: str) -> int:
+        """Chia đoạn + nhúng tài liệu vào vector store (bỏ qua nếu đã có hoặc store tắt)"""
+        try:
+            store = self._get_vector_store()
+            if store is None or doc_id in store:
+                return 0
+            chunks = chunk_text(content, store.config['chunk_chars'])
+            return store.add(doc_id, chunks, self._get_embedder().embed(chunks))
+        except Exception as e:
+            self.logger.warning(f"Không thể nhúng tài liệu {doc_id[:8]}: {e}")
+            return 0
+    
+    def _get_embedder(self):
+        """Embedder mặc định dùng chung provider / host pool với dispatcher (nạp khi cần)"""
+        if self._embedder is None:
+            from core_ai.embeddings import get_embedder
+            self._embedder = get_embedder()
+        return self._embedder
+    
+    def _get_vector_store(self) -> Optional[VectorStore]:
+        """Vector store dùng chung theo base_path; None nếu bị tắt, thiếu numpy hoặc chưa có embedding model"""
+        if not self.vector_config.get('enabled', True):
+            return None
+        store = self._peek_index("vectors")
+        if store is None:
+            try:
+                model = self._get_embedder().model
+            except ImportError as e:
+                self.logger.warning(f"Không có embedder, tắt vector store: {e}")
+                return None
+            if not model:
+                return None
+            store = self._shared_index("vectors", lambda: VectorStore(
+                self.base_path / "vector_store", self.vector_config, model=model))
+        return store if store.available else None
+    
+    def _get_document_index(self) -> InvertedIndex:
+        """Chỉ mục tài liệu, dựng một lần từ storage ở lần tìm kiếm đầu tiên"""
+        def build():
+            index = InvertedIndex()
+            for doc_data in self.storage.iter_documents():
+                index.add(doc_data['id'], self._document_text(doc_data))
+            return index
+        return self._shared_index("documents", build)
+    
+    def _get_long_term_index(self) -> LongTermIndex:
+        """Chỉ mục bộ nhớ dài hạn; quét toàn bộ storage chỉ khi dựng lại"""
+        return self._shared_index("long_term", lambda: LongTermIndex.build(self.storage.iter_long_term()))
+    
+    def rebuild_indexes(self):
+        """Bỏ chỉ mục hiện tại, lần truy vấn sau sẽ dựng lại từ storage"""
+        with _shared_lock:
+            for kind in ("documents", "long_term"):
+                _shared_indexes.pop((str(self.base_path.resolve()), kind), None)
+    
+    def _shared_index(self, kind: str, build):
+        key = (str(self.base_path.resolve()), kind)
+        index = _shared_indexes.get(key)
+        if index is None:
+            with _shared_lock:
+                index = _shared_indexes.get(key)
+                if index is None:
+                    index = build()
+                    _shared_indexes[key] = index
+                    self.logger.info(f"🔎 Đã lập chỉ mục {len(index)} mục ({kind})")
+        return index
+    
+    def _attach_access_stats(self, config: Optional[Dict[str, Any]]) -> AccessStats:
+        """AccessStats dùng chung theo base_path: mọi instance thấy cùng số lượt chưa flush"""
+        key = (str(self.base_path.resolve()), "access_stats")
+        with _shared_lock:
+            stats = _shared_indexes.get(key)
+            if stats is None:
+                stats = AccessStats(self.storage, config)
+                _shared_indexes[key] = stats
+            stats.attach()
+        return stats
+    
+    def close(self):
+        """Ghi lượt truy cập còn chờ; instance cuối cùng của base_path dừng AccessStats dùng chung"""
+        key = (str(self.base_path.resolve()), "access_stats")
+        with _shared_lock:
+            last = self.access_stats.detach()
+            if last and _shared_indexes.get(key) is self.access_stats:
+                del _shared_indexes[key]
+        if last:
+            self.access_stats.close()
+        else:
+            self.access_stats.flush()
+    
+    def _peek_index(self, kind: str):
+        """Chỉ mục đã dựng (None nếu chưa) - lúc ghi không dựng chỉ mục mới"""
+        return _shared_indexes.get((str(self.base_path.resolve()), kind))
+    
+    @staticmethod
+    def _document_text(doc_data: Dict[str, Any]) -> str:
+        """Nội dung được lập chỉ mục: content + giá trị metadata"""
+        metadata = doc_data.get('metadata') or {}
+        return ' '.join([doc_data.get('content', '')] + [str(v) for v in metadata.values()])
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê số entry theo loại (thay cho memory_index.json)"""
+        categories = self.storage.counts()
+        return {
+            "total_entries": sum(categories.values()),
+            "last_updated": datetime.now().isoformat(),
+            "categories": categories,
+            "backend": self.storage.name
+        }
@@ -0,0 +1,492 @@
+"""
+MEMORY STORAGE - Backend lưu trữ cho MemorySystem
+SQLite (WAL, bảng có index, upsert trong transaction) hoặc file JSON như trước
+"""
+import abc
+import json
+import yaml
+import hashlib
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+DEFAULT_STORAGE_CONFIG = {
+    "backend": "sqlite",        # sqlite | json
+    "sqlite": {
+        "filename": "memory.db",
+        "busy_timeout_ms": 5000
+    },
+    "migrate_json": True        # Lần đầu mở DB rỗng: nhập dữ liệu từ các file JSON cũ
+}
+
+CATEGORIES = ["short_term", "long_term", "documents", "knowledge"]
+
+
+def load_memory_settings(path: str = 'config/settings.yaml') -> Dict[str, Any]:
+    """Đọc mục `memory` trong settings.yaml (rỗng nếu không có)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            settings = yaml.safe_load(f) or {}
+        return settings.get('memory', {}) or {}
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Không thể tải cấu hình memory: {e}")
+        return {}
+
+
+class MemoryStorage(abc.ABC):
+    """Giao diện backend; entry long-term định danh bởi (category, key_hash)"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def get_short_term(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def merge_short_term(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Gộp data vào session (đọc-sửa-ghi nguyên tử), trả về session sau khi gộp"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_long_term(self, entry: Dict[str, Any]):
+        """Thêm hoặc ghi đè entry"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_long_term(self, key_hash: str) -> List[Dict[str, Any]]:
+        """Entry có key_hash ở mọi category"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_long_term(self, category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_long_term_entries(self, ids: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Entry theo danh sách (category, key_hash), giữ thứ tự, bỏ qua id không còn"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def record_access(self, updates: List[Tuple[str, str, str, int]]):
+        """Cộng dồn lượt truy cập theo lô: [(category, key_hash, last_accessed, số lượt)]"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_document(self, doc: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_documents(self) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put_knowledge(self, key: str, data: Dict[str, Any]):
+        """Ghi (hoặc thay) mục kiến thức theo key"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_knowledge(self, key: str) -> Optional[Dict[str, Any]]:
+        """{"key", "data", "updated_at"} hoặc None"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_knowledge(self) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Số entry theo loại (short_term, long_term, documents, knowledge)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JSONFileStorage(MemoryStorage):
+    """Mỗi entry một file JSON (cấu trúc thư mục cũ)"""
+
+    name = "json"
+
+    def __init__(self, base_path: Path):
+        self.base_path = Path(base_path)
+        for dir_name in CATEGORIES:
+            (self.base_path / dir_name).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def get_short_term(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._read(self.base_path / "short_term" / f"{session_id}.json")
+
+    def merge_short_term(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        session_file = self.base_path / "short_term" / f"{session_id}.json"
+        with self._lock:
+            existing = self._read(session_file) or {}
+            existing.update(data)
+            self._write(session_file, existing)
+        return existing
+
+    def put_long_term(self, entry: Dict[str, Any]):
+        category_dir = self.base_path / "long_term" / entry['category']
+        category_dir.mkdir(parents=True, exist_ok=True)
+        self._write(category_dir / f"{entry['key_hash']}.json", entry)
+
+    def get_long_term(self, key_hash: str) -> List[Dict[str, Any]]:
+        results = []
+        for category_dir in self._category_dirs():
+            entry = self._read(category_dir / f"{key_hash}.json")
+            if entry is not None:
+                results.append(entry)
+        return results
+
+    def iter_long_term(self, category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        dirs = [self.base_path / "long_term" / category] if category else self._category_dirs()
+        for category_dir in dirs:
+            if category_dir.is_dir():
+                for memory_file in category_dir.glob("*.json"):
+                    entry = self._read(memory_file)
+                    if entry is not None:
+                        yield entry
+
+    def get_long_term_entries(self, ids: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        entries = (self._read(self.base_path / "long_term" / category / f"{key_hash}.json")
+                   for category, key_hash in ids)
+        return [entry for entry in entries if entry is not None]
+
+    def record_access(self, updates: List[Tuple[str, str, str, int]]):
+        with self._lock:
+            for category, key_hash, last_accessed, count in updates:
+                memory_file = self.base_path / "long_term" / category / f"{key_hash}.json"
+                entry = self._read(memory_file)
+                if entry is not None:
+                    entry['access_count'] = entry.get('access_count', 0) + count
+                    entry['last_accessed'] = max(entry.get('last_accessed', ''), last_accessed)
+                    self._write(memory_file, entry)
+
+    def put_document(self, doc: Dict[str, Any]):
+        self._write(self.base_path / "documents" / f"{doc['id']}.json", doc)
+
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self._read(self.base_path / "documents" / f"{doc_id}.json")
+
+    def iter_documents(self) -> Iterator[Dict[str, Any]]:
+        for doc_file in (self.base_path / "documents").glob("*.json"):
+            doc = self._read(doc_file)
+            if doc is not None:
+                yield doc
+
+    def put_knowledge(self, key: str, data: Dict[str, Any]):
+        entry = {"key": key, "data": data, "updated_at": datetime.now().isoformat()}
+        self._write(self._knowledge_file(key), entry)
+
+    def get_knowledge(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._read(self._knowledge_file(key))
+
+    def iter_knowledge(self) -> Iterator[Dict[str, Any]]:
+        for knowledge_file in (self.base_path / "knowledge").glob("*.json"):
+            entry = self._read(knowledge_file)
+            if entry is not None:
+                yield entry
+
+    def _knowledge_file(self, key: str) -> Path:
+        # Key tùy ý nên đặt tên file theo hash
+        return self.base_path / "knowledge" / f"{hashlib.md5(key.encode()).hexdigest()}.json"
+
+    def counts(self) -> Dict[str, int]:
+        counts = {}
+        for category in CATEGORIES:
+            category_dir = self.base_path / category
+            pattern = category_dir.rglob if category == "long_term" else category_dir.glob
+            counts[category] = sum(1 for _ in pattern("*.json"))
+        return counts
+
+    def _category_dirs(self) -> List[Path]:
+        base_dir = self.base_path / "long_term"
+        return [d for d in base_dir.iterdir() if d.is_dir()] if base_dir.exists() else []
+
+    @staticmethod
+    def _read(path: Path) -> Optional[Dict[str, Any]]:
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write(path: Path, data: Dict[str, Any]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS short_term (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS long_term (
+    category TEXT NOT NULL,
+    key_hash TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    last_accessed TEXT NOT NULL,
+    access_count INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (category, key_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_long_term_key_hash ON long_term (key_hash);
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    type TEXT,
+    source TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_created_at ON documents (created_at);
+CREATE TABLE IF NOT EXISTS knowledge (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage(MemoryStorage):
+    """
+    Một file SQLite ở chế độ WAL: người đọc không chặn người ghi, mỗi lần lưu
+    là một upsert theo khóa chính thay vì ghi lại file + đếm lại thư mục
+    """
+
+    name = "sqlite"
+
+    def __init__(self, base_path: Path, config: Optional[Dict[str, Any]] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_STORAGE_CONFIG['sqlite'])
+        self.config.update(config or {})
+        self.base_path = Path(base_path)
+        self.base_path.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.base_path / self.config['filename']
+        self._local = threading.local()   # Mỗi thread một connection
+
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=self.config['busy_timeout_ms'] / 1000)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: không fsync mỗi commit, vẫn an toàn khi process bị kill
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_short_term(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM short_term WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def merge_short_term(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        conn = self._conn()
+        with conn:
+            # Giữ khóa ghi từ lúc đọc để hai lần gộp đồng thời không ghi đè nhau
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM short_term WHERE session_id = ?", (session_id,)).fetchone()
+            merged = json.loads(row['data']) if row else {}
+            merged.update(data)
+            conn.execute(
+                "INSERT INTO short_term (session_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (session_id, self._dumps(merged), datetime.now().isoformat())
+            )
+        return merged
+
+    def put_long_term(self, entry: Dict[str, Any]):
+        with self._conn() as conn:
+            self._insert_long_term(conn, entry)
+
+    def _insert_long_term(self, conn: sqlite3.Connection, entry: Dict[str, Any]):
+        conn.execute(
+            "INSERT INTO long_term (category, key_hash, key, data, created_at, last_accessed, access_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(category, key_hash) DO UPDATE SET key = excluded.key, data = excluded.data, "
+            "created_at = excluded.created_at, last_accessed = excluded.last_accessed, "
+            "access_count = excluded.access_count",
+            (entry['category'], entry['key_hash'], entry['key'], self._dumps(entry['data']),
+             entry['created_at'], entry['last_accessed'], entry.get('access_count', 1))
+        )
+
+    def get_long_term(self, key_hash: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT * FROM long_term WHERE key_hash = ?", (key_hash,))
+        return [self._long_term_entry(row) for row in rows]
+
+    def iter_long_term(self, category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        if category:
+            rows = self._conn().execute("SELECT * FROM long_term WHERE category = ?", (category,))
+        else:
+            rows = self._conn().execute("SELECT * FROM long_term")
+        for row in rows.fetchall():
+            yield self._long_term_entry(row)
+
+    def get_long_term_entries(self, ids: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        found = {}
+        conn = self._conn()
+        for start in range(0, len(ids), 400):
+            chunk = ids[start:start + 400]
+            placeholders = ', '.join('(?, ?)' for _ in chunk)
+            rows = conn.execute(
+                f"SELECT * FROM long_term WHERE (category, key_hash) IN (VALUES {placeholders})",
+                [value for entry_id in chunk for value in entry_id]
+            )
+            for row in rows:
+                found[(row['category'], row['key_hash'])] = self._long_term_entry(row)
+        return [found[entry_id] for entry_id in ids if entry_id in found]
+
+    def record_access(self, updates: List[Tuple[str, str, str, int]]):
+        with self._conn() as conn:
+            # Cộng dồn trong SQL để không ghi đè lượt truy cập của process khác
+            conn.executemany(
+                "UPDATE long_term SET access_count = access_count + ?, "
+                "last_accessed = MAX(last_accessed, ?) WHERE category = ? AND key_hash = ?",
+                [(count, last_accessed, category, key_hash)
+                 for category, key_hash, last_accessed, count in updates]
+            )
+
+    def put_document(self, doc: Dict[str, Any]):
+        with self._conn() as conn:
+            self._insert_document(conn, doc)
+
+    def _insert_document(self, conn: sqlite3.Connection, doc: Dict[str, Any]):
+        conn.execute(
+            "INSERT INTO documents (id, content, metadata, type, source, created_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET content = excluded.content, metadata = excluded.metadata, "
+            "type = excluded.type, source = excluded.source, created_at = excluded.created_at",
+            (doc['id'], doc.get('content', ''), self._dumps(doc.get('metadata') or {}),
+             doc.get('type'), doc.get('source'), doc.get('created_at') or datetime.now().isoformat())
+        )
+
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return self._document(row) if row else None
+
+    def iter_documents(self) -> Iterator[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT * FROM documents ORDER BY created_at")
+        for row in rows.fetchall():
+            yield self._document(row)
+
+    def put_knowledge(self, key: str, data: Dict[str, Any]):
+        with self._conn() as conn:
+            self._insert_knowledge(conn, key, data, datetime.now().isoformat())
+
+    def _insert_knowledge(self, conn: sqlite3.Connection, key: str, data: Dict[str, Any], updated_at: str):
+        conn.execute(
+            "INSERT INTO knowledge (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (key, self._dumps(data), updated_at)
+        )
+
+    def get_knowledge(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM knowledge WHERE key = ?", (key,)).fetchone()
+        return self._knowledge(row) if row else None
+
+    def iter_knowledge(self) -> Iterator[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT * FROM knowledge ORDER BY key")
+        for row in rows.fetchall():
+            yield self._knowledge(row)
+
+    def counts(self) -> Dict[str, int]:
+        conn = self._conn()
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in CATEGORIES}
+
+    def is_empty(self) -> bool:
+        return not any(self.counts().values())
+
+    def import_from(self, source: JSONFileStorage) -> int:
+        """Nhập toàn bộ dữ liệu từ backend JSON trong một transaction, trả về số entry"""
+        conn = self._conn()
+        imported = 0
+        with conn:
+            for session_file in (source.base_path / "short_term").glob("*.json"):
+                data = source._read(session_file) or {}
+                conn.execute(
+                    "INSERT OR REPLACE INTO short_term (session_id, data, updated_at) VALUES (?, ?, ?)",
+                    (session_file.stem, self._dumps(data), data.get('_last_updated') or datetime.now().isoformat())
+                )
+                imported += 1
+            for entry in source.iter_long_term():
+                self._insert_long_term(conn, entry)
+                imported += 1
+            for doc in source.iter_documents():
+                if 'id' in doc:
+                    self._insert_document(conn, doc)
+                    imported += 1
+            for entry in source.iter_knowledge():
+                if 'key' in entry:
+                    self._insert_knowledge(conn, entry['key'], entry.get('data') or {},
+                                           entry.get('updated_at') or datetime.now().isoformat())
+                    imported += 1
+        return imported
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _long_term_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "key": row['key'],
+            "key_hash": row['key_hash'],
+            "data": json.loads(row['data']),
+            "category": row['category'],
+            "created_at": row['created_at'],
+            "last_accessed": row['last_accessed'],
+            "access_count": row['access_count']
+        }
+
+    @staticmethod
+    def _document(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row['id'],
+            "content": row['content'],
+            "metadata": json.loads(row['metadata']),
+            "created_at": row['created_at'],
+            "type": row['type'],
+            "source": row['source']
+        }
+
+    @staticmethod
+    def _knowledge(row: sqlite3.Row) -> Dict[str, Any]:
+        return {"key": row['key'], "data": json.loads(row['data']), "updated_at": row['updated_at']}
+
+    @staticmethod
+    def _dumps(data: Any) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
+
+def create_storage(base_path: Path, config: Optional[Dict[str, Any]] = None) -> MemoryStorage:
+    """Tạo backend theo cấu hình `memory` trong settings.yaml"""
+    settings = dict(DEFAULT_STORAGE_CONFIG)
+    settings.update(config or {})
+    logger = logging.getLogger(__name__)
+
+    if settings['backend'] == 'json':
+        return JSONFileStorage(base_path)
+    if settings['backend'] != 'sqlite':
+        logger.warning(f"Backend memory không hỗ trợ: {settings['backend']}, dùng sqlite")
+
+    storage = SQLiteStorage(base_path, settings.get('sqlite'))
+    legacy = Path(base_path) / "long_term"
+    if settings['migrate_json'] and storage.is_empty() and legacy.exists():
+        imported = storage.import_from(JSONFileStorage(base_path))
+        if imported:
+            logger.info(f"📦 Đã chuyển {imported} entry từ file JSON sang {storage.db_path}")
+    return storage
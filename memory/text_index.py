@@ -0,0 +1,151 @@
+"""
+TEXT INDEX - Chỉ mục ngược cho tìm kiếm tài liệu trong bộ nhớ
+Tách từ có xử lý dấu tiếng Việt (giữ dấu + bản bỏ dấu), xếp hạng BM25
+"""
+import re
+import math
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_INDEX_CONFIG = {
+    "k1": 1.5,
+    "b": 0.75,
+    "folded_weight": 0.3    # Trọng số khớp bản bỏ dấu khi câu hỏi có gõ dấu
+}
+
+_WORD = re.compile(r'\w+')
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'Tiếng Việt đẹp' -> 'tieng viet dep' (chữ thường)"""
+    decomposed = unicodedata.normalize('NFD', text.lower())
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+    return stripped.replace('đ', 'd')
+
+
+def tokenize(text: str) -> List[str]:
+    """Các từ (chữ thường, dạng NFC) theo thứ tự xuất hiện"""
+    return _WORD.findall(unicodedata.normalize('NFC', text.lower()))
+
+
+def index_terms(text: str) -> List[str]:
+    """
+    Term đưa vào chỉ mục: mỗi từ luôn có bản bỏ dấu, từ có dấu có thêm bản giữ dấu
+
+    Bản bỏ dấu cho phép gõ không dấu vẫn tìm được; bản giữ dấu giúp phân biệt 'việt' với 'viết'
+    """
+    terms = []
+    for word in tokenize(text):
+        folded = fold_diacritics(word)
+        terms.append(folded)
+        if folded != word:
+            terms.append(word)
+    return terms
+
+
+class InvertedIndex:
+    """Chỉ mục ngược cập nhật tăng dần: term -> {doc_id: tần suất}"""
+
+    def __init__(self, config: Dict = None):
+        self.config = dict(DEFAULT_INDEX_CONFIG)
+        self.config.update(config or {})
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_length: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_length)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_length
+
+    def add(self, doc_id: str, text: str):
+        """Thêm (hoặc thay) tài liệu"""
+        words = tokenize(text)
+        terms = Counter(index_terms(text))
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._doc_terms[doc_id] = terms
+            # Độ dài tính theo số từ gốc, không tính term bỏ dấu nhân đôi
+            self._doc_length[doc_id] = len(words)
+            self._total_length += len(words)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_length.pop(doc_id)
+
+    def query_terms(self, query: str) -> Dict[str, float]:
+        """Term của câu hỏi kèm trọng số: gõ có dấu thì ưu tiên khớp đúng dấu"""
+        weights: Dict[str, float] = {}
+        for word in tokenize(query):
+            folded = fold_diacritics(word)
+            if folded == word:
+                weights[folded] = max(weights.get(folded, 0.0), 1.0)
+            else:
+                weights[word] = max(weights.get(word, 0.0), 1.0)
+                weights[folded] = max(weights.get(folded, 0.0), self.config['folded_weight'])
+        return weights
+
+    def reference_score(self, query: str) -> float:
+        """
+        Điểm của tài liệu dài trung bình chứa mỗi term của câu hỏi đúng một lần
+
+        Chia điểm BM25 cho giá trị này được độ liên quan ~[0, 1]: tỉ lệ trọng số idf
+        của câu hỏi mà tài liệu khớp (khớp vài từ phổ biến thì gần 0)
+        """
+        weights = self.query_terms(query)
+        with self._lock:
+            total_docs = len(self._doc_length)
+            reference = 0.0
+            for term, weight in weights.items():
+                matches = len(self._postings.get(term, ()))
+                reference += weight * math.log(1 + (total_docs - matches + 0.5) / (matches + 0.5))
+        return reference
+
+    def search(self, query: str, top_k: Optional[int] = 5) -> List[Tuple[str, float]]:
+        """
+        Top-k (doc_id, điểm BM25) giảm dần; top_k = None trả về mọi tài liệu khớp
+
+        Chỉ duyệt posting list của các term trong câu hỏi nên chi phí theo số tài liệu
+        chứa term, không theo kích thước toàn bộ kho
+        """
+        weights = self.query_terms(query)
+        k1, b = self.config['k1'], self.config['b']
+        with self._lock:
+            total_docs = len(self._doc_length)
+            if not total_docs or not weights:
+                return []
+            avg_length = self._total_length / total_docs or 1.0
+
+            scores: Dict[str, float] = {}
+            for term, weight in weights.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = k1 * (1 - b + b * self._doc_length[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * idf * tf * (k1 + 1) / (tf + norm)
+
+        if top_k is None:
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
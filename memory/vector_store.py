@@ -0,0 +1,313 @@
+"""
+VECTOR STORE - Kho vector nhúng cục bộ trong memory/vector_store
+Ma trận float32 memory-map xuống đĩa, tìm kiếm chính xác (cosine) hoặc IVF xấp xỉ;
+numpy là phụ thuộc tùy chọn, thiếu numpy thì kho vector tự tắt
+"""
+import re
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+DEFAULT_VECTOR_STORE_CONFIG = {
+    "enabled": True,
+    "mode": "exact",              # exact | ivf
+    "chunk_chars": 1000,          # Độ dài tối đa một đoạn được nhúng
+    "initial_capacity": 1024,     # Số dòng cấp phát ban đầu, nhân đôi khi đầy
+    "ivf": {
+        "nlist": 0,               # Số cụm (0 = ~sqrt(số vector))
+        "nprobe": 8,              # Số cụm được duyệt khi tìm
+        "train_threshold": 20000, # Chưa đủ vector thì vẫn tìm chính xác
+        "train_sample": 50000,
+        "iterations": 10
+    }
+}
+
+_PARAGRAPH = re.compile(r'\n\s*\n')
+_SENTENCE = re.compile(r'(?<=[.!?])\s+')
+
+
+def chunk_text(text: str, max_chars: int) -> List[str]:
+    """Chia tài liệu thành đoạn ≤ max_chars, cắt ở ranh giới đoạn văn rồi tới câu"""
+    pieces = []
+    for paragraph in _PARAGRAPH.split(text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE.split(paragraph):
+            # Câu quá dài thì cắt cứng
+            pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+
+    chunks, current = [], ''
+    for piece in pieces:
+        if not piece:
+            continue
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+class VectorStore:
+    """
+    vectors.f32: ma trận (capacity, dim) đã chuẩn hóa, memory-map nên không nạp hết vào RAM
+    chunks.jsonl: mỗi dòng ứng với một hàng (doc_id, số thứ tự đoạn, text), chỉ ghi nối thêm
+    state.json: dim, số hàng, embedding model; ivf_centroids.npy khi đã train IVF
+    """
+
+    def __init__(self, path: Path, config: Optional[Dict[str, Any]] = None, model: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.config = dict(DEFAULT_VECTOR_STORE_CONFIG)
+        self.config.update(config or {})
+        self.ivf_config = dict(DEFAULT_VECTOR_STORE_CONFIG['ivf'])
+        self.ivf_config.update((config or {}).get('ivf') or {})
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.np = _numpy()
+        self._lock = threading.Lock()
+
+        self.dim = 0
+        self.count = 0
+        self.capacity = 0
+        self.model = model
+        self._matrix = None
+        self._chunks: List[Dict[str, Any]] = []
+        self._doc_ids = set()
+        self._centroids = None
+        self._lists: List[List[int]] = []
+        self._trained_count = 0
+
+        if self.np is None:
+            self.logger.warning("Thiếu numpy, tắt vector store")
+            return
+        self._load()
+
+    @property
+    def available(self) -> bool:
+        return self.np is not None and bool(self.config['enabled'])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_ids
+
+    # ---- Ghi ----
+
+    def add(self, doc_id: str, chunks: List[str], vectors: List[Optional[List[float]]]) -> int:
+        """Thêm các đoạn của một tài liệu (bỏ đoạn không có vector), trả về số đoạn đã thêm"""
+        np = self.np
+        rows = [(i, text, vector) for i, (text, vector) in enumerate(zip(chunks, vectors)) if vector]
+        if not self.available or not rows or doc_id in self._doc_ids:
+            return 0
+
+        with self._lock:
+            matrix = np.asarray([vector for _, _, vector in rows], dtype=np.float32)
+            if not self.dim:
+                self.dim = matrix.shape[1]
+            if matrix.shape[1] != self.dim:
+                self.logger.warning(f"Vector {matrix.shape[1]} chiều không khớp kho ({self.dim}), bỏ qua")
+                return 0
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+            self._ensure_capacity(self.count + len(rows))
+            start = self.count
+            self._matrix[start:start + len(rows)] = matrix
+            self._matrix.flush()
+
+            with open(self.path / "chunks.jsonl", 'a', encoding='utf-8') as f:
+                for index, text, _ in rows:
+                    chunk = {"doc_id": doc_id, "chunk": index, "text": text}
+                    f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                    self._chunks.append(chunk)
+            self.count += len(rows)
+            self._doc_ids.add(doc_id)
+            self._save_state()
+
+            if self._centroids is not None:
+                for offset, cluster in enumerate(self._assign(matrix)):
+                    self._lists[cluster].append(start + offset)
+            self._maybe_train()
+        return len(rows)
+
+    def reset(self):
+        """Xóa toàn bộ vector (vd. khi đổi embedding model)"""
+        with self._lock:
+            for name in ("vectors.f32", "chunks.jsonl", "state.json", "ivf_centroids.npy"):
+                (self.path / name).unlink(missing_ok=True)
+            self.dim = self.count = self.capacity = 0
+            self._matrix, self._centroids = None, None
+            self._chunks, self._doc_ids, self._lists = [], set(), []
+            self._trained_count = 0
+            self._save_state()
+
+    # ---- Tìm kiếm ----
+
+    def search(self, vector: List[float], k: int = 5) -> List[Dict[str, Any]]:
+        """k đoạn gần nhất theo cosine: {"doc_id", "chunk", "text", "score"}"""
+        np = self.np
+        if not self.available or not self.count or not vector or len(vector) != self.dim:
+            return []
+
+        with self._lock:
+            query = np.asarray(vector, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+
+            if self._centroids is not None and self.config['mode'] == 'ivf':
+                rows = self._probe_rows(query)
+                scores = self._matrix[rows] @ query
+            else:
+                rows = None
+                scores = self._matrix[:self.count] @ query
+
+            k = min(k, len(scores))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for position in top:
+                row = int(rows[position]) if rows is not None else int(position)
+                chunk = dict(self._chunks[row])
+                chunk['score'] = round(float(scores[position]), 4)
+                results.append(chunk)
+            return results
+
+    # ---- IVF ----
+
+    def _maybe_train(self):
+        """Train IVF lần đầu khi đủ vector, train lại khi số vector tăng gấp đôi"""
+        if self.config['mode'] != 'ivf' or self.count < self.ivf_config['train_threshold']:
+            return
+        if self._centroids is not None and self.count < 2 * self._trained_count:
+            return
+        self._train()
+
+    def _train(self):
+        np = self.np
+        nlist = self.ivf_config['nlist'] or max(1, int(self.count ** 0.5))
+        rng = np.random.default_rng(0)
+        sample_size = min(self.count, self.ivf_config['train_sample'])
+        sample = self._matrix[np.sort(rng.choice(self.count, sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, min(nlist, sample_size), replace=False)].copy()
+
+        # k-means trên cầu đơn vị (spherical): gán theo tích vô hướng, tâm cụm chuẩn hóa lại
+        for _ in range(self.ivf_config['iterations']):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(len(centroids)):
+                members = sample[labels == cluster]
+                if len(members):
+                    center = members.sum(axis=0)
+                    centroids[cluster] = center / max(float(np.linalg.norm(center)), 1e-12)
+
+        self._centroids = centroids
+        np.save(self.path / "ivf_centroids.npy", centroids)
+        self._rebuild_lists()
+        self._trained_count = self.count
+        self._save_state()
+        self.logger.info(f"🧮 Đã train IVF: {len(centroids)} cụm trên {sample_size} vector")
+
+    def _rebuild_lists(self):
+        """Gán lại toàn bộ vector vào cụm, theo lô để không nạp hết ma trận"""
+        self._lists = [[] for _ in range(len(self._centroids))]
+        for start in range(0, self.count, 65536):
+            block = self._matrix[start:min(self.count, start + 65536)]
+            for offset, cluster in enumerate(self._assign(block)):
+                self._lists[cluster].append(start + offset)
+
+    def _assign(self, matrix):
+        return self.np.argmax(matrix @ self._centroids.T, axis=1)
+
+    def _probe_rows(self, query):
+        np = self.np
+        nprobe = min(self.ivf_config['nprobe'], len(self._centroids))
+        clusters = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        rows = [row for cluster in clusters for row in self._lists[cluster]]
+        return np.asarray(sorted(rows), dtype=np.int64)
+
+    # ---- Lưu trữ ----
+
+    def _ensure_capacity(self, needed: int):
+        """Mở rộng file ma trận (nhân đôi) rồi memory-map lại"""
+        if needed <= self.capacity and self._matrix is not None:
+            return
+        capacity = max(self.capacity, self.config['initial_capacity'])
+        while capacity < needed:
+            capacity *= 2
+        vectors_file = self.path / "vectors.f32"
+        with open(vectors_file, 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._matrix = self.np.memmap(vectors_file, dtype=self.np.float32, mode='r+',
+                                      shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _load(self):
+        state_file = self.path / "state.json"
+        if not state_file.exists():
+            return
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if self.model and state.get('model') and state['model'] != self.model:
+            self.logger.warning(f"Embedding model đổi ({state['model']} -> {self.model}), xóa vector cũ")
+            self.reset()
+            return
+
+        self.dim, self.count = state.get('dim', 0), state.get('count', 0)
+        self._trained_count = state.get('trained_count', 0)
+        if self.count:
+            self.capacity = (self.path / "vectors.f32").stat().st_size // (self.dim * 4)
+            self._matrix = self.np.memmap(self.path / "vectors.f32", dtype=self.np.float32, mode='r+',
+                                          shape=(self.capacity, self.dim))
+            self._chunks = self._load_chunks()
+            self._doc_ids = {chunk['doc_id'] for chunk in self._chunks}
+
+        centroids_file = self.path / "ivf_centroids.npy"
+        if self.count and centroids_file.exists():
+            self._centroids = self.np.load(centroids_file)
+            self._rebuild_lists()
+
+    def _load_chunks(self) -> List[Dict[str, Any]]:
+        """
+        Đọc đúng count dòng đầu của chunks.jsonl
+
+        Dòng dư là của lần ghi dở (crash trước khi state được cập nhật): cắt bỏ khỏi file,
+        nếu không lần add sau sẽ ghi nối sau chúng và hàng vector lệch với đoạn
+        """
+        chunks_file = self.path / "chunks.jsonl"
+        chunks, size = [], 0
+        with open(chunks_file, 'rb') as f:
+            for _, line in zip(range(self.count), f):
+                chunks.append(json.loads(line))
+                size += len(line)
+        if len(chunks) < self.count:
+            self.logger.warning(f"chunks.jsonl chỉ có {len(chunks)}/{self.count} dòng, bỏ các hàng thiếu")
+            self.count = len(chunks)
+            self._save_state()
+        if chunks_file.stat().st_size > size:
+            self.logger.warning("Bỏ các dòng ghi dở cuối chunks.jsonl")
+            with open(chunks_file, 'r+b') as f:
+                f.truncate(size)
+        return chunks
+
+    def _save_state(self):
+        state = {"dim": self.dim, "count": self.count, "model": self.model,
+                 "trained_count": self._trained_count}
+        tmp_file = self.path / "state.json.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        tmp_file.replace(self.path / "state.json")
@@ -5,6 +5,8 @@ import subprocess
 import sys
 import os
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
 def check_ollama():
     """Kiểm tra Ollama đã cài đặt chưa"""
     try:
@@ -22,6 +24,19 @@ def check_ollama():
 
 def check_models():
     """Kiểm tra model đã có"""
+    # Ưu tiên API tags qua transport dùng chung (không cần spawn process)
+    try:
+        from core_ai.http_transport import get_transport
+        response = get_transport().get("/api/tags", timeout=5)
+        if response.status_code == 200:
+            print("📋 Model hiện có:")
+            for model in response.json().get('models', []):
+                size_gb = model.get('size', 0) / (1024 ** 3)
+                print(f"  - {model.get('name')} ({size_gb:.1f}GB)")
+            return True
+    except Exception:
+        pass
+    
     try:
         result = subprocess.run(['ollama', 'list'], 
                               capture_output=True, text=True)
@@ -3,6 +3,7 @@ ORCHESTRATOR FINAL - Phiên bản hoàn chỉnh, đã fix tất cả lỗi
 """
 import sys
 import os
+import uuid
 import logging
 import re
 from datetime import datetime
@@ -58,52 +59,6 @@ TÍNH NĂNG NỔI BẬT:
 """
     print(banner)
 
-def clean_response_advanced(response: str) -> str:
-    """
-    Làm sạch response cực mạnh - loại bỏ hoàn toàn lặp
-    """
-    if not response:
-        return ""
-    
-    # 1. Chia thành đoạn
-    paragraphs = response.strip().split('\n\n')
-    
-    # 2. Loại bỏ đoạn trùng lặp
-    unique_paragraphs = []
-    seen_content = set()
-    
-    for para in paragraphs:
-        para_clean = para.strip()
-        if not para_clean:
-            continue
-        
-        # Tạo "signature" của đoạn (lấy 100 ký tự đầu, bỏ khoảng trắng)
-        if len(para_clean) > 100:
-            sig = para_clean[:100].lower().replace(' ', '')
-        else:
-            sig = para_clean.lower().replace(' ', '')
-        
-        # Nếu chưa thấy signature này
-        if sig not in seen_content:
-            seen_content.add(sig)
-            unique_paragraphs.append(para_clean)
-    
-    # 3. Ghép lại
-    result = '\n\n'.join(unique_paragraphs)
-    
-    # 4. Loại bỏ dòng trùng trong cùng đoạn
-    lines = result.split('\n')
-    final_lines = []
-    prev_line = ""
-    
-    for line in lines:
-        line_stripped = line.strip()
-        if line_stripped and line_stripped != prev_line:
-            final_lines.append(line_stripped)
-            prev_line = line_stripped
-    
-    return '\n'.join(final_lines)
-
 def test_system():
     """Kiểm tra nhanh hệ thống"""
     print("\n🧪 KIỂM TRA NHANH HỆ THỐNG...")
@@ -126,8 +81,8 @@ def test_system():
 def check_ollama():
     """Kiểm tra Ollama"""
     try:
-        import requests
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
+        from core_ai.http_transport import get_transport
+        response = get_transport().get("/api/tags", timeout=5)
         return response.status_code == 200
     except:
         return False
@@ -164,6 +119,8 @@ def main():
         # Khởi tạo
         logger.info("🚀 Khởi động ORCHESTRATOR FINAL...")
         router = ChatRouter()
+        # Mỗi lần chạy là một hội thoại - các lượt sau dùng lại lịch sử với LLM
+        session_id = uuid.uuid4().hex[:12]
         
         # Hiển thị thông tin hệ thống
         print(f"\n{'='*60}")
@@ -225,44 +182,48 @@ def main():
                     print("\n⚠️ LƯU Ý: deepseek-coder chỉ hiểu tiếng Anh cho code")
                     continue
                 
-                # Xử lý chat
+                # Xử lý chat - in token ngay khi model sinh ra
                 print("🤖 Đang xử lý...", end="", flush=True)
                 
-                # Gọi router
-                result = router.route(user_input)
+                result = {}
+                streamed = False
+                for event in router.route_stream(user_input, session_id):
+                    if event.get('done'):
+                        result = event
+                        break
+                    
+                    if not streamed:
+                        # Xóa dòng "đang xử lý" và in header theo model
+                        print("\r" + " " * 50 + "\r", end="")
+                        model = event.get('model', 'unknown')
+                        if 'coder' in model.lower():
+                            print(f"🤖 [{model} - Coding Assistant]:")
+                        elif model.startswith('mock'):
+                            print(f"🤖 [Demo Mode]:")
+                        else:
+                            print(f"🤖 [{model}]:")
+                        streamed = True
+                    print(event.get('chunk', ''), end="", flush=True)
                 
-                # Xóa dòng "đang xử lý"
-                print("\r" + " " * 50 + "\r", end="")
+                if not streamed:
+                    print("\r" + " " * 50 + "\r", end="")
                 
                 if result.get('status') == 'success':
                     llm_result = result.get('result', {})
                     response_text = llm_result.get('response', '')
                     model = llm_result.get('model', 'unknown')
-                    mode = llm_result.get('mode', 'real')
-                    
-                    # Làm sạch response cực mạnh
-                    cleaned_response = clean_response_advanced(response_text)
+                    print("\n")
                     
-                    # Kiểm tra lặp với response trước đó
+                    # Response đã hiển thị (đã bỏ lặp khi stream); chỉ cảnh báo nếu model lặp lại câu trả lời trước
+                    cleaned_response = response_text.strip()
                     if cleaned_response == last_response:
                         repeat_count += 1
                         if repeat_count >= 2:
-                            print("⚠️  Phát hiện response lặp, bỏ qua...")
-                            continue
+                            print("⚠️  Phát hiện response lặp lại nhiều lần")
                     else:
                         repeat_count = 0
                         last_response = cleaned_response
                     
-                    # Hiển thị
-                    if 'coder' in model.lower():
-                        print(f"🤖 [{model} - Coding Assistant]:")
-                    elif mode == 'mock':
-                        print(f"🤖 [Demo Mode]:")
-                    else:
-                        print(f"🤖 [{model}]:")
-                    
-                    print(f"{cleaned_response}\n")
-                    
                     # Log
                     logger.info(f"Input: {user_input[:50]}... | Model: {model} | Len: {len(response_text)}")
                     
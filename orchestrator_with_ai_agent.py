@@ -229,30 +229,15 @@ class OrchestratorWithAIAgent:
             }
         
         try:
-            import json
-            index_file = self.memory.base_path / "memory_index.json"
-            if index_file.exists():
-                with open(index_file, 'r', encoding='utf-8') as f:
-                    stats = json.load(f)
-                
-                return {
-                    "status": "success",
-                    "result": {
-                        "response": "Thống kê hệ thống bộ nhớ",
-                        "stats": stats,
-                        "memory_path": str(self.memory.base_path)
-                    },
-                    "type": "memory_stats"
-                }
-            else:
-                return {
-                    "status": "success",
-                    "result": {
-                        "response": "Hệ thống bộ nhớ chưa được khởi tạo đầy đủ",
-                        "stats": {}
-                    },
-                    "type": "memory_stats"
-                }
+            return {
+                "status": "success",
+                "result": {
+                    "response": "Thống kê hệ thống bộ nhớ",
+                    "stats": self.memory.get_stats(),
+                    "memory_path": str(self.memory.base_path)
+                },
+                "type": "memory_stats"
+            }
                 
         except Exception as e:
             return {
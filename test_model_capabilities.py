@@ -1,17 +1,23 @@
 """
 Kiểm tra khả năng của từng model
 """
-import requests
+import os
+import sys
 import time
 import json
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from core_ai.http_transport import get_transport
+
 def test_model_response(model_name, prompt, max_tokens=4096):
     """Test model với prompt cụ thể"""
     print(f"\n{'='*60}")
     print(f"TESTING MODEL: {model_name}")
     print(f"{'='*60}")
     
-    url = "http://localhost:11434/api/generate"
+    transport = get_transport()
+    url = transport.url("/api/generate")
     
     payload = {
         "model": model_name,
@@ -26,7 +32,7 @@ def test_model_response(model_name, prompt, max_tokens=4096):
     
     try:
         start_time = time.time()
-        response = requests.post(url, json=payload, timeout=120)
+        response = transport.post(url, json=payload, timeout=120)
         elapsed = time.time() - start_time
         
         if response.status_code == 200:
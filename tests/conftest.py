@@ -0,0 +1,77 @@
+"""Fixture chung: dispatcher chạy trên stub LLM server trong process, không cần model thật"""
+import shutil
+from pathlib import Path
+
+import pytest
+import yaml
+
+from core_ai import embeddings, host_pool, http_transport, latency_stats, llm_dispatcher, \
+    llm_providers, model_registry, stub_server
+from core_ai.async_bridge import get_loop_runner
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Stub nhanh để test không phải chờ: 20ms tới token đầu, 40 token mỗi câu trả lời
+FAST_STUB = {"latency_ms": 20, "tokens_per_second": 2000, "response_tokens": 40}
+
+_SINGLETONS = [
+    (http_transport, '_transport'), (http_transport, '_async_transport'),
+    (llm_providers, '_provider'), (host_pool, '_pool'), (model_registry, '_registry'),
+    (embeddings, '_embedder'), (llm_dispatcher, '_dispatcher'), (stub_server, '_server')
+]
+
+
+def _update(target, overrides):
+    """Gộp đệ quy overrides vào dict cấu hình"""
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _update(target[key], value)
+        else:
+            target[key] = value
+
+
+@pytest.fixture
+def stub_env(tmp_path, monkeypatch):
+    """
+    Thư mục làm việc tạm có bản sao config/ của repo (file thống kê, cache... ghi vào đây)
+
+    Trả về hàm configure(ollama=..., dispatcher=...) ghi đè settings.yaml / llm_profiles.yaml;
+    mặc định ollama dùng provider stub
+    """
+    shutil.copytree(REPO_ROOT / 'config', tmp_path / 'config')
+    monkeypatch.chdir(tmp_path)
+    for module, name in _SINGLETONS:
+        monkeypatch.setattr(module, name, None)
+    monkeypatch.setattr(latency_stats, '_stats', {})
+
+    def configure(ollama=None, dispatcher=None):
+        settings_file = tmp_path / 'config' / 'settings.yaml'
+        settings = yaml.safe_load(settings_file.read_text(encoding='utf-8'))
+        _update(settings['ollama'], {"provider": "stub", "stub": dict(FAST_STUB)})
+        _update(settings['ollama'], ollama)
+        settings_file.write_text(yaml.safe_dump(settings, allow_unicode=True), encoding='utf-8')
+
+        profiles_file = tmp_path / 'config' / 'llm_profiles.yaml'
+        profiles = yaml.safe_load(profiles_file.read_text(encoding='utf-8'))
+        _update(profiles['dispatcher'], dispatcher)
+        profiles_file.write_text(yaml.safe_dump(profiles, allow_unicode=True), encoding='utf-8')
+
+    configure()
+    yield configure
+
+    transport = http_transport._async_transport
+    if transport is not None:
+        get_loop_runner().run(transport.close())
+    if stub_server._server is not None:
+        stub_server._server.stop()
+
+
+@pytest.fixture
+def make_dispatcher(stub_env):
+    """Tạo LLMDispatcher mới trên stub (các tham số như stub_env)"""
+
+    def make(ollama=None, dispatcher=None):
+        stub_env(ollama, dispatcher)
+        return llm_dispatcher.LLMDispatcher()
+
+    return make
@@ -0,0 +1,114 @@
+"""Kiểm tra AccessStats: đếm trong RAM, flush theo lô, dùng chung theo thư mục memory"""
+import atexit
+
+import pytest
+
+from memory.access_stats import AccessStats
+from memory.memory_system import MemorySystem
+
+
+class FakeStorage:
+    """Chỉ ghi lại các lô record_access; fail=True thì ném lỗi"""
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def record_access(self, updates):
+        if self.fail:
+            raise IOError("đĩa đầy")
+        self.batches.append(sorted(updates))
+
+
+@pytest.fixture
+def memory_dir(tmp_path, monkeypatch):
+    (tmp_path / 'config').mkdir()
+    (tmp_path / 'config' / 'settings.yaml').write_text(
+        "memory:\n  backend: sqlite\n  vector_store:\n    enabled: false\n"
+        "  access_stats:\n    flush_interval: 3600\n", encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'memory')
+
+
+def test_counts_batched_until_flush():
+    storage = FakeStorage()
+    stats = AccessStats(storage, {"flush_interval": 3600})
+    for accessed_at in ("2024-01-01T10:00", "2024-01-01T09:00", "2024-01-01T11:00"):
+        stats.record("facts", "a", accessed_at)
+    stats.record("notes", "b", "2024-01-02T00:00")
+    assert storage.batches == []
+
+    entry = stats.apply({"category": "facts", "key_hash": "a", "access_count": 5,
+                         "last_accessed": "2023-12-31T00:00"})
+    assert entry['access_count'] == 8 and entry['last_accessed'] == "2024-01-01T11:00"
+
+    assert stats.flush() == 2
+    assert storage.batches == [[("facts", "a", "2024-01-01T11:00", 3), ("notes", "b", "2024-01-02T00:00", 1)]]
+    assert stats.flush() == 0
+    stats.close()
+
+
+def test_failed_flush_keeps_counts_for_retry():
+    storage = FakeStorage()
+    stats = AccessStats(storage, {"flush_interval": 3600})
+    stats.record("facts", "a", "2024-01-01")
+    storage.fail = True
+    assert stats.flush() == 0
+    stats.record("facts", "a", "2024-01-02")
+    storage.fail = False
+    assert stats.flush() == 1
+    assert storage.batches == [[("facts", "a", "2024-01-02", 2)]]
+    stats.close()
+
+
+def test_max_pending_wakes_background_flush():
+    storage = FakeStorage()
+    stats = AccessStats(storage, {"flush_interval": 3600, "max_pending": 2})
+    stats.record("facts", "a", "t")
+    stats.record("facts", "b", "t")
+    for _ in range(100):
+        if storage.batches:
+            break
+        stats._thread.join(0.02)
+    assert storage.batches == [[("facts", "a", "t", 1), ("facts", "b", "t", 1)]]
+    stats.close()
+    assert not stats._thread.is_alive()
+
+
+def test_close_stops_thread_and_unregisters(monkeypatch):
+    unregistered = []
+    monkeypatch.setattr(atexit, 'unregister', lambda func: unregistered.append(func))
+    storage = FakeStorage()
+    stats = AccessStats(storage, {"flush_interval": 3600})
+    stats.record("facts", "a", "t")
+    stats.close()
+    assert storage.batches == [[("facts", "a", "t", 1)]]
+    assert not stats._thread.is_alive()
+    assert unregistered == [stats.flush]
+
+
+def test_memory_systems_share_one_instance(memory_dir):
+    first = MemorySystem(memory_dir)
+    second = MemorySystem(memory_dir)
+    assert first.access_stats is second.access_stats
+
+    first.save_long_term("thủ đô", {"answer": "Hà Nội"}, "facts")
+    first.retrieve_long_term(key="thủ đô")
+    second.retrieve_long_term(key="thủ đô")
+    # Cả hai instance thấy cùng số lượt (1 lúc lưu + 2 lượt đọc chưa flush)
+    assert first.retrieve_long_term(category="facts")[0]['access_count'] == 3
+    assert second.retrieve_long_term(category="facts")[0]['access_count'] == 3
+
+    # Instance đầu đóng: flush nhưng AccessStats vẫn chạy cho instance còn lại
+    stats = first.access_stats
+    first.close()
+    assert not stats._closed
+    assert second.storage.get_long_term(second.retrieve_long_term(category="facts")[0]['key_hash'])[0][
+        'access_count'] == 3
+
+    second.close()
+    assert stats._closed
+    third = MemorySystem(memory_dir)
+    assert third.access_stats is not stats
+    assert third.retrieve_long_term(category="facts")[0]['access_count'] == 3
+    third.close()
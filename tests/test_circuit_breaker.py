@@ -0,0 +1,82 @@
+"""Kiểm tra circuit breaker: mở mạch theo tỉ lệ lỗi/chậm, probe half-open, dispatcher bỏ qua model hỏng"""
+import time
+
+import pytest
+
+from core_ai.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakerRegistry, CircuitOpenError
+
+CONFIG = {"window_size": 4, "min_requests": 4, "error_rate_threshold": 0.5,
+          "slow_call_seconds": 1.0, "slow_call_rate_threshold": 0.75, "open_seconds": 0.05}
+
+
+def test_opens_on_error_rate_only_after_min_requests():
+    registry = CircuitBreakerRegistry(CONFIG)
+    breaker = registry.get("m")
+    breaker.record_failure(0.1)
+    breaker.record_failure(0.1)
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    breaker.record_success(0.1)              # 2/4 lỗi = ngưỡng 0.5
+    assert breaker.state == OPEN
+    assert not registry.is_available("m")
+    with pytest.raises(CircuitOpenError):
+        registry.acquire("m")
+    assert registry.snapshot()["m"]["error_rate"] == 0.5
+
+
+def test_opens_on_slow_call_rate():
+    breaker = CircuitBreakerRegistry(CONFIG).get("m")
+    for latency in (2.0, 2.0, 2.0, 0.1):
+        breaker.record_success(latency)
+    assert breaker.state == OPEN
+
+
+def test_half_open_allows_single_probe():
+    registry = CircuitBreakerRegistry(CONFIG)
+    breaker = registry.get("m")
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    time.sleep(0.06)
+    assert registry.is_available("m")
+    assert registry.acquire("m") is breaker and breaker.state == HALF_OPEN
+    assert not registry.is_available("m")
+    with pytest.raises(CircuitOpenError):
+        registry.acquire("m")                # Chỉ một probe tại một thời điểm
+
+    breaker.release_probe()                  # Probe bị hủy: không tính kết quả
+    assert breaker.state == HALF_OPEN and registry.acquire("m") is breaker
+    breaker.record_failure(0.1)
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    registry.acquire("m").record_success(0.1)
+    assert breaker.state == CLOSED and breaker.snapshot()["calls"] == 1
+
+
+def test_disabled_registry_never_blocks():
+    registry = CircuitBreakerRegistry(dict(CONFIG, enabled=False))
+    for _ in range(4):
+        registry.get("m").record_failure(0.1)
+    assert registry.is_available("m") and registry.acquire("m") is None
+
+
+def test_dispatcher_routes_around_open_circuit(make_dispatcher, monkeypatch):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False},
+                                             "circuit_breaker": {"open_seconds": 60}})
+    original = dispatcher._ollama_generate
+
+    async def failing(model, *args, **kwargs):
+        if model == "qwen2.5:14b":
+            raise ConnectionError("model hỏng")
+        return await original(model, *args, **kwargs)
+
+    monkeypatch.setattr(dispatcher, '_ollama_generate', failing)
+    plan = {"intent": "chat", "llm_type": "chat", "language": "vi"}
+    for i in range(4):
+        result = dispatcher.dispatch(dict(plan, user_input=f"câu hỏi số {i}"))
+        assert (result['mode'], result['model']) == ('mock', 'mock-fallback')
+
+    result = dispatcher.dispatch(dict(plan, user_input="câu hỏi sau khi mở mạch"))
+    assert result['mode'] == 'real'
+    assert result['model'] == dispatcher.model_candidates['chat'][1]     # Model kế tiếp trong profile
+    assert result['circuits']['qwen2.5:14b']['state'] == OPEN
@@ -0,0 +1,136 @@
+"""Kiểm tra hàng đợi model: giới hạn num_parallel, ưu tiên theo lane, gộp request trùng"""
+import asyncio
+
+import pytest
+
+from core_ai.dispatch_queue import DispatchQueue, current_lane
+
+
+@pytest.fixture(autouse=True)
+def no_env_parallel(monkeypatch):
+    monkeypatch.delenv('OLLAMA_NUM_PARALLEL', raising=False)
+
+
+def test_num_parallel_limits_concurrency():
+    queue = DispatchQueue({"num_parallel": 2})
+    running, peak = 0, 0
+
+    async def call():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return "ok"
+
+    async def run():
+        return await asyncio.gather(*(queue.arun("m", None, call) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["ok"] * 5
+    assert peak == 2
+    assert queue.stats()['models']['m'] == {"active": 0, "capacity": 2, "waiting": 0}
+
+
+def test_env_overrides_num_parallel_and_hosts_scale_capacity(monkeypatch):
+    monkeypatch.setenv('OLLAMA_NUM_PARALLEL', '3')
+    queue = DispatchQueue({"num_parallel": 1}, hosts=lambda model: 2 if model == "a" else 0)
+    assert queue.num_parallel == 3
+    assert queue.queue_for("a").capacity() == 6
+    assert queue.queue_for("b").capacity() == 3
+
+
+def test_waiters_served_by_lane_then_arrival():
+    queue = DispatchQueue({"num_parallel": 1})
+    order = []
+
+    async def request(name, lane, gate=None):
+        current_lane.set(lane)
+
+        async def call():
+            order.append(name)
+            if gate is not None:
+                await gate.wait()
+        await queue.arun("m", None, call)
+
+    async def run():
+        gate = asyncio.Event()
+        holder = asyncio.ensure_future(request("giữ slot", "interactive", gate))
+        await asyncio.sleep(0.01)
+        waiting = [asyncio.ensure_future(request(name, lane)) for name, lane in (
+            ("nền", "background"), ("nghiên cứu", "research"),
+            ("chat 1", "interactive"), ("chat 2", "interactive"))]
+        await asyncio.sleep(0.01)
+        assert queue.stats()['models']['m']['waiting'] == 4
+        gate.set()
+        await asyncio.gather(holder, *waiting)
+
+    asyncio.run(run())
+    assert order == ["giữ slot", "chat 1", "chat 2", "nghiên cứu", "nền"]
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    queue = DispatchQueue({"num_parallel": 1})
+
+    async def run():
+        gate = asyncio.Event()
+        holder = asyncio.ensure_future(queue.arun("m", None, gate.wait))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(queue.arun("m", None, gate.wait))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        gate.set()
+        await holder
+        return await queue.arun("m", None, lambda: asyncio.sleep(0, "xong"))
+
+    assert asyncio.run(run()) == "xong"
+    assert queue.stats()['models']['m']['active'] == 0
+
+
+def test_identical_requests_coalesce():
+    queue = DispatchQueue()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "kết quả"
+
+    async def run():
+        return await asyncio.gather(queue.arun("m", "k", call), queue.arun("m", "k", call),
+                                    queue.arun("m", "khác", call))
+
+    assert asyncio.run(run()) == ["kết quả"] * 3
+    assert len(calls) == 2 and queue.stats()['coalesced'] == 1
+
+
+def test_coalesced_requests_share_errors_and_can_be_disabled():
+    queue = DispatchQueue()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("model lỗi")
+
+    async def run(q):
+        return await asyncio.gather(q.arun("m", "k", failing), q.arun("m", "k", failing),
+                                    return_exceptions=True)
+
+    errors = asyncio.run(run(queue))
+    assert all(isinstance(e, RuntimeError) for e in errors) and queue.coalesced == 1
+
+    uncoalesced = DispatchQueue({"coalesce": False})
+    asyncio.run(run(uncoalesced))
+    assert uncoalesced.coalesced == 0
+
+
+def test_dispatcher_coalesces_concurrent_identical_plans(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False},
+                                             "response_cache": {"enabled": False}})
+    plan = {"intent": "chat", "llm_type": "chat", "language": "vi", "user_input": "bộ nhớ đệm là gì"}
+
+    async def run():
+        return await asyncio.gather(dispatcher.adispatch(dict(plan)), dispatcher.adispatch(dict(plan)))
+
+    first, second = asyncio.run(run())
+    assert first['mode'] == second['mode'] == 'real'
+    assert first['response'] == second['response']
+    assert second['queue']['coalesced'] == 1
@@ -0,0 +1,75 @@
+"""Kiểm tra ensemble: plan suy luận/nghiên cứu hỏi song song nhiều model, judge chọn câu trả lời"""
+import asyncio
+
+from core_ai.llm_dispatcher import LLMDispatcher
+
+PLAN = {"intent": "research", "llm_type": "research", "language": "vi",
+        "user_input": "so sánh các chiến lược bộ nhớ đệm"}
+NO_CACHE = {"semantic_cache": {"enabled": False}, "response_cache": {"enabled": False}}
+
+
+def test_parse_judge_choice():
+    assert LLMDispatcher._parse_judge_choice("2", 3) == 1
+    assert LLMDispatcher._parse_judge_choice("Câu trả lời [1] tốt nhất", 2) == 0
+    assert LLMDispatcher._parse_judge_choice("4", 3) is None
+    assert LLMDispatcher._parse_judge_choice("0", 3) is None
+    assert LLMDispatcher._parse_judge_choice("", 2) is None
+    assert LLMDispatcher._parse_judge_choice(None, 2) is None
+
+
+def test_research_plan_runs_members_in_parallel(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    members = dispatcher._ensemble_models("research", dispatcher.model_priority['research'])
+    assert len(members) == 2 and members[0] == dispatcher.model_priority['research']
+    assert dispatcher._ensemble_models("chat", "qwen2.5:14b") == []
+
+    result = dispatcher.dispatch(dict(PLAN))
+    assert result['mode'] == 'real'
+    assert result['ensemble'] == {"models": members, "judge": "heuristic"}
+    assert result['model'] in members
+
+
+def test_heuristic_prefers_adequate_structured_answers(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    short = ("a", "ngắn")
+    plain = ("b", "Bộ nhớ đệm giữ dữ liệu hay dùng gần bộ xử lý. " * 6)
+    listed = ("c", plain[1] + "\n- LRU\n- LFU\n- FIFO")
+    model, response, judge = asyncio.run(dispatcher._judge_answers(dict(PLAN), [short, plain, listed]))
+    assert (model, judge) == ("c", "heuristic")
+
+
+def test_model_judge_picks_answer_and_falls_back(make_dispatcher, monkeypatch):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    dispatcher.ensemble_config.update(judge="model", judge_model="qwen2.5:7b")
+    answers = [("a", "Câu trả lời dài và có cấu trúc\n- một\n- hai\n- ba " * 4), ("b", "ngắn")]
+    prompts = []
+
+    async def judge(model, prompt, llm_type):
+        prompts.append(prompt)
+        return "2"
+
+    monkeypatch.setattr(dispatcher, '_smart_llm_call', judge)
+    assert asyncio.run(dispatcher._judge_answers(dict(PLAN), answers)) == ("b", "ngắn", "qwen2.5:7b")
+    assert "[1]" in prompts[0] and "[2]" in prompts[0] and PLAN['user_input'] in prompts[0]
+
+    async def rambling(model, prompt, llm_type):
+        return "không chọn được"
+
+    monkeypatch.setattr(dispatcher, '_smart_llm_call', rambling)
+    model, _, judge_name = asyncio.run(dispatcher._judge_answers(dict(PLAN), answers))
+    assert (model, judge_name) == ("a", "heuristic")
+
+
+def test_failed_member_does_not_fail_ensemble(make_dispatcher, monkeypatch):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    members = dispatcher._ensemble_models("research", dispatcher.model_priority['research'])
+    original = dispatcher._ollama_generate
+
+    async def failing(model, *args, **kwargs):
+        if model == members[1]:
+            raise ConnectionError("model hỏng")
+        return await original(model, *args, **kwargs)
+
+    monkeypatch.setattr(dispatcher, '_ollama_generate', failing)
+    result = dispatcher.dispatch(dict(PLAN))
+    assert result['ensemble']['models'] == [members[0]] and result['model'] == members[0]
@@ -0,0 +1,86 @@
+"""Kiểm tra hedged request: backup khởi động khi model chính chậm, response đạt chuẩn đầu tiên thắng"""
+import asyncio
+import time
+
+import pytest
+
+from core_ai.hedged_request import arun_hedged
+
+FAST = {"delay_seconds": 0.1, "first_token_timeout": 0.05}
+
+
+def _stream(chunks, first_delay=0.0, delay=0.0, error=None, log=None, name=None):
+    async def factory():
+        if log is not None:
+            log.append(('start', name))
+        try:
+            await asyncio.sleep(first_delay)
+            for chunk in chunks:
+                yield chunk
+                await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(('cancel', name))
+            raise
+    return factory
+
+
+def _adequate(text):
+    return len(text) >= 10
+
+
+def test_fast_primary_never_starts_backup():
+    log = []
+    response, winner = asyncio.run(arun_hedged(
+        ("a", _stream(["câu trả lời ", "đầy đủ"], log=log, name="a")),
+        ("b", _stream(["backup đầy đủ"], log=log, name="b")),
+        _adequate, FAST))
+    assert (response, winner) == ("câu trả lời đầy đủ", "a")
+    assert log == [('start', 'a')]
+
+
+def test_slow_first_token_starts_backup_and_cancels_primary():
+    log = []
+    started = time.monotonic()
+    response, winner = asyncio.run(arun_hedged(
+        ("a", _stream(["quá chậm nhưng đầy đủ"], first_delay=5, log=log, name="a")),
+        ("b", _stream(["backup trả lời đầy đủ"], log=log, name="b")),
+        _adequate, FAST))
+    assert (response, winner) == ("backup trả lời đầy đủ", "b")
+    assert time.monotonic() - started < 1
+    assert ('cancel', 'a') in log
+
+
+def test_inadequate_primary_starts_backup_immediately():
+    response, winner = asyncio.run(arun_hedged(
+        ("a", _stream(["ngắn"])),
+        ("b", _stream(["backup trả lời đầy đủ"], first_delay=0.01)),
+        _adequate, {"delay_seconds": 60, "first_token_timeout": 60}))
+    assert winner == "b"
+
+
+def test_no_adequate_response_returns_longest_or_last_error():
+    response, winner = asyncio.run(arun_hedged(
+        ("a", _stream(["ngắn"])), ("b", _stream(["dài hơn"])), _adequate, FAST))
+    assert (response, winner) == ("dài hơn", "b")
+
+    with pytest.raises(RuntimeError, match="b hỏng"):
+        asyncio.run(arun_hedged(
+            ("a", _stream([], error=RuntimeError("a hỏng"))),
+            ("b", _stream([], first_delay=0.01, error=RuntimeError("b hỏng"))),
+            _adequate, FAST))
+
+
+def test_dispatch_hedges_slow_primary_model(make_dispatcher):
+    dispatcher = make_dispatcher(
+        ollama={"stub": {"model_tokens_per_second": {"qwen2.5:14b": 2}}},
+        dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False},
+                    "hedging": {"enabled": True, "delay_seconds": 0.3, "first_token_timeout": 0.2}})
+    started = time.monotonic()
+    result = dispatcher.dispatch({"intent": "chat", "llm_type": "chat", "language": "vi",
+                                  "user_input": "giải thích bộ nhớ đệm"})
+    assert result['mode'] == 'real'
+    assert result['model'] == 'llama3:8b'       # Backup của qwen2.5:14b thắng
+    assert time.monotonic() - started < 5        # Model chính cần ~20s cho 40 token
@@ -0,0 +1,76 @@
+"""Kiểm tra phân tải qua nhiều host: slot hàng đợi theo số host, chọn host, rút host lỗi"""
+import asyncio
+import time
+
+import pytest
+
+from core_ai.http_transport import HTTPTransport
+from core_ai.host_pool import HostPool
+from core_ai.stub_server import StubLLMServer
+
+LATENCY_MS = 400
+
+
+@pytest.fixture
+def two_hosts():
+    servers = [StubLLMServer({"latency_ms": LATENCY_MS, "tokens_per_second": 2000,
+                              "response_tokens": 40}).start() for _ in range(2)]
+    yield [server.base_url for server in servers]
+    for server in servers:
+        server.stop()
+
+
+def _pool_dispatcher(make_dispatcher, monkeypatch, hosts):
+    monkeypatch.delenv('OLLAMA_NUM_PARALLEL', raising=False)
+    return make_dispatcher(
+        ollama={"provider": "ollama", "base_url": hosts[0], "hosts": hosts},
+        dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False},
+                    "response_cache": {"enabled": False}, "warm_pool": {"enabled": False},
+                    "queue": {"num_parallel": 1}}
+    )
+
+
+def test_one_model_runs_in_parallel_across_hosts(make_dispatcher, monkeypatch, two_hosts):
+    dispatcher = _pool_dispatcher(make_dispatcher, monkeypatch, two_hosts)
+    model = dispatcher.model_priority['chat']
+    assert dispatcher.dispatch_queue.queue_for(model).capacity() == 2
+
+    async def run():
+        plans = [{"intent": "chat", "llm_type": "chat", "user_input": f"câu hỏi số {i}"} for i in range(2)]
+        start = time.monotonic()
+        results = await asyncio.gather(*(dispatcher.adispatch(plan) for plan in plans))
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(run())
+    assert all(result['mode'] == 'real' and result['model'] == model for result in results)
+    # Tuần tự sẽ mất ít nhất 2 x latency; song song trên hai host chỉ khoảng 1 x
+    assert elapsed < 2 * LATENCY_MS / 1000
+    served = [host['served'] for host in dispatcher.host_pool.snapshot().values()]
+    assert served == [1, 1]
+
+
+def test_capacity_follows_healthy_hosts(two_hosts):
+    pool = HostPool(HTTPTransport(base_url=two_hosts[0]), two_hosts + ["http://127.0.0.1:9"],
+                    {"health_timeout": 0.5})
+    try:
+        # Host thứ ba không phản hồi health check -> không tính slot
+        assert pool.capacity("llama3:8b") == 2
+        assert pool.capacity("model-không-có") == 1
+        pool.hosts[1].healthy = False
+        assert pool.capacity("llama3:8b") == 1
+    finally:
+        pool.transport.close()
+
+
+def test_failing_host_is_drained(two_hosts):
+    pool = HostPool(HTTPTransport(base_url=two_hosts[0]), two_hosts, {"fail_threshold": 2})
+    bad = pool.hosts[0]
+    pool.hosts[1].latency["llama3:8b"] = 100.0   # Host còn lại chậm hơn nhiều
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            with pool.lease("llama3:8b") as url:
+                assert url == bad.base_url
+                raise RuntimeError("lỗi host")
+    assert not bad.available(time.time())
+    with pool.lease("llama3:8b") as url:
+        assert url == pool.hosts[1].base_url
@@ -0,0 +1,67 @@
+"""Kiểm tra AsyncHTTPTransport: session theo event loop, lỗi cấu hình client"""
+import sys
+import asyncio
+
+import pytest
+
+from core_ai.http_transport import AsyncHTTPTransport, TransportConfigError
+from core_ai.stub_server import StubLLMServer
+
+
+@pytest.fixture
+def stub_url():
+    server = StubLLMServer({"latency_ms": 0, "tokens_per_second": 2000}).start()
+    yield server.base_url
+    server.stop()
+
+
+def test_session_closed_when_asyncio_run_finishes(stub_url):
+    transport = AsyncHTTPTransport(base_url=stub_url)
+    sessions = []
+
+    async def call():
+        status, data = await transport.request_json('GET', '/api/tags')
+        sessions.append(await transport._get_session())
+        return status, data
+
+    for _ in range(2):
+        status, data = asyncio.run(call())
+        assert status == 200 and data['models']
+    # Mỗi asyncio.run có session riêng, cả hai đã đóng cùng connector
+    assert len(sessions) == 2 and sessions[0] is not sessions[1]
+    assert all(session.closed for session in sessions)
+
+
+def test_session_reused_within_loop_and_closed_explicitly(stub_url):
+    transport = AsyncHTTPTransport(base_url=stub_url)
+
+    async def run():
+        first = await transport._get_session()
+        lines = [line async for line in transport.stream_lines(
+            'POST', '/api/generate', json={"model": "llama3:8b", "prompt": "xin chào"})]
+        assert lines and await transport._get_session() is first
+        await transport.close()
+        assert first.closed
+        # Gọi lại sau close() thì mở session mới
+        second = await transport._get_session()
+        assert second is not first and not second.closed
+        return second
+
+    assert asyncio.run(run()).closed
+
+
+def test_missing_aiohttp_does_not_open_circuits(make_dispatcher, monkeypatch):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False}})
+    monkeypatch.setitem(sys.modules, 'aiohttp', None)
+    plan = {"intent": "chat", "llm_type": "chat", "user_input": "xin chào"}
+    for _ in range(6):
+        assert dispatcher.dispatch(dict(plan))['mode'] == 'mock'
+    snapshot = dispatcher.circuit_breakers.snapshot()
+    assert all(state['state'] == 'closed' and state['calls'] == 0 for state in snapshot.values())
+    assert all(host['healthy'] for host in dispatcher.host_pool.snapshot().values())
+
+
+def test_invalid_url_is_a_config_error():
+    transport = AsyncHTTPTransport(base_url="localhost:11434")
+    with pytest.raises(TransportConfigError):
+        asyncio.run(transport.request_json('GET', '/api/tags'))
@@ -0,0 +1,87 @@
+"""Kiểm tra latency stats: timeout theo p99, num_predict theo SLO, lưu/tải và dùng chung theo file"""
+import json
+import os
+
+from core_ai import latency_stats
+from core_ai.latency_stats import LatencyStats, get_latency_stats, percentile
+
+
+def _stats(tmp_path, **overrides):
+    config = {"path": str(tmp_path / "latency.json"), "min_samples": 5, "save_interval_seconds": 3600}
+    config.update(overrides)
+    return LatencyStats(config)
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 99), percentile(values, 100)) == (50, 99, 100)
+    assert percentile([7], 99) == 7
+
+
+def test_timeout_from_p99_within_bounds(tmp_path):
+    stats = _stats(tmp_path, min_timeout=10, max_timeout=60)
+    for _ in range(4):
+        stats.record("m", "chat", 12.0)
+    assert stats.timeout_for("m", "chat", 30) == 30        # Chưa đủ mẫu
+    stats.record("m", "chat", 20.0)
+    assert stats.timeout_for("m", "chat", 30) == 30         # 20 * 1.5
+    assert stats.timeout_for("m", "coding", 45) == 45       # Mỗi llm_type một cửa sổ
+
+    stats.record_timeout("m", "chat", 100.0)
+    assert stats.timeout_for("m", "chat", 30) == 60
+    for _ in range(5):
+        stats.record("fast", "chat", 1.0)
+    assert stats.timeout_for("fast", "chat", 30) == 10
+
+
+def test_max_tokens_for_slo(tmp_path):
+    stats = _stats(tmp_path, latency_slo={"chat": 20})
+    for _ in range(5):
+        stats.record("m", "chat", 5.0, eval_count=100, eval_duration=int(2.5e9))   # 40 tokens/s
+    assert stats.max_tokens_for("m", "chat", 4096) == 768    # 40 * 20 = 800, làm tròn xuống bước 256
+    assert stats.max_tokens_for("m", "chat", 600) == 600     # Không vượt mức cấu hình
+    for _ in range(5):
+        stats.record("slow", "chat", 5.0, eval_count=10, eval_duration=int(5e9))
+    assert stats.max_tokens_for("slow", "chat", 4096) == 512  # Không thấp hơn min_tokens
+
+
+def test_save_and_reload(tmp_path):
+    stats = _stats(tmp_path)
+    stats.record("qwen2.5:7b", "chat", 3.0, eval_count=80, eval_duration=int(2e9))
+    stats.save()
+    data = json.loads((tmp_path / "latency.json").read_text(encoding='utf-8'))
+    assert data == {"qwen2.5:7b|chat": {"latency": [3.0], "tps": [40.0]}}
+
+    reloaded = _stats(tmp_path)
+    assert reloaded.snapshot()["qwen2.5:7b|chat"]["samples"] == 1
+
+
+def test_disabled_keeps_defaults_and_writes_nothing(tmp_path):
+    stats = _stats(tmp_path, enabled=False)
+    for _ in range(10):
+        stats.record("m", "chat", 50.0)
+    stats.save()
+    assert stats.timeout_for("m", "chat", 30) == 30
+    assert not (tmp_path / "latency.json").exists()
+
+
+def test_shared_per_resolved_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(latency_stats, '_stats', {})
+    monkeypatch.chdir(tmp_path)
+    first = get_latency_stats({"path": "memory/latency.json"})
+    assert get_latency_stats({"path": str(tmp_path / "memory" / "latency.json")}) is first
+    assert get_latency_stats({"path": "memory/other.json"}) is not first
+
+    # Đường dẫn tương đối được cố định lúc tạo: đổi thư mục làm việc không đổi nơi lưu
+    first.record("m", "chat", 1.0)
+    monkeypatch.chdir(os.path.dirname(tmp_path))
+    first.save()
+    assert (tmp_path / "memory" / "latency.json").exists()
+
+
+def test_dispatch_records_latency(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False}})
+    result = dispatcher.dispatch({"intent": "chat", "llm_type": "chat", "language": "vi",
+                                  "user_input": "giải thích bộ nhớ đệm"})
+    stats = dispatcher.latency_stats.snapshot()[f"{result['model']}|chat"]
+    assert stats["samples"] == 1 and stats["tokens_per_second"] > 0
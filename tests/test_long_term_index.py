@@ -0,0 +1,87 @@
+"""Kiểm tra chỉ mục bộ nhớ dài hạn: từ khóa, category, khoảng thời gian và phân trang"""
+from memory.long_term_index import LongTermIndex, entry_text
+
+
+def _entry(category, key_hash, created_at, key='', data=None):
+    return {"category": category, "key_hash": key_hash, "key": key,
+            "data": data or {}, "created_at": created_at}
+
+
+ENTRIES = [
+    _entry("facts", "f1", "2024-01-01T08:00:00", "thủ đô", {"answer": "Hà Nội"}),
+    _entry("facts", "f2", "2024-01-02T08:00:00", "dân số", {"answer": "100 triệu"}),
+    _entry("notes", "n1", "2024-01-03T08:00:00", "ghi chú", {"text": "Hà Nội mùa thu"}),
+    _entry("notes", "n2", "2024-01-04T08:00:00", "mua sắm", {"items": ["sữa", "bánh mì"]}),
+    _entry("facts", "f3", "2024-01-05T08:00:00", "sông", {"answer": "sông Hồng chảy qua Hà Nội"}),
+]
+
+
+def _index():
+    return LongTermIndex.build(ENTRIES)
+
+
+def test_entry_text_flattens_nested_data():
+    text = entry_text(_entry("notes", "x", "", "k", {"a": [1, {"b": "c"}], "d": None}))
+    assert text.split() == ["k", "notes", "a", "1", "b", "c", "d"]
+
+
+def test_without_keyword_newest_first():
+    ids, total = _index().query()
+    assert total == 5
+    assert [key_hash for _, key_hash in ids] == ["f3", "n2", "n1", "f2", "f1"]
+
+
+def test_category_filter():
+    ids, total = _index().query(category="notes")
+    assert (ids, total) == ([("notes", "n2"), ("notes", "n1")], 2)
+    assert _index().query(category="khác") == ([], 0)
+
+
+def test_since_inclusive_until_exclusive():
+    index = _index()
+    ids, total = index.query(since="2024-01-02T08:00:00", until="2024-01-04T08:00:00")
+    assert [key_hash for _, key_hash in ids] == ["n1", "f2"]
+    assert total == 2
+    # Chỉ ngày (không có giờ) vẫn so sánh đúng thứ tự chuỗi ISO
+    ids, _ = index.query(since="2024-01-04")
+    assert [key_hash for _, key_hash in ids] == ["f3", "n2"]
+    ids, _ = index.query(until="2024-01-02")
+    assert [key_hash for _, key_hash in ids] == ["f1"]
+    assert index.query(since="2025-01-01") == ([], 0)
+
+
+def test_offset_limit_pagination_keeps_total():
+    index = _index()
+    pages = [index.query(offset=offset, limit=2) for offset in (0, 2, 4, 6)]
+    assert [total for _, total in pages] == [5, 5, 5, 5]
+    assert [[key_hash for _, key_hash in ids] for ids, _ in pages] == [
+        ["f3", "n2"], ["n1", "f2"], ["f1"], []]
+    ids, total = index.query(category="facts", offset=1)
+    assert ([key_hash for _, key_hash in ids], total) == (["f2", "f1"], 3)
+
+
+def test_keyword_combined_with_filters():
+    index = _index()
+    ids, total = index.query(keyword="ha noi")
+    assert total == 3
+    assert set(ids) == {("facts", "f1"), ("notes", "n1"), ("facts", "f3")}
+    ids, total = index.query(keyword="hà nội", category="facts", since="2024-01-02")
+    assert (ids, total) == ([("facts", "f3")], 1)
+    ids, total = index.query(keyword="Hà Nội", limit=1, offset=1)
+    assert len(ids) == 1 and total == 3
+
+
+def test_add_replaces_and_remove_drops_entry():
+    index = _index()
+    index.add(_entry("facts", "f1", "2024-02-01T00:00:00", "thủ đô", {"answer": "Huế"}))
+    assert len(index) == 5
+    assert index.query()[0][0] == ("facts", "f1")
+    assert ("facts", "f1") not in index.query(keyword="hà nội")[0]
+    assert index.query(keyword="hue")[0] == [("facts", "f1")]
+
+    index.remove("notes", "n1")
+    index.remove("notes", "không có")
+    assert len(index) == 4
+    assert index.query(category="notes") == ([("notes", "n2")], 1)
+    assert index.query(keyword="ghi chú") == ([], 0)
+    assert index.query(since="2024-01-03", until="2024-01-04") == ([], 0)
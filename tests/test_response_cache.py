@@ -0,0 +1,86 @@
+"""Kiểm tra response cache: key chuẩn hóa, LRU/TTL, tầng đĩa, không cache stream đứt"""
+import time
+import unicodedata
+
+from core_ai.response_cache import ResponseCache, normalize_prompt
+
+OPTIONS = {"temperature": 0.7, "num_predict": 512}
+
+
+def test_key_normalizes_prompt_but_not_options_or_model():
+    key = ResponseCache.make_key("llama3:8b", "Xin  CHÀO\n thế giới", OPTIONS)
+    assert key == ResponseCache.make_key("llama3:8b", "xin chào thế giới", dict(OPTIONS))
+    # NFD (tổ hợp dấu) và NFC cho cùng key
+    assert normalize_prompt("Tiếng") == normalize_prompt("Tiếng")
+    assert key != ResponseCache.make_key("qwen2.5:7b", "xin chào thế giới", OPTIONS)
+    assert key != ResponseCache.make_key("llama3:8b", "xin chào thế giới", dict(OPTIONS, temperature=0.2))
+
+
+def test_lru_eviction_and_stats():
+    cache = ResponseCache({"max_entries": 2})
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"      # 'a' vừa dùng -> 'b' bị loại trước
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.stats() == {"hits": 3, "misses": 1, "hit_rate": 0.75, "size": 2}
+
+
+def test_ttl_and_disabled():
+    cache = ResponseCache({"ttl_seconds": 0.05})
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+    time.sleep(0.06)
+    assert cache.get("k") is None
+
+    disabled = ResponseCache({"enabled": False})
+    disabled.set("k", "v")
+    assert disabled.get("k") is None
+    cache.set("empty", "")
+    assert cache.get("empty") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    config = {"disk": {"enabled": True, "path": str(tmp_path / "cache"), "max_entries": 10}}
+    ResponseCache(config).set("k", "từ đĩa")
+    fresh = ResponseCache(config)
+    assert fresh.get("k") == "từ đĩa"
+    assert fresh.stats()['size'] == 1   # Hit trên đĩa được đưa lên tầng bộ nhớ
+
+
+def test_disk_tier_evicts_oldest(tmp_path):
+    config = {"disk": {"enabled": True, "path": str(tmp_path / "cache"), "max_entries": 10}}
+    cache = ResponseCache(config)
+    for i in range(12):
+        cache.set(f"k{i}", f"v{i}")
+    assert len(list((tmp_path / "cache").glob("*.json"))) <= 10
+
+
+PLAN = {"intent": "chat", "llm_type": "chat", "language": "vi", "user_input": "bộ nhớ đệm là gì"}
+
+
+def test_dispatch_hits_cache_for_equivalent_prompt(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False}})
+    first = dispatcher.dispatch(dict(PLAN))
+    again = dispatcher.dispatch(dict(PLAN, user_input="  Bộ NHỚ đệm   là gì "))
+    assert (first['mode'], again['mode']) == ('real', 'cache')
+    assert again['response'] == first['response']
+
+
+def test_broken_stream_not_cached(make_dispatcher, monkeypatch):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}, "semantic_cache": {"enabled": False}})
+    original = dispatcher._ollama_generate_stream
+
+    async def broken(*args, **kwargs):
+        count = 0
+        async for chunk in original(*args, **kwargs):
+            yield chunk
+            count += 1
+            if count == 3:
+                raise ConnectionError("mất kết nối")
+
+    monkeypatch.setattr(dispatcher, '_ollama_generate_stream', broken)
+    final = list(dispatcher.dispatch_stream(dict(PLAN)))[-1]['result']
+    assert final['mode'] == 'degraded' and final['response']
+    assert dispatcher.response_cache.stats()['size'] == 0
@@ -0,0 +1,71 @@
+"""Kiểm tra truy xuất tài liệu kèm prompt: ngưỡng BM25 chuẩn hóa, intent, key semantic cache"""
+import pytest
+
+from core_ai.semantic_cache import SemanticCache
+from memory.memory_system import MemorySystem
+
+DOCUMENTS = [
+    "Python là ngôn ngữ lập trình thông dịch, cú pháp gọn, nhiều thư viện khoa học dữ liệu.",
+    "Phở bò Hà Nội nấu từ xương bò hầm, ăn kèm bánh phở và hành lá.",
+    "Vịnh Hạ Long là di sản thiên nhiên thế giới ở tỉnh Quảng Ninh.",
+    "Lịch sử Việt Nam thời Lý: nhà Lý dời đô về Thăng Long năm 1010.",
+]
+
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    (tmp_path / 'config').mkdir()
+    (tmp_path / 'config' / 'settings.yaml').write_text(
+        "memory:\n  backend: sqlite\n  vector_store:\n    enabled: false\n", encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    system = MemorySystem(str(tmp_path / 'memory'))
+    for text in DOCUMENTS:
+        system.save_document(text, {"source": "test"})
+    return system
+
+
+def test_relevant_document_attached(memory):
+    documents = memory.retrieve_context("ngôn ngữ lập trình python", "research")
+    assert [doc['content'] for doc in documents] == [DOCUMENTS[0]]
+    assert 0.2 <= documents[0]['score'] <= 1.5
+    assert documents[0]['source'] == "test" and documents[0]['doc_id']
+
+
+def test_unaccented_query_still_relevant(memory):
+    documents = memory.retrieve_context("nha Ly doi do ve Thang Long", "web_search")
+    assert [doc['content'] for doc in documents] == [DOCUMENTS[3]]
+
+
+def test_partial_match_on_rare_word_attached(memory):
+    documents = memory.retrieve_context("món phở ngon ở đâu", "research")
+    assert [doc['content'] for doc in documents] == [DOCUMENTS[1]]
+
+
+def test_single_shared_common_word_not_attached(memory):
+    # 'là' có trong nhiều tài liệu; các từ còn lại không có trong kho
+    assert memory.retrieve_context("hôm nay thời tiết là bao nhiêu độ", "research") == []
+    assert memory.retrieve_context("thủ đô của nước Pháp", "research") == []
+
+
+def test_chat_intent_not_retrieved_by_default(memory):
+    assert memory.retrieve_context("ngôn ngữ lập trình python", "chat") == []
+    memory.retrieval_config['intents'] = ["chat"]
+    assert len(memory.retrieve_context("ngôn ngữ lập trình python", "chat")) == 1
+
+
+def test_semantic_cache_keyed_by_context():
+    cache = SemanticCache({"default_threshold": 0.9})
+    vector = [1.0, 0.0, 0.0]
+    cache.add(vector, "research", "vi", "trả lời dựa trên tài liệu A", "m", "docA#0")
+    assert cache.lookup(vector, "research", "vi", "docA#0")['response'] == "trả lời dựa trên tài liệu A"
+    assert cache.lookup(vector, "research", "vi", "docB#0") is None
+    assert cache.lookup(vector, "research", "vi") is None
+
+
+def test_dispatcher_semantic_context(make_dispatcher):
+    dispatcher = make_dispatcher()
+    assert dispatcher._semantic_context({}) == ""
+    plan = {"documents": [{"doc_id": "abc", "chunk": 2, "content": "x"}, {"doc_id": "def", "content": "y"}]}
+    assert dispatcher._semantic_context(plan) == "abc#2,def"
+    assert dispatcher._semantic_context({"documents": ["văn bản"]}) != dispatcher._semantic_context(
+        {"documents": ["văn bản khác"]})
@@ -0,0 +1,67 @@
+"""Kiểm tra semantic cache: ngưỡng cosine theo intent, phân vùng, TTL, dùng trong dispatch"""
+import time
+
+from core_ai.semantic_cache import SemanticCache, normalize_vector
+
+
+def test_threshold_per_intent():
+    cache = SemanticCache({"thresholds": {"chat": 0.8, "coding": 0.99}})
+    cache.add([1.0, 0.0], "chat", "vi", "trả lời chat", "m")
+    cache.add([1.0, 0.0], "coding", "vi", "trả lời code", "m")
+    close = [0.9, 0.3]           # cosine ~0.95
+    assert cache.lookup(close, "chat", "vi")['response'] == "trả lời chat"
+    assert cache.lookup(close, "coding", "vi") is None
+    assert cache.threshold_for("research") == cache.config['default_threshold']
+
+
+def test_returns_most_similar_entry_with_similarity():
+    cache = SemanticCache({"default_threshold": 0.5})
+    cache.add([1.0, 0.0, 0.0], "research", "vi", "A", "m1")
+    cache.add([0.7, 0.7, 0.0], "research", "vi", "B", "m2")
+    hit = cache.lookup([0.6, 0.8, 0.0], "research", "vi")
+    assert (hit['response'], hit['model']) == ("B", "m2")
+    assert 0.98 < hit['similarity'] <= 1.0
+
+
+def test_partitioned_by_language_and_ignores_other_dimensions():
+    cache = SemanticCache()
+    cache.add([1.0, 0.0], "chat", "vi", "xin chào", "m")
+    assert cache.lookup([1.0, 0.0], "chat", "en") is None
+    assert cache.lookup([1.0, 0.0, 0.0], "chat", "vi") is None
+    assert cache.stats() == {"hits": 0, "misses": 2, "size": 1}
+
+
+def test_ttl_and_max_entries():
+    cache = SemanticCache({"ttl_seconds": 0.05, "max_entries": 2})
+    cache.add([1.0, 0.0], "chat", "vi", "cũ", "m")
+    time.sleep(0.06)
+    assert cache.lookup([1.0, 0.0], "chat", "vi") is None
+
+    cache = SemanticCache({"max_entries": 2})
+    for i, vector in enumerate(([1.0, 0.0], [0.0, 1.0], [-1.0, 0.0])):
+        cache.add(vector, "chat", "vi", str(i), "m")
+    assert cache.stats()['size'] == 2
+    assert cache.lookup([1.0, 0.0], "chat", "vi") is None     # Entry cũ nhất bị loại
+    assert cache.lookup([-1.0, 0.0], "chat", "vi")['response'] == "2"
+
+
+def test_normalize_vector():
+    assert normalize_vector([3.0, 4.0]) == [0.6, 0.8]
+    assert normalize_vector([0.0, 0.0]) == [0.0, 0.0]
+
+
+def test_dispatch_answers_paraphrase_from_semantic_cache(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False},
+                                             "semantic_cache": {"thresholds": {"chat": 0.8}}})
+    assert dispatcher.embedding_model == "nomic-embed-text"
+    plan = {"intent": "chat", "llm_type": "chat", "language": "vi",
+            "user_input": "giải thích bộ nhớ đệm trong hệ thống máy tính hiện đại"}
+    first = dispatcher.dispatch(dict(plan))
+    assert first['mode'] == 'real'
+
+    paraphrase = dispatcher.dispatch(dict(plan, user_input="giải thích giúp tôi bộ nhớ đệm trong hệ thống máy tính hiện đại"))
+    assert paraphrase['mode'] == 'semantic_cache'
+    assert paraphrase['response'] == first['response'] and paraphrase['similarity'] >= 0.8
+
+    other = dispatcher.dispatch(dict(plan, user_input="công thức nấu phở bò"))
+    assert other['mode'] == 'real'
@@ -0,0 +1,74 @@
+"""Kiểm tra session hội thoại: lịch sử giữ prefix ổn định, giới hạn, lượt sau gửi qua /api/chat"""
+import time
+
+from core_ai.session_store import SessionStore
+
+
+def test_messages_keep_history_in_order():
+    session = SessionStore().get("s1")
+    assert not session.has_history
+    session.add_turn("câu 1", "trả lời 1")
+    session.add_turn("câu 2", "trả lời 2")
+    messages = session.build_messages("hệ thống", "câu 3")
+    assert [m['role'] for m in messages] == ["system", "user", "assistant", "user", "assistant", "user"]
+    assert [m['content'] for m in messages[1:]] == ["câu 1", "trả lời 1", "câu 2", "trả lời 2", "câu 3"]
+
+
+def test_history_token_budget_keeps_latest_turns():
+    session = SessionStore().get("s1")
+    session.add_turn("cũ " * 200, "cũ " * 200)
+    session.add_turn("mới", "mới")
+    messages = session.build_messages("hệ thống", "câu hỏi", history_tokens=20)
+    assert [m['content'] for m in messages[1:]] == ["mới", "mới", "câu hỏi"]
+
+
+def test_turn_and_char_limits_drop_oldest():
+    store = SessionStore({"max_turns": 2, "max_history_chars": 30})
+    session = store.get("s1")
+    for i in range(3):
+        session.add_turn(f"câu {i}", f"trả lời {i}")
+    assert [q for q, _ in session.turns] == ["câu 1", "câu 2"]
+    session.add_turn("x" * 40, "y")              # Lượt mới dài vẫn được giữ
+    assert [q for q, _ in session.turns] == ["x" * 40]
+
+
+def test_store_eviction_ttl_and_disabled():
+    store = SessionStore({"max_sessions": 2, "ttl_seconds": 0.05})
+    first = store.get("a")
+    first.add_turn("q", "a")
+    assert store.get("a") is first
+    store.get("b")
+    store.get("c")
+    assert store.stats() == {"sessions": 2}      # "a" cũ nhất bị loại
+    assert not store.get("a").has_history
+
+    expiring = store.get("d")
+    expiring.add_turn("q", "a")
+    time.sleep(0.06)
+    assert store.get("d") is not expiring      # Hết hạn: bắt đầu session mới
+    assert SessionStore({"enabled": False}).get("a") is None
+    assert store.get(None) is None
+
+
+def test_second_turn_goes_through_chat_messages(make_dispatcher, monkeypatch):
+    dispatcher = make_dispatcher(dispatcher={"tiered": {"enabled": False}})
+    sent = []
+    generate_request = dispatcher.provider.generate_request
+
+    def recording(payload):
+        path, body = generate_request(payload)
+        sent.append((path, body))
+        return path, body
+
+    monkeypatch.setattr(dispatcher.provider, 'generate_request', recording)
+    plan = {"intent": "chat", "llm_type": "chat", "language": "vi", "session_id": "phiên-1"}
+    first = dispatcher.dispatch(dict(plan, user_input="bộ nhớ đệm là gì"))
+    second = dispatcher.dispatch(dict(plan, user_input="cho ví dụ"))
+    assert (first['mode'], second['mode']) == ('real', 'real')
+
+    path, body = sent[-1]
+    assert path == "/api/chat"
+    contents = [m['content'] for m in body['messages']]
+    assert contents[2] == first['response'] and "cho ví dụ" in contents[-1]
+    assert [m['role'] for m in body['messages']] == ["system", "user", "assistant", "user"]
+    assert second['sessions'] == {"sessions": 1}
@@ -0,0 +1,93 @@
+"""Kiểm tra backend SQLite: chuyển dữ liệu từ JSON, upsert, gộp short-term, knowledge"""
+import threading
+
+from memory.storage import JSONFileStorage, SQLiteStorage, create_storage
+
+
+def _entry(key_hash, category="fact", access_count=1, text="nội dung"):
+    return {"key": f"khóa {key_hash}", "key_hash": key_hash, "data": {"text": text}, "category": category,
+            "created_at": "2024-01-01T00:00:00", "last_accessed": "2024-01-01T00:00:00",
+            "access_count": access_count}
+
+
+def test_migrates_json_files_once(tmp_path):
+    legacy = JSONFileStorage(tmp_path)
+    legacy.merge_short_term("phiên", {"_last_updated": "2024-01-02T00:00:00", "topic": "phở"})
+    legacy.put_long_term(_entry("h1"))
+    legacy.put_long_term(_entry("h2", category="preference"))
+    legacy.put_document({"id": "doc1", "content": "văn bản", "metadata": {"lang": "vi"},
+                         "created_at": "2024-01-03T00:00:00", "type": "txt", "source": "tệp"})
+    legacy.put_knowledge("thủ đô", {"value": "Hà Nội"})
+
+    storage = create_storage(tmp_path)
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.counts() == {"short_term": 1, "long_term": 2, "documents": 1, "knowledge": 1}
+    assert storage.get_short_term("phiên")['topic'] == "phở"
+    assert storage.get_long_term("h2")[0]['category'] == "preference"
+    assert storage.get_document("doc1")['metadata'] == {"lang": "vi"}
+    assert storage.get_knowledge("thủ đô")['data'] == {"value": "Hà Nội"}
+    storage.close()
+
+    # DB đã có dữ liệu: file JSON mới không được nhập lại
+    legacy.put_long_term(_entry("h3"))
+    storage = create_storage(tmp_path)
+    assert storage.counts()['long_term'] == 2
+    storage.close()
+
+
+def test_migration_can_be_disabled_and_json_backend_selected(tmp_path):
+    JSONFileStorage(tmp_path).put_long_term(_entry("h1"))
+    storage = create_storage(tmp_path, {"migrate_json": False})
+    assert storage.is_empty()
+    storage.close()
+    assert isinstance(create_storage(tmp_path, {"backend": "json"}), JSONFileStorage)
+
+
+def test_upserts_replace_rows(tmp_path):
+    storage = SQLiteStorage(tmp_path)
+    storage.put_long_term(_entry("h1"))
+    storage.put_long_term(_entry("h1", text="đã sửa", access_count=5))
+    entries = list(storage.iter_long_term("fact"))
+    assert len(entries) == 1 and entries[0]['data'] == {"text": "đã sửa"} and entries[0]['access_count'] == 5
+
+    storage.put_document({"id": "d", "content": "cũ"})
+    storage.put_document({"id": "d", "content": "mới"})
+    assert [doc['content'] for doc in storage.iter_documents()] == ["mới"]
+
+    storage.put_knowledge("k", {"v": 1})
+    storage.put_knowledge("k", {"v": 2})
+    assert [entry['data'] for entry in storage.iter_knowledge()] == [{"v": 2}]
+    storage.close()
+
+
+def test_record_access_accumulates_and_entries_keep_order(tmp_path):
+    storage = SQLiteStorage(tmp_path)
+    for key_hash in ("a", "b", "c"):
+        storage.put_long_term(_entry(key_hash))
+    storage.record_access([("fact", "a", "2024-05-01T00:00:00", 2), ("fact", "a", "2024-03-01T00:00:00", 1)])
+    entry = storage.get_long_term("a")[0]
+    assert entry['access_count'] == 4 and entry['last_accessed'] == "2024-05-01T00:00:00"
+
+    ids = [("fact", "c"), ("fact", "không-có"), ("fact", "a")]
+    assert [e['key_hash'] for e in storage.get_long_term_entries(ids)] == ["c", "a"]
+    storage.close()
+
+
+def test_merge_short_term_from_many_threads(tmp_path):
+    storage = SQLiteStorage(tmp_path)
+    storage.merge_short_term("phiên", {"user": "an"})
+
+    def merge(i):
+        storage.merge_short_term("phiên", {f"k{i}": i})
+        storage.close()                          # Connection riêng của thread
+
+    threads = [threading.Thread(target=merge, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = storage.get_short_term("phiên")
+    assert merged == dict({"user": "an"}, **{f"k{i}": i for i in range(8)})
+    assert storage.get_short_term("khác") is None
+    storage.close()
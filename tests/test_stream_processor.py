@@ -0,0 +1,105 @@
+"""Hậu xử lý stream: kết quả theo chunk phải giống hệt khi xử lý cả chuỗi"""
+import random
+
+import pytest
+
+from core_ai.stream_processor import (EMPTY_RESPONSE_FALLBACK, ResponseStreamProcessor,
+                                      TruncationRepairStream, process_response,
+                                      repair_truncation, split_sentences)
+
+SAMPLES = [
+    "Xin chào! Đây là câu trả lời đầy đủ.",
+    "Đoạn một có nội dung.\n\nĐoạn hai khác.\n\nĐoạn một có nội dung.\n\nKết thúc.",
+    "Dòng lặp\nDòng lặp\nDòng lặp\nDòng khác.",
+    "```python\nx = 1\nx = 1\n```\nCode giữ nguyên dòng lặp trong block.",
+    "Câu đầu tiên khá dài để vượt ngưỡng độ dài tối thiểu. " * 3 + "Câu thứ hai! Và phần đuôi bị cắt ngang giữa",
+    "Mở đầu. Rồi một câu hỏi? Tiếp theo là đoạn dài không có dấu kết thúc " + "chữ " * 30,
+]
+
+
+def _feed_chunks(processor, text, rng):
+    out, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 12)
+        out.append(processor.feed(text[i:i + size]))
+        i += size
+    out.append(processor.finish())
+    return ''.join(out)
+
+
+def _baseline_truncation(response):
+    """Quy tắc gốc của _post_process_response trước khi chuyển sang stream"""
+    endings = ['.', '!', '?']
+    last_char = response.strip()[-1] if response.strip() else ''
+    if last_char not in endings and len(response) > 100:
+        for end_marker in ['.', '!', '?', '\n\n']:
+            end_pos = response.rfind(end_marker)
+            if end_pos > len(response) * 0.7:
+                return response[:end_pos + 1]
+    return response
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_chunked_matches_whole_string(text):
+    rng = random.Random(7)
+    expected = process_response(text)
+    for _ in range(20):
+        assert _feed_chunks(ResponseStreamProcessor(), text.strip(), rng).strip() == expected
+
+
+def test_truncation_matches_original_rule():
+    rng = random.Random(1)
+    for _ in range(3000):
+        text = ''.join(rng.choice('ab  c.!?\n\n') for _ in range(rng.randint(1, 220))).strip()
+        if not text:
+            continue
+        expected = _baseline_truncation(text)
+        assert repair_truncation(text) == expected
+        assert _feed_chunks(TruncationRepairStream(), text, rng) == expected
+
+
+def test_truncation_uses_marker_order_not_latest_boundary():
+    # '.' cuối nằm trong 30% cuối nên là chỗ cắt, dù '!' xuất hiện muộn hơn
+    text = "x" * 100 + ". yy! đuôi dở dang"
+    assert repair_truncation(text) == "x" * 100 + "."
+
+
+def test_truncation_streams_safe_prefix_early():
+    repair = TruncationRepairStream()
+    assert repair.feed("Một câu. ") == "Một câu."
+    assert repair.feed("Hai câu! và tiếp ") == " Hai câu! và tiếp "
+
+
+def test_held_tail_kept_as_chunks_not_recopied():
+    # Dấu '.' ở vị trí 1000 còn có thể là chỗ cắt tới khi dài ~1430 ký tự:
+    # phần sau nó được giữ dưới dạng các chunk gốc, không nối lại mỗi lần feed
+    repair = TruncationRepairStream()
+    assert repair.feed("x" * 1000 + ".") == "x" * 1000 + "."
+    chunks = [f"{i % 10}" for i in range(300)]
+    assert all(repair.feed(chunk) == "" for chunk in chunks)
+    assert len(repair._pending) == 300 and all(len(piece) == 1 for piece in repair._pending)
+    # Vượt ngưỡng: '.' không thể là chỗ cắt nữa, toàn bộ phần giữ được trả ra một lần
+    released = repair.feed("y" * 200)
+    assert released == "".join(chunks) + "y" * 200
+    assert not repair._pending and repair.finish() == ""
+
+
+def test_code_fence_counts_as_ending():
+    text = "Ví dụ code đầy đủ như sau. " * 5 + "\n```python\nprint(1)\n```"
+    assert repair_truncation(text) == text
+
+
+def test_empty_response_falls_back():
+    assert process_response("   ") == EMPTY_RESPONSE_FALLBACK
+
+
+def test_duplicate_paragraphs_and_lines_removed():
+    assert process_response(SAMPLES[1]) == "Đoạn một có nội dung.\n\nĐoạn hai khác.\n\nKết thúc."
+    assert process_response(SAMPLES[2]) == "Dòng lặp\nDòng khác."
+
+
+def test_sentences_follow_emitted_text():
+    processor = ResponseStreamProcessor()
+    processor.feed("Câu một. Câu hai? ")
+    processor.finish()
+    assert processor.sentences == split_sentences("Câu một. Câu hai?") == ["Câu một.", "Câu hai?"]
@@ -0,0 +1,172 @@
+"""Kiểm tra JSON tăng dần: lỗi phải bị phát hiện ngay ở ký tự sai, theo chunk hay cả chuỗi"""
+import json
+import random
+
+import pytest
+
+from core_ai.structured_output import JSONStreamValidator, StructuredOutputError, validate_schema
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "goal": {"type": "string"},
+        "steps": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+        "estimate": {"type": "number"}
+    },
+    "required": ["steps"],
+    "additionalProperties": False
+}
+
+VALID_DOCUMENTS = [
+    '{"goal": "Học Python", "steps": ["cài đặt", "viết \\"hello\\""], "estimate": 2.5e1}',
+    '[1, -0.5, 3E+2, true, false, null, {"a": [ ]}, "x\\u00e9\\n\\\\"]',
+    '  {"nested": {"deep": [[], {}], "empty": ""}}  ',
+    '"chuỗi đơn"',
+    '-12',
+]
+
+
+def _feed(validator, text, rng=None):
+    if rng is None:
+        validator.feed(text)
+        return
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 5)
+        validator.feed(text[i:i + size])
+        i += size
+
+
+def _fails_at(text, schema=None):
+    """Số ký tự đã nhận khi validator báo lỗi (None nếu không lỗi lúc feed)"""
+    validator = JSONStreamValidator(schema)
+    for position, ch in enumerate(text):
+        try:
+            validator.feed(ch)
+        except StructuredOutputError:
+            return position
+    return None
+
+
+@pytest.mark.parametrize("text", VALID_DOCUMENTS)
+def test_chunked_matches_whole_string(text):
+    rng = random.Random(3)
+    whole = JSONStreamValidator()
+    _feed(whole, text)
+    assert whole.finish() == json.loads(text)
+    for _ in range(20):
+        chunked = JSONStreamValidator()
+        _feed(chunked, text, rng)
+        assert chunked.finish() == json.loads(text)
+        assert chunked.text == text
+
+
+def test_schema_document_parses():
+    validator = JSONStreamValidator(PLAN_SCHEMA)
+    _feed(validator, VALID_DOCUMENTS[0], random.Random(0))
+    assert validator.finish()["steps"] == ["cài đặt", 'viết "hello"']
+
+
+@pytest.mark.parametrize("text, position", [
+    ('Đây là JSON: {}', 0),               # Văn bản trước JSON
+    ('{"a" 1}', 5),                       # Thiếu dấu ':'
+    ('{a: 1}', 1),                        # Key không có ngoặc kép
+    ('{"a": tru }', 9),                   # Literal sai
+    ('{"a": 1} {"b": 2}', 9),             # Dư ký tự sau JSON
+    ('[1 2]', 3),                         # Thiếu dấu ','
+])
+def test_invalid_prefix_rejected_at_first_bad_char(text, position):
+    assert _fails_at(text) == position
+
+
+def test_schema_type_mismatch_rejected_before_value_ends():
+    # 'steps' phải là mảng: lỗi ngay khi gặp ngoặc kép mở chuỗi
+    text = '{"steps": "một bước duy nhất"}'
+    assert _fails_at(text, PLAN_SCHEMA) == text.index('"một')
+
+
+def test_unknown_property_rejected_when_key_closes():
+    text = '{"steps": ["a"], "extra": 1}'
+    assert _fails_at(text, PLAN_SCHEMA) == text.index('": 1')
+
+
+@pytest.mark.parametrize("text", ['{"a": 1,}', '[1, 2,]', '{"a": [1,],}', '[,]'])
+def test_trailing_comma_rejected(text):
+    with pytest.raises(StructuredOutputError):
+        JSONStreamValidator().feed(text)
+
+
+@pytest.mark.parametrize("text", ['"\\x"', '"\\u12g4"', '"xuống\ndòng"', '"tab\there"'])
+def test_invalid_escape_or_control_char_rejected(text):
+    with pytest.raises(StructuredOutputError):
+        JSONStreamValidator().feed(text)
+
+
+def test_escaped_quote_does_not_end_string():
+    validator = JSONStreamValidator()
+    validator.feed('{"a": "x\\"')
+    validator.feed(', b: 1}"}')
+    assert validator.finish() == {"a": 'x", b: 1}'}
+
+
+@pytest.mark.parametrize("text", ['[01]', '[1.]', '[-]', '[1e]'])
+def test_invalid_number_rejected(text):
+    with pytest.raises(StructuredOutputError):
+        validator = JSONStreamValidator()
+        validator.feed(text)
+        validator.finish()
+
+
+@pytest.mark.parametrize("text", ['{"steps": ["a"]', '[1, 2', '"mở', '', '   '])
+def test_incomplete_document_rejected_on_finish(text):
+    validator = JSONStreamValidator()
+    validator.feed(text)
+    with pytest.raises(StructuredOutputError):
+        validator.finish()
+
+
+def test_schema_rules_checked_on_finish():
+    for text in ('{"goal": "x"}', '{"steps": []}'):
+        validator = JSONStreamValidator(PLAN_SCHEMA)
+        validator.feed(text)
+        with pytest.raises(StructuredOutputError):
+            validator.finish()
+
+
+def test_validate_schema_enum_and_integer():
+    validate_schema({"level": 2}, {"properties": {"level": {"type": "number", "enum": [1, 2]}}})
+    with pytest.raises(StructuredOutputError):
+        validate_schema({"level": 3}, {"properties": {"level": {"enum": [1, 2]}}})
+
+
+def test_escaped_keys_decoded_for_schema_checks():
+    schema = {
+        "type": "object",
+        "properties": {"tên": {"type": "string"}, "a\nb": {"type": "integer"}, "😀": {"type": "boolean"}},
+        "required": ["tên", "a\nb", "😀"],
+        "additionalProperties": False
+    }
+    text = '{"t\\u00ean": "x", "a\\nb": 1, "\\ud83d\\ude00": true}'
+    for rng in (None, random.Random(5)):
+        validator = JSONStreamValidator(schema)
+        _feed(validator, text, rng)
+        assert validator.finish() == {"tên": "x", "a\nb": 1, "😀": True}
+    # Key escape khác tên trong schema vẫn bị từ chối ngay khi đóng key
+    assert _fails_at('{"t\\u00e9n": "x"}', schema) == len('{"t\\u00e9n"') - 1
+
+
+@pytest.mark.parametrize("number", ["1.5", "2e3", "-0.0", "1E+2"])
+def test_integer_rejects_fraction_and_exponent(number):
+    schema = {"type": "object", "properties": {"count": {"type": "integer"}}}
+    text = '{"count": ' + number + '}'
+    assert _fails_at(text, schema) == len(text) - 1
+    with pytest.raises(StructuredOutputError):
+        validate_schema({"count": json.loads(number)}, schema)
+
+
+def test_integer_and_number_accepted():
+    schema = {"type": "object", "properties": {"count": {"type": "integer"}, "ratio": {"type": "number"}}}
+    validator = JSONStreamValidator(schema)
+    validator.feed('{"count": -12, "ratio": 3}')
+    assert validator.finish() == {"count": -12, "ratio": 3}
+    validate_schema(2.5, {"type": ["integer", "number"]})
@@ -0,0 +1,82 @@
+"""Chạy toàn pipeline dispatch trên stub LLM server (không cần Ollama / model thật)"""
+from core_ai.llm_dispatcher import LLMDispatcher
+from core_ai.stub_server import StubLLMServer
+
+PLAN = {"intent": "chat", "llm_type": "chat", "language": "vi",
+        "user_input": "Giải thích ngắn gọn bộ nhớ đệm là gì"}
+
+# Tắt các tầng có thể trả lời thay model chính để test nhìn thấy đúng một lần gọi
+PLAIN = {"tiered": {"enabled": False}, "semantic_cache": {"enabled": False}}
+
+
+def test_models_detected_from_stub(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=PLAIN)
+    assert not dispatcher.use_mock
+    assert "qwen2.5:14b" in dispatcher.available_models
+
+
+def test_dispatch_returns_stub_response_then_cache(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=PLAIN)
+    first = dispatcher.dispatch(dict(PLAN))
+    assert first['mode'] == 'real'
+    assert first['model'] == dispatcher.model_priority['chat']
+    assert len(first['response'].split()) > 10
+
+    second = dispatcher.dispatch(dict(PLAN))
+    assert second['mode'] == 'cache'
+    assert second['response'] == first['response']
+
+
+def test_dispatch_stream_matches_dispatch(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=dict(PLAIN, response_cache={"enabled": False}))
+    events = list(dispatcher.dispatch_stream(dict(PLAN)))
+    chunks = [event['chunk'] for event in events if not event.get('done')]
+    final = events[-1]['result']
+    assert events[-1]['done'] and final['mode'] == 'real'
+    assert len(chunks) > 1
+    assert "".join(chunks) == final['response']
+    assert dispatcher.dispatch(dict(PLAN))['response'] == final['response']
+
+
+def test_dispatch_structured_returns_schema_shaped_json(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=PLAIN)
+    schema = {
+        "type": "object",
+        "properties": {
+            "steps": {"type": "array", "items": {"type": "string"}, "minItems": 2},
+            "priority": {"type": "integer"},
+            "mode": {"enum": ["fast", "careful"]}
+        },
+        "required": ["steps", "priority", "mode"],
+        "additionalProperties": False
+    }
+    result = dispatcher.dispatch_structured(dict(PLAN, llm_type="reasoning"), schema)
+    assert result['mode'] == 'structured'
+    data = result['data']
+    assert len(data['steps']) == 2 and isinstance(data['priority'], int) and data['mode'] in ("fast", "careful")
+
+    untyped = dispatcher.dispatch_structured(dict(PLAN))
+    assert isinstance(untyped['data'], dict)
+
+
+def test_openai_protocol(make_dispatcher):
+    dispatcher = make_dispatcher(ollama={"stub": {"protocol": "openai"}}, dispatcher=PLAIN)
+    assert not dispatcher.use_mock
+    assert dispatcher.dispatch(dict(PLAN))['mode'] == 'real'
+    assert dispatcher.dispatch_structured(dict(PLAN), {"type": "object", "properties": {
+        "answer": {"type": "string"}}, "required": ["answer"]})['data']['answer']
+
+
+def test_closed_stream_does_not_break_server():
+    server = StubLLMServer({"latency_ms": 0, "tokens_per_second": 200}).start()
+    try:
+        import requests
+        for _ in range(3):
+            response = requests.post(f"{server.base_url}/api/generate", stream=True,
+                                     json={"model": "llama3:8b", "prompt": "x"})
+            next(response.iter_lines())
+            response.close()
+        status = requests.get(f"{server.base_url}/api/tags").status_code
+        assert status == 200
+    finally:
+        server.stop()
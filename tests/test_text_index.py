@@ -0,0 +1,73 @@
+"""Kiểm tra chỉ mục ngược BM25 có xử lý dấu tiếng Việt"""
+from memory.text_index import InvertedIndex, fold_diacritics, index_terms, tokenize
+
+
+def _index(docs):
+    index = InvertedIndex()
+    for doc_id, text in docs.items():
+        index.add(doc_id, text)
+    return index
+
+
+def test_fold_diacritics():
+    assert fold_diacritics("Tiếng Việt ĐẸP") == "tieng viet dep"
+    assert fold_diacritics("đường") == "duong"
+
+
+def test_index_terms_keep_accented_and_folded_forms():
+    assert tokenize("Xin Chào!") == ["xin", "chào"]
+    assert index_terms("xin chào") == ["xin", "chao", "chào"]
+
+
+def test_unaccented_query_matches_accented_document():
+    index = _index({
+        "vn": "Lịch sử nước Việt Nam thời Lý",
+        "py": "Hướng dẫn lập trình Python",
+    })
+    assert [doc_id for doc_id, _ in index.search("lich su viet nam")] == ["vn"]
+    assert [doc_id for doc_id, _ in index.search("huong dan")] == ["py"]
+
+
+def test_accented_query_prefers_exact_diacritics():
+    index = _index({
+        "viet_nam": "người việt",
+        "viet_bai": "người viết",
+    })
+    results = index.search("việt")
+    assert [doc_id for doc_id, _ in results] == ["viet_nam", "viet_bai"]
+    assert results[0][1] > results[1][1] > 0
+    # Gõ không dấu thì hai tài liệu ngang nhau
+    unaccented = dict(index.search("viet"))
+    assert unaccented["viet_nam"] == unaccented["viet_bai"]
+
+
+def test_bm25_ranks_rare_and_frequent_terms():
+    index = _index({
+        "a": "mèo mèo mèo chó",
+        "b": "mèo chó",
+        "c": "chó chó",
+    })
+    assert index.search("mèo")[0][0] == "a"
+    # 'mèo' hiếm hơn 'chó' nên đóng góp nhiều điểm hơn
+    scores = dict(index.search("mèo chó"))
+    assert scores["b"] > scores["c"]
+
+
+def test_top_k_and_unknown_terms():
+    index = _index({str(i): f"tài liệu số {i}" for i in range(10)})
+    assert len(index.search("tài liệu", top_k=3)) == 3
+    assert len(index.search("tài liệu", top_k=None)) == 10
+    assert index.search("không có") == []
+    assert InvertedIndex().search("bất kỳ") == []
+
+
+def test_remove_and_replace_document():
+    index = _index({"x": "học máy", "y": "học sâu"})
+    index.remove("x")
+    assert "x" not in index and len(index) == 1
+    assert [doc_id for doc_id, _ in index.search("may")] == []
+    index.add("y", "thị giác máy tính")
+    assert [doc_id for doc_id, _ in index.search("sâu")] == []
+    assert [doc_id for doc_id, _ in index.search("may tinh")] == ["y"]
+    index.remove("không tồn tại")
+    assert len(index) == 1
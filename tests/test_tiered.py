@@ -0,0 +1,53 @@
+"""Kiểm tra tiered: model nhỏ trả lời trước, câu trả lời thiếu tự tin thì chuyển lên model lớn"""
+
+PLAN = {"intent": "chat", "llm_type": "chat", "language": "vi", "user_input": "bộ nhớ đệm là gì"}
+NO_CACHE = {"semantic_cache": {"enabled": False}, "response_cache": {"enabled": False},
+            "tiered": {"check_chars": 60}}
+
+
+def _final(events):
+    assert events[-1]['done']
+    return events[-1]['result']
+
+
+def test_small_model_answers_first(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    result = dispatcher.dispatch(dict(PLAN))
+    assert (result['mode'], result['model']) == ('real', 'qwen2.5:7b')
+    assert result['tiered'] == {"first_pass": 1, "escalated": 0}
+
+
+def test_uncertain_answer_escalates(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    small = dispatcher.dispatch(dict(PLAN))['response']
+    # Stub trả lời xác định: coi một từ trong câu trả lời của model nhỏ là dấu hiệu thiếu tự tin
+    dispatcher.tiered_config['uncertainty_markers'] = [small.split()[1].lower()]
+
+    result = dispatcher.dispatch(dict(PLAN))
+    assert (result['mode'], result['model']) == ('real', 'qwen2.5:14b')
+    assert result['tiered'] == {"first_pass": 1, "escalated": 1}
+
+
+def test_stream_checks_head_before_showing(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=NO_CACHE)
+    events = list(dispatcher.dispatch_stream(dict(PLAN)))
+    result = _final(events)
+    assert result['model'] == 'qwen2.5:7b'
+    first = events[0]
+    assert first['model'] == 'qwen2.5:7b' and len(first['chunk']) >= 60   # Đoạn đầu gửi một lần
+    assert ''.join(e['chunk'] for e in events) == result['response']
+
+    dispatcher.tiered_config['uncertainty_markers'] = [result['response'].split()[1].lower()]
+    events = list(dispatcher.dispatch_stream(dict(PLAN)))
+    result = _final(events)
+    assert result['model'] == 'qwen2.5:14b'
+    assert {e['model'] for e in events[:-1]} == {'qwen2.5:14b'}           # Không lộ chunk của model nhỏ
+    assert dispatcher.tier_stats == {"first_pass": 1, "escalated": 1}
+
+
+def test_long_or_other_plans_skip_first_pass(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher=dict(NO_CACHE, tiered={"max_input_chars": 20}))
+    result = dispatcher.dispatch(dict(PLAN, user_input="giải thích chi tiết cơ chế bộ nhớ đệm"))
+    assert result['model'] == 'qwen2.5:14b'
+    assert dispatcher._tier_model(dict(PLAN, llm_type="coding"), "deepseek-coder:6.7b") is None
+    assert dispatcher.tier_stats == {"first_pass": 0, "escalated": 0}
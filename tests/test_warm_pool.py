@@ -0,0 +1,119 @@
+"""Kiểm tra warm pool: keep_alive theo tỉ lệ sử dụng, nạp trước model kế tiếp, tắt preload khi nhiều host"""
+import threading
+
+from core_ai.stub_server import StubLLMServer
+from core_ai.warm_pool import WarmPoolManager
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeTransport:
+    """Giả lập /api/ps và ghi lại các request nạp trước"""
+
+    def __init__(self, resident=()):
+        self.resident = list(resident)
+        self.preloaded = []
+        self.preload_done = threading.Event()
+
+    def get(self, path, timeout=None):
+        assert path == "/api/ps"
+        return FakeResponse({"models": [{"name": name} for name in self.resident]})
+
+    def post(self, path, json=None, timeout=None):
+        assert path == "/api/generate" and 'prompt' not in json
+        self.preloaded.append(json)
+        self.preload_done.set()
+        return FakeResponse({})
+
+
+def _pool(transport, **config):
+    return WarmPoolManager(transport, dict({"history_size": 10, "hot_share": 0.5}, **config))
+
+
+def test_keep_alive_by_usage_share():
+    pool = _pool(FakeTransport())
+    for model in ("a", "a", "a", "b"):
+        pool.note_usage(model)
+    assert pool.keep_alive_for("a") == "30m"
+    assert pool.keep_alive_for("b") == "5m"
+    assert pool.snapshot()['usage'] == {"a": 3, "b": 1}
+    assert _pool(FakeTransport(), enabled=False).keep_alive_for("a") is None
+
+
+def test_predict_next_from_transitions():
+    pool = _pool(FakeTransport())
+    for model in ("a", "b", "a", "b", "a", "c"):
+        pool.note_usage(model)
+    next_model, probability = pool.predict_next("a")
+    assert next_model == "b" and abs(probability - 2 / 3) < 1e-9
+    assert pool.predict_next("c") is None
+
+
+def test_preload_with_free_slot_and_cooldown():
+    transport = FakeTransport()
+    pool = _pool(transport, max_loaded_models=2)
+    for model in ("a", "b", "a"):
+        pool.note_usage(model)
+    pool._maybe_preload("a")
+    assert [request['model'] for request in transport.preloaded] == ["b"]
+    assert transport.preloaded[0]['keep_alive'] == "5m"
+    pool._maybe_preload("a")                       # Trong thời gian cooldown
+    assert len(transport.preloaded) == 1
+
+
+def test_no_swap_unless_likely_or_already_resident():
+    transport = FakeTransport(resident=["a"])
+    pool = _pool(transport, max_loaded_models=1, swap_threshold=0.6)
+    for model in ("a", "b", "a", "c", "a"):
+        pool.note_usage(model)
+    pool._maybe_preload("a")                       # b chỉ 50%: không đẩy a ra khỏi bộ nhớ
+    assert transport.preloaded == []
+
+    transport.resident = ["b"]
+    pool = _pool(transport, max_loaded_models=2)
+    for model in ("a", "b"):
+        pool.note_usage(model)
+    pool._maybe_preload("a")
+    assert transport.preloaded == []               # b đã nằm sẵn trong bộ nhớ
+
+
+def test_after_request_preloads_in_background():
+    transport = FakeTransport()
+    pool = _pool(transport, max_loaded_models=2)
+    pool.note_usage("a")
+    pool.note_usage("b")
+    pool.after_request("a")
+    assert transport.preload_done.wait(2)
+    assert transport.preloaded[0]['model'] == "b"
+
+    transport = FakeTransport()
+    pool = _pool(transport, preload=False)
+    for model in ("a", "b", "a"):
+        pool.after_request(model)
+    assert pool.snapshot()['usage'] == {"a": 2, "b": 1} and transport.preloaded == []
+
+
+def test_dispatcher_sends_keep_alive(make_dispatcher):
+    dispatcher = make_dispatcher(dispatcher={"warm_pool": {"preload": False}})
+    model = dispatcher.model_priority['chat']
+    dispatcher.warm_pool.note_usage(model)
+    payload, _ = dispatcher._build_generate_request(model, "xin chào", "chat")
+    assert payload['keep_alive'] == "30m"
+
+
+def test_dispatcher_disables_preload_with_several_hosts(make_dispatcher, monkeypatch):
+    servers = [StubLLMServer({"latency_ms": 20}).start() for _ in range(2)]
+    try:
+        hosts = [server.base_url for server in servers]
+        dispatcher = make_dispatcher(ollama={"provider": "ollama", "base_url": hosts[0], "hosts": hosts})
+        assert dispatcher.warm_pool.enabled and not dispatcher.warm_pool.config['preload']
+    finally:
+        for server in servers:
+            server.stop()